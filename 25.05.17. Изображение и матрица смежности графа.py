@@ -3,232 +3,3931 @@
 # Добавление ребра - выделить две вершины и нажать e
 # Удаление вершины - выделить вершину и нажать d
 # Удаление ребра - выделить две вершины ребра и нажать r
-# Также доступно добавление контрольных точек на рёбра для их изгибания, выделение контрольной точки и нажатие r удаляет её
-# Нажатие "Показать матрицу" выводит матрицу смежности в виде списка списков
+# Также доступно добавление контрольных точек на рёбра для их изгибания (ребро проходит через них плавной кривой), выделение контрольной точки и нажатие r удаляет её
+# Нажатие "Показать матрицу" открывает таблицу матрицы смежности: рисуется только видимое окно, клик по ячейке подсвечивает ребро
+# File -> Print Matrix печатает матрицу списком списков (для больших графов — списки соседей, см. AdjacencyMatrix.DENSE_LIMIT_BYTES)
+# File -> Save Matrix: .json (компактный JSON), .npy (бит на ячейку), .npz (разреженная CSR), .txt (список рёбер)
+# File -> Import Graph: матрица .json, разреженная .npz, список рёбер .txt и GraphML; вершины без координат раскладываются сеткой
+# File -> Save Session / Open Session: .graphsession хранит вершины, рёбра, контрольные точки и вид; при открытии сразу рисуется видимая часть, остальное догружается
+# GraphModel работает без окна: пакетные правки из скриптов внутри with model.batch() дают одну перерисовку
+# Колесо мыши — масштаб, перетаскивание ПКМ/СКМ — сдвиг вида; при сильном отдалении подписи и контрольные точки скрываются
+# l — запуск и остановка авто-раскладки, p — закрепить/открепить выделенные вершины (раскладка их не двигает)
+# Shift + ЛКМ — рамка выделения (добавляет вершины к выделенным); перетаскивание вершины из выделенной группы двигает всю группу вместе с контрольными точками, d удаляет её
+# Analysis: кратчайший путь между двумя выделенными вершинами, компоненты, степени, циклы — считаются в отдельных процессах
+# F2 — профилирование с HUD (FPS, p50/p99 обработчиков, задержка событий), F3 — запись cProfile; File -> Save Profile: .json или .prof
+# Ctrl+Z / Ctrl+Y (Edit -> Undo/Redo) — отмена и повтор; правки пишутся в журнал автосохранения (~/.graph_editor/autosave), File -> Recover Autosave восстанавливает работу упавшего прошлого запуска (при обычном выходе журнал удаляется; второй запущенный редактор пишет в autosave-1)
 
+import gc
+import json
 import math
 import tkinter as tk
 from tkinter import filedialog
-import networkx as nx
-import json
+import numpy as np
+import atexit
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from itertools import chain
+
+# networkx, ElementTree, пул процессов и cProfile импортируются там, где нужны (to_networkx, read_graphml,
+# run_analysis, запись профиля): окно появляется без них, см. python benchmark.py startup
+
+# Форматы сохранения матрицы: расширение файла определяет способ записи (см. AdjacencyMatrix.save)
+MATRIX_FILETYPES = [("JSON files", "*.json"), ("Bit-packed matrix (NumPy)", "*.npy"),
+                    ("Sparse CSR (NumPy)", "*.npz"), ("Edge list", "*.txt")]
+
+class CellIndex:
+    """
+    Основа сеток PointGrid и SegmentGrid: непустые ячейки лежат в массиве кодов по возрастанию (cell_codes),
+    их элементы — подряд в items, границы — в cell_starts, так что ячейки одного столбца сетки идут подряд
+    и находятся двумя searchsorted, а на запись в ячейке уходит 4 байта.
+    Код ячейки — уровень << 58 | столбец << 29 | строка; у каждого уровня свой размер ячейки (level_size).
+    Элементы, которые поменялись или исчезли (touch), помечаются устаревшими в основной части, а их новые
+    записи при следующем запросе вставляются в небольшую отсортированную добавку, где ищутся так же, как
+    в основной. Запись добавки помнит эпоху элемента: если элемент тронули снова, старая запись перестаёт
+    совпадать с ней и отбрасывается при запросе. Добавка вливается в основную часть, когда дорастёт до её
+    восьмой доли, поэтому запрос стоит O(log n + найденного) при любом числе правок.
+    """
+    OFFSET = 1 << 28  # номер ячейки сдвигается в [1, 2^29), чтобы код помещался в int64
+    MASK = (1 << 29) - 1
+    LEVELS = 1
+    MIN_BUFFER = 4096
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cell_codes = np.zeros(0, dtype=np.int64)    # коды непустых ячеек по возрастанию
+        self.cell_starts = np.zeros(1, dtype=np.int64)   # границы ячеек в items, на одну больше ячеек
+        self.items = np.zeros(0, dtype=np.int32)
+        self.delta_codes = np.zeros(0, dtype=np.int64)   # записи (код ячейки, элемент), ещё не влитые в items
+        self.delta_items = np.zeros(0, dtype=np.int32)
+        self.delta_epochs = np.zeros(0, dtype=np.int32)  # эпоха элемента, когда запись попала в добавку
+        self.stale = np.zeros(0, dtype=bool)             # элемент -> его записи в items устарели
+        self.queued = np.zeros(0, dtype=bool)            # элемент ждёт в буфере
+        self.epoch = np.zeros(0, dtype=np.int32)         # элемент -> сколько раз его записи пересчитывались
+        self.buffer = np.zeros(64, dtype=np.int64)       # тронутые после последнего запроса, занято [0, buffered)
+        self.buffered = 0
+        self.dirty = False     # в items есть устаревшие записи
+        self.outdated = False  # в добавке есть записи прошлых эпох
+
+    def level_size(self, level):
+        return self.cell_size
+
+    def cell(self, value, size):
+        return min(max(int(value // size), 1 - self.OFFSET), self.OFFSET - 2) + self.OFFSET
+
+    def cells(self, values, sizes):
+        cells = np.clip(np.floor(values / sizes), 1 - self.OFFSET, self.OFFSET - 2)
+        return cells.astype(np.int64) + self.OFFSET
+
+    @staticmethod
+    def take_rows(array, rows):
+        # array[rows] для массива (n, 2) или (n, 4) float32 через одномерный вид по элементу на строку:
+        # выборка строк двумерного массива по номерам в NumPy в разы медленнее
+        wide = {8: np.float64, 16: np.complex128}[array.shape[1] * array.itemsize]
+        return array.view(wide).ravel()[rows].view(array.dtype).reshape(len(rows), array.shape[1])
+
+    def touch(self, items):
+        items = np.asarray(items, dtype=np.int64)
+        if not (items[1:] > items[:-1]).all():
+            items = np.unique(items)
+        if len(items) and items[-1] >= len(self.stale):
+            size = max(int(items[-1]) + 1, 2 * len(self.stale))
+            self.stale, self.queued, self.epoch = (np.concatenate([a, np.zeros(size - len(a), dtype=a.dtype)])
+                                                   for a in (self.stale, self.queued, self.epoch))
+        items = items[~self.queued[items]]
+        self.queued[items] = self.stale[items] = True
+        self.dirty |= len(items) > 0
+        end = self.buffered + len(items)
+        if end > len(self.buffer):
+            grown = np.zeros(max(end, 2 * len(self.buffer)), dtype=np.int64)
+            grown[:self.buffered] = self.buffer[:self.buffered]
+            self.buffer = grown
+        self.buffer[self.buffered:end] = items
+        self.buffered = end
+
+    def reset(self):
+        # Все записи выбрасываются; элементы заново попадут в сетку через touch
+        self.cell_codes, self.cell_starts, self.items = self.cell_codes[:0], self.cell_starts[:1], self.items[:0]
+        self.delta_codes, self.delta_items, self.delta_epochs = (a[:0] for a in (self.delta_codes, self.delta_items,
+                                                                                 self.delta_epochs))
+        self.stale[:] = self.queued[:] = False
+        self.buffered = 0
+        self.dirty = self.outdated = False
+
+    def update(self):
+        # Новые записи тронутых элементов — в добавку; прежние их записи там устаревают вместе с эпохой
+        if not self.buffered:
+            return
+        touched = self.buffer[:self.buffered]
+        self.queued[touched] = False
+        self.epoch[touched] += 1
+        self.outdated |= len(self.delta_items) > 0
+        self.buffered = 0
+        if len(self.buffer) > 2 * self.MIN_BUFFER:
+            self.buffer = np.zeros(64, dtype=np.int64)  # после загрузки большого графа буфер не держим
+        codes, items = self.entries(touched[self.live(touched)])
+        order = np.argsort(codes)
+        codes, items = codes[order], items[order].astype(np.int32)
+        at = np.searchsorted(self.delta_codes, codes)
+        self.delta_codes = np.insert(self.delta_codes, at, codes)
+        self.delta_items = np.insert(self.delta_items, at, items)
+        self.delta_epochs = np.insert(self.delta_epochs, at, self.epoch[items])
+        if len(self.delta_codes) > max(self.MIN_BUFFER, len(self.items) // 8):
+            self.merge()
+
+    def merge(self):
+        # Устаревшие записи выбрасываются, добавка вставляется на свои места по коду ячейки
+        # Коды записей восстанавливаются только на время слияния
+        keep = ~self.stale[self.items]
+        codes = np.repeat(self.cell_codes, np.diff(self.cell_starts))[keep]
+        self.items = self.items[keep]
+        keep = self.delta_epochs == self.epoch[self.delta_items]
+        at = np.searchsorted(codes, self.delta_codes[keep])
+        codes = np.insert(codes, at, self.delta_codes[keep])
+        self.items = np.insert(self.items, at, self.delta_items[keep])
+        starts = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        self.cell_codes = codes[np.concatenate([[0], starts])] if len(codes) else codes
+        self.cell_starts = np.concatenate([[0], starts, [len(codes)]]) if len(codes) else self.cell_starts[:1]
+        self.delta_codes, self.delta_items, self.delta_epochs = (a[:0] for a in (self.delta_codes, self.delta_items,
+                                                                                 self.delta_epochs))
+        self.stale[:] = False
+        self.dirty = self.outdated = False
+
+    def lookup(self, codes, x0, y0, x1, y1):
+        # Диапазоны [lo, hi) отсортированного массива кодов с ячейками всех уровней, задетых прямоугольником
+        found = []
+        bounds = np.searchsorted(codes, np.arange(self.LEVELS + 1, dtype=np.int64) << 58)
+        for level in np.flatnonzero(np.diff(bounds)).tolist():
+            size = self.level_size(level)
+            first, last = codes[bounds[level]], codes[bounds[level + 1] - 1]
+            cx0 = max(self.cell(x0, size), int(first >> 29) & self.MASK)
+            cx1 = min(self.cell(x1, size), int(last >> 29) & self.MASK)
+            if cx0 > cx1:
+                continue
+            columns = level << 58 | np.arange(cx0, cx1 + 1, dtype=np.int64) << 29
+            lo = np.searchsorted(codes, columns | self.cell(y0, size))
+            hi = np.searchsorted(codes, columns | self.cell(y1, size), "right")
+            found.append((lo, hi))
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return tuple(map(np.concatenate, zip(*found)))
+
+    @staticmethod
+    def positions(lo, hi):
+        counts = hi - lo
+        return np.arange(counts.sum()) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+
+    def candidates(self, x0, y0, x1, y1):
+        # Элементы основной части без устаревших и элементы добавки текущей эпохи
+        self.update()
+        lo, hi = self.lookup(self.cell_codes, x0, y0, x1, y1)
+        found = self.items[self.positions(self.cell_starts[lo], self.cell_starts[hi])]
+        if self.dirty:
+            found = found[~self.stale[found]]
+        if len(self.delta_codes):
+            at = self.positions(*self.lookup(self.delta_codes, x0, y0, x1, y1))
+            items = self.delta_items[at]
+            if self.outdated:
+                items = items[self.delta_epochs[at] == self.epoch[items]]
+            found = np.concatenate([found, items])
+        return found
+
+class PointGrid(CellIndex):
+    """
+    Сетка над слотами хранилища точек (вершины PointStore, контрольные точки EdgeStore): в ней лежат только
+    номера слотов, координаты и занятость слотов читаются из хранилища. Если хранилище уплотнилось и слоты
+    переехали (store.generation), сетка строится заново.
+    """
+    def __init__(self, store, cell_size=32):
+        super().__init__(cell_size)
+        self.store = store
+        self.generation = store.generation
+
+    def sync(self):
+        if self.generation != self.store.generation:
+            self.generation = self.store.generation
+            self.reset()
+            super().touch(self.store.active_slots())
+
+    def touch(self, slots):
+        self.sync()
+        super().touch(slots)
+
+    def candidates(self, x0, y0, x1, y1):
+        self.sync()
+        return super().candidates(x0, y0, x1, y1)
+
+    def live(self, slots):
+        return self.store.live(slots)
+
+    def entries(self, slots):
+        cells = self.cells(self.take_rows(self.store.coords, slots).astype(np.float64), self.cell_size)
+        return cells[:, 0] << 29 | cells[:, 1], slots
+
+    def nearest(self, x, y, radius):
+        slots = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        if not len(slots):
+            return None
+        dist = ((self.take_rows(self.store.coords, slots).astype(np.float64) - (x, y)) ** 2).sum(axis=1)
+        best = int(dist.argmin())
+        return int(slots[best]) if dist[best] <= radius ** 2 else None
+
+    def query_rect(self, x0, y0, x1, y1):
+        slots = self.candidates(x0, y0, x1, y1)
+        coords = self.take_rows(self.store.coords, slots).astype(np.float64)
+        inside = ((coords[:, 0] >= x0) & (coords[:, 0] <= x1) & (coords[:, 1] >= y0) & (coords[:, 1] <= y1))
+        return slots[inside]
+
+class SegmentGrid(CellIndex):
+    """
+    Индекс отрезков ломаных (путей рёбер) по многоуровневой сетке. Ломаная хранится под целым номером
+    группы (запись EdgeStore), её отрезки — подряд идущими строками массива segs. Отрезок попадает на тот
+    уровень, где он занимает не больше LONG_CELLS ячеек по каждой оси (ячейка уровня L в 2^L раз крупнее
+    нулевого), и регистрируется в ячейках, через которые проходит: длинный отрезок не размазывается по сотням
+    мелких ячеек, а запрос просматривает по нескольку ячеек на каждом непустом уровне.
+    Новые пути (set_path) копятся в pending и раскладываются по сетке при следующем запросе: при перетаскивании
+    группы вершин путь ребра меняется каждый кадр, а нужен только для попадания мышью.
+    """
+    LEVELS = 20
+    LONG_CELLS = 16
+
+    def __init__(self, cell_size=64):
+        super().__init__(cell_size)
+        self.segs = np.zeros((64, 4), dtype=np.float32)      # строка -> (x1, y1, x2, y2)
+        self.row_group = np.full(64, -1, dtype=np.int32)     # строка -> группа, -1 — строка свободна
+        self.first = np.zeros(64, dtype=np.int64)            # группа -> первая строка её отрезков
+        self.count = np.zeros(64, dtype=np.int64)            # группа -> число отрезков
+        self.end = 0       # строки [0, end) уже выдавались
+        self.garbage = 0   # строк в брошенных блоках
+        self.pending = {}  # группа -> путь, ещё не разложенный по сетке
+
+    def level_size(self, level):
+        return self.cell_size * 2 ** level
+
+    def live(self, rows):
+        return self.row_group[rows] >= 0
+
+    def entries(self, rows):
+        # Записи для ячеек, через которые проходит каждый отрезок на своём уровне: перебираем столбцы,
+        # которые он задевает, и в каждом столбце — строки между его точками входа и выхода
+        seg = self.take_rows(self.segs, rows).astype(np.float64)
+        seg[seg[:, 0] > seg[:, 2]] = seg[seg[:, 0] > seg[:, 2]][:, [2, 3, 0, 1]]
+        x1, y1, x2, y2 = seg.T
+        extent = np.maximum(x2 - x1, np.abs(y2 - y1)) / (self.LONG_CELLS * self.cell_size)
+        with np.errstate(divide="ignore"):
+            levels = np.clip(np.ceil(np.log2(extent)), 0, self.LEVELS - 1).astype(np.int64)
+        sizes = self.cell_size * 2.0 ** levels
+        c0 = self.cells(x1, sizes)
+        columns = self.cells(x2, sizes) - c0 + 1
+        r = np.repeat(np.arange(len(rows)), columns)
+        cx = c0[r] + np.arange(len(r)) - np.repeat(np.cumsum(columns) - columns, columns)
+        size, dx = sizes[r], (x2 - x1)[r]
+        xa = np.maximum(x1[r], (cx - self.OFFSET) * size)
+        xb = np.minimum(x2[r], (cx - self.OFFSET + 1) * size)
+        slope = (y2 - y1)[r] / np.where(dx > 0, dx, 1)
+        ya = np.where(dx > 0, y1[r] + slope * (xa - x1[r]), y1[r])
+        yb = np.where(dx > 0, y1[r] + slope * (xb - x1[r]), y2[r])
+        cy0 = self.cells(np.minimum(ya, yb), size)
+        counts = self.cells(np.maximum(ya, yb), size) - cy0 + 1
+        cy = np.repeat(cy0, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(levels[r] << 58 | cx << 29, counts) | cy, np.repeat(rows[r], counts)
+
+    def set_path(self, group, path):
+        self.pending[group] = path
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        paths = [np.asarray(path, dtype=np.float64).reshape(-1, 2) for path in pending.values()]
+        points = np.concatenate(paths)
+        lengths = np.fromiter(map(len, paths), dtype=np.int64, count=len(paths))
+        starts = np.delete(np.arange(len(points)), np.cumsum(lengths) - 1)
+        self.put(np.fromiter(pending, dtype=np.int64, count=len(pending)),
+                 np.hstack([points[starts], points[starts + 1]]), lengths - 1)
+
+    def put(self, groups, segs, counts):
+        # Новые отрезки групп: counts[j] строк segs подряд на группу groups[j]; путь прежней длины
+        # переписывается на месте, остальные уходят в новый блок в конце массива
+        if not len(groups):
+            return
+        if groups.max() >= len(self.first):
+            size = max(int(groups.max()) + 1, 2 * len(self.first))
+            self.first, self.count = (np.concatenate([a, np.zeros(size - len(a), dtype=np.int64)])
+                                      for a in (self.first, self.count))
+        offsets = np.cumsum(counts) - counts
+        same = self.count[groups] == counts
+        rows = self.ranges(self.first[groups[same]], counts[same])
+        self.segs[rows] = segs[self.ranges(offsets[same], counts[same])]
+        self.touch(rows)
+        groups, counts, offsets = groups[~same], counts[~same], offsets[~same]
+        self.release(groups)
+        start = self.allocate(int(counts.sum()))
+        rows = np.arange(start, self.end)
+        self.segs[rows] = segs[self.ranges(offsets, counts)]
+        self.row_group[rows] = np.repeat(groups, counts)
+        self.first[groups], self.count[groups] = start + np.cumsum(counts) - counts, counts
+        self.touch(rows)
+
+    @staticmethod
+    def ranges(starts, counts):
+        return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+
+    def release(self, groups):
+        rows = self.ranges(self.first[groups], self.count[groups])
+        self.row_group[rows] = -1
+        self.garbage += len(rows)
+        self.count[groups] = 0
+        self.touch(rows)
+
+    def allocate(self, size):
+        if self.end + size > len(self.segs):
+            if self.garbage > self.end // 2:
+                self.compact()
+            if self.end + size > len(self.segs):
+                grown = max(2 * len(self.segs), self.end + size)
+                self.segs = np.concatenate([self.segs, np.zeros((grown - len(self.segs), 4), dtype=np.float32)])
+                self.row_group = np.concatenate([self.row_group,
+                                                 np.full(grown - len(self.row_group), -1, dtype=np.int32)])
+        start = self.end
+        self.end += size
+        return start
+
+    def compact(self):
+        # Строки живых групп переезжают подряд в начало массива; сетка строится заново при следующем запросе
+        live = np.flatnonzero(self.row_group[:self.end] >= 0)
+        position = np.cumsum(self.row_group[:self.end] >= 0) - 1
+        groups = np.flatnonzero(self.count)
+        self.first[groups] = position[self.first[groups]]
+        self.segs[:len(live)] = self.segs[live]
+        self.row_group[:len(live)] = self.row_group[live]
+        self.row_group[len(live):self.end] = -1
+        self.end, self.garbage = len(live), 0
+        self.reset()
+        self.touch(np.arange(self.end))
+
+    def add_lines(self, groups, segs):
+        # Много путей из одного отрезка сразу (рёбра без контрольных точек)
+        groups = np.asarray(groups, dtype=np.int64)
+        self.put(groups, np.asarray(segs, dtype=np.float64).reshape(-1, 4), np.ones(len(groups), dtype=np.int64))
+
+    def move_lines(self, groups, segs):
+        # Новое положение путей из одного отрезка (рёбра без контрольных точек при сдвиге группы вершин)
+        groups = np.asarray(groups, dtype=np.int64)
+        if self.pending:
+            for group in groups.tolist():
+                self.pending.pop(group, None)
+        self.add_lines(groups, segs)
+
+    def remove_path(self, group):
+        self.remove_paths([group])
+
+    def remove_paths(self, groups):
+        groups = np.asarray(groups, dtype=np.int64)
+        if self.pending:
+            for group in groups.tolist():
+                self.pending.pop(group, None)
+        self.release(groups[groups < len(self.count)])
+
+    def nearest(self, x, y, threshold):
+        # Возвращает ((group, i), проекция точки) для ближайшего отрезка не дальше threshold
+        self.flush()
+        rows = self.candidates(x - threshold, y - threshold, x + threshold, y + threshold)
+        # Длинные отрезки крупных ячеек почти все далеко: сначала в float32 отсекаются те, чья прямая или
+        # рамка дальше порога (с запасом на округление), точное расстояние считается для оставшихся
+        seg = self.take_rows(self.segs, rows)
+        x1, y1, x2, y2 = seg.T
+        dx, dy = x2 - x1, y2 - y1
+        cross = dx * (y - y1) - dy * (x - x1)
+        near = ((cross * cross <= (threshold + 1) ** 2 * (dx * dx + dy * dy)) &
+                (np.minimum(x1, x2) <= x + threshold) & (np.maximum(x1, x2) >= x - threshold) &
+                (np.minimum(y1, y2) <= y + threshold) & (np.maximum(y1, y2) >= y - threshold))
+        rows = rows[near]
+        if not len(rows):
+            return None
+        seg = seg[near].astype(np.float64)
+        a, d = seg[:, :2], seg[:, 2:] - seg[:, :2]
+        length = (d ** 2).sum(axis=1)
+        u = np.clip(((x - a[:, 0]) * d[:, 0] + (y - a[:, 1]) * d[:, 1]) / np.where(length > 0, length, 1), 0, 1)
+        proj = a + u[:, None] * d
+        dist = np.hypot(proj[:, 0] - x, proj[:, 1] - y)
+        best = int(dist.argmin())
+        if dist[best] > threshold:
+            return None
+        row = int(rows[best])
+        group = int(self.row_group[row])
+        return (group, row - int(self.first[group])), tuple(proj[best].tolist())
+
+    def query_rect(self, x0, y0, x1, y1):
+        # Группы, у которых какой-нибудь отрезок пересекает прямоугольник (отсечение Лианга — Барски)
+        self.flush()
+        rows = self.candidates(x0, y0, x1, y1)
+        seg = self.take_rows(self.segs, rows).astype(np.float64)
+        d = seg[:, 2:] - seg[:, :2]
+        t0, t1 = np.zeros(len(rows)), np.ones(len(rows))
+        hit = np.ones(len(rows), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for p, q in ((-d[:, 0], seg[:, 0] - x0), (d[:, 0], x1 - seg[:, 0]),
+                         (-d[:, 1], seg[:, 1] - y0), (d[:, 1], y1 - seg[:, 1])):
+                hit &= (p != 0) | (q >= 0)
+                t0 = np.where(p < 0, np.maximum(t0, q / p), t0)
+                t1 = np.where(p > 0, np.minimum(t1, q / p), t1)
+        return np.unique(self.row_group[rows[hit & (t0 <= t1)]])
+
+class AdjacencyMatrix:
+    """
+    Матрица смежности в разреженном виде (CSR): indptr — границы строк, indices — номера столбцов.
+    Строится по спискам соседей за O(V + E). Плотная матрица создаётся только по запросу и только
+    если занимает не больше DENSE_LIMIT_BYTES, иначе представление остаётся разреженным.
+    """
+    DENSE_LIMIT_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, nodes, adjacency, rows=None):
+        # nodes — порядок строк, adjacency — вершина -> её соседи (GraphModel.adjacency, nx.Graph.adj),
+        # rows — готовое отображение вершина -> строка, если оно уже есть (RowIndex.rows)
+        self.nodes = list(nodes)
+        row = rows if rows is not None else {node: i for i, node in enumerate(self.nodes)}
+        n = len(self.nodes)
+        degrees = np.fromiter((len(adjacency[node]) for node in self.nodes), dtype=np.int64, count=n)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degrees, out=self.indptr[1:])
+        self.indices = np.fromiter((row[other] for node in self.nodes for other in adjacency[node]),
+                                   dtype=np.int64, count=int(self.indptr[-1]))
+
+    @classmethod
+    def from_csr(cls, nodes, indptr, indices):
+        # Готовые массивы в номерах строк (NeighborStore.submatrix)
+        matrix = cls.__new__(cls)
+        matrix.nodes = nodes.tolist() if isinstance(nodes, np.ndarray) else list(nodes)
+        matrix.indptr, matrix.indices = indptr, indices
+        return matrix
+
+    @property
+    def size(self):
+        return len(self.nodes)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def to_coo(self):
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        return rows, self.indices
+
+    def dense_bytes(self, dtype=np.uint8):
+        return self.size * self.size * np.dtype(dtype).itemsize
+
+    def is_dense_allowed(self, dtype=np.uint8):
+        return self.dense_bytes(dtype) <= self.DENSE_LIMIT_BYTES
+
+    def to_dense(self, dtype=np.uint8, force=False):
+        if not force and not self.is_dense_allowed(dtype):
+            raise MemoryError(f"Плотная матрица {self.size}x{self.size} заняла бы {self.dense_bytes(dtype)} байт, "
+                              f"порог {self.DENSE_LIMIT_BYTES}")
+        dense = np.zeros((self.size, self.size), dtype=dtype)
+        dense[self.to_coo()] = 1
+        return dense
+
+    def dense_rows(self, dtype=np.uint8, progress=None):
+        # Плотные строки по одной: в памяти одновременно не больше одной строки.
+        # progress(сделано, всего) вызывается перед каждой строкой (см. MatrixJob.report)
+        row = np.zeros(self.size, dtype=dtype)
+        for i in range(self.size):
+            if progress is not None:
+                progress(i, self.size)
+            cols = self.row(i)
+            row[cols] = 1
+            yield row
+            row[cols] = 0
+
+    def save(self, file_path, progress=None):
+        ext = os.path.splitext(file_path)[1].lower()
+        try:
+            if ext == ".npy":
+                with open(file_path, "wb") as file:
+                    self.write_bits(file, progress)
+            elif ext == ".npz":
+                self.write_npz(file_path)
+            elif ext == ".txt":
+                with open(file_path, "w") as file:
+                    self.write_edge_list(file, progress=progress)
+            else:
+                with open(file_path, "wb") as file:
+                    self.write_json(file, progress)
+        except BaseException:
+            # Недописанный файл (ошибка или отмена) не оставляем
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+
+    def write_json(self, file, progress=None):
+        # Компактный JSON без отступов, по строке матрицы на строку файла
+        file.write(b"[")
+        text = np.full(max(2 * self.size - 1, 0), ord(","), dtype=np.uint8)
+        for i, row in enumerate(self.dense_rows(progress=progress)):
+            text[0::2] = row + ord("0")
+            file.write(b"[" + text.tobytes() + (b"],\n" if i < self.size - 1 else b"]"))
+        file.write(b"]\n")
+
+    def write_bits(self, file, progress=None):
+        # Матрица по биту на ячейку: .npy с массивом uint8 (size, ceil(size / 8)),
+        # открывается без чтения целиком через np.load(path, mmap_mode="r") и распаковывается np.unpackbits
+        np.lib.format.write_array_header_1_0(file, {"descr": "|u1", "fortran_order": False,
+                                                    "shape": (self.size, (self.size + 7) // 8)})
+        for row in self.dense_rows(progress=progress):
+            file.write(np.packbits(row).tobytes())
+
+    def write_npz(self, file_path):
+        # Разреженная матрица: массивы хранятся в архиве без сжатия, поэтому каждый можно отобразить в память
+        np.savez(file_path, nodes=np.array(self.nodes), indptr=self.indptr, indices=self.indices)
+
+    def write_edge_list(self, file, chunk=65536, progress=None):
+        # Список рёбер "u v" по идентификаторам вершин, каждое ребро один раз
+        nodes = np.array(self.nodes, dtype=object)
+        rows, cols = self.to_coo()
+        upper = rows <= cols
+        rows, cols = rows[upper], cols[upper]
+        for start in range(0, len(rows), chunk):
+            if progress is not None:
+                progress(start, len(rows))
+            pairs = zip(nodes[rows[start:start + chunk]], nodes[cols[start:start + chunk]])
+            file.write("".join(f"{u} {v}\n" for u, v in pairs))
+
+    def to_text(self, progress=None):
+        # То же, что str(), но построчно, с отчётом о прогрессе
+        if self.is_dense_allowed():
+            return "[" + ", ".join(str(row.tolist()) for row in self.dense_rows(progress=progress)) + "]"
+        lines = [f"Разреженная матрица {self.size}x{self.size}, ненулевых элементов: {self.nnz}"]
+        for i, node in enumerate(self.nodes):
+            if progress is not None:
+                progress(i, self.size)
+            lines.append(f"{node}: {[self.nodes[j] for j in self.row(i)]}")
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.to_text()
+
+class JobCancelled(Exception):
+    pass
+
+class MatrixJob:
+    """
+    Работа над снимком матрицы в фоновом потоке. Работа получает report(сделано, всего) и вызывает её
+    по ходу дела; report обновляет progress и бросает JobCancelled после cancel(). Результат и ошибку
+    редактор забирает из Tk-потока, опрашивая done через root.after, и тогда же вызывает on_done(result).
+    """
+    def __init__(self, title, work, on_done=None):
+        self.title = title
+        self.work = work
+        self.on_done = on_done
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            self.result = self.work(self.report)
+        except JobCancelled:
+            pass
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+    def report(self, done, total):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        self.progress = done / total if total else 1.0
+
+    def cancel(self):
+        self.cancelled.set()
+
+GRAPH_FILETYPES = [("Matrix JSON", "*.json"), ("Edge list", "*.txt *.edges *.csv"), ("GraphML", "*.graphml"),
+                   ("Sparse CSR (NumPy)", "*.npz")]
+
+def read_graph(file_path, progress=None):
+    """
+    Читает граф из файла, формат — по расширению (как у AdjacencyMatrix.save).
+    Возвращает (число вершин, координаты (n, 2) или None, рёбра (m, 2) по номерам вершин 0..n-1).
+    Файл читается кусками, в памяти одновременно кусок файла и уже собранные массивы рёбер.
+    progress(прочитано байт, всего байт) — как у MatrixJob.report.
+    Рёбра с концами вне 0..n-1 (например, у неквадратной матрицы) — ValueError.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".npz":
+        n, points, edges = read_npz(file_path)
+    else:
+        total = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            def chunks(size=1 << 20):
+                for data in iter(lambda: file.read(size), b""):
+                    if progress is not None:
+                        progress(file.tell(), total)
+                    yield data
+            reader = {".json": read_matrix_json, ".graphml": read_graphml}.get(ext, read_edge_list)
+            n, points, edges = reader(chunks())
+    outside = (edges < 0) | (edges >= n)
+    if outside.any():
+        raise ValueError(f"{os.path.basename(file_path)}: ребро ссылается на вершину {int(edges[outside][0])}, "
+                         f"а вершин {n}")
+    return n, points, edges
+
+def collect_edges(parts):
+    return np.concatenate(parts).reshape(-1, 2) if parts else np.zeros((0, 2), dtype=np.int64)
+
+def read_matrix_json(chunks):
+    # Матрица — список строк вида [0,1,...]; строка разбирается целиком в NumPy, как только пришла её ']'
+    parts, buf, i, outer = [], b"", 0, False
+    for data in chunks:
+        buf += data
+        pos = 0
+        if not outer:
+            pos = buf.find(b"[")
+            if pos < 0:
+                buf = b""
+                continue
+            pos, outer = pos + 1, True
+        while True:
+            start = buf.find(b"[", pos)
+            end = buf.find(b"]", start) if start >= 0 else -1
+            if end < 0:
+                break
+            row = buf[start + 1:end]
+            cols = np.flatnonzero(np.array(row.split(b","), dtype=np.float64)) if row.strip() else np.zeros(0, int)
+            parts.append(np.stack([np.full(len(cols), i), cols], axis=1).ravel())
+            i, pos = i + 1, end + 1
+        buf = buf[start if start >= 0 else len(buf):]
+    return i, None, collect_edges(parts)
+
+def read_edge_list(chunks):
+    # Строки "u v [что угодно дальше]", разделители — пробелы, табуляция или запятые; # и % — комментарии.
+    # Вершины нумеруются в порядке первого появления.
+    parts, rows, tail = [], {}, b""
+    for data in chunks:
+        lines = (tail + data).split(b"\n")
+        tail = lines.pop()
+        parts.append(parse_edge_lines(lines, rows))
+    parts.append(parse_edge_lines([tail], rows))
+    return len(rows), None, collect_edges(parts)
+
+def parse_edge_lines(lines, rows):
+    ends = []
+    for line in lines:
+        fields = line.replace(b",", b" ").split()
+        if len(fields) >= 2 and not fields[0].startswith((b"#", b"%")):
+            ends.append(fields[0])
+            ends.append(fields[1])
+    return np.array([rows.setdefault(label, len(rows)) for label in ends], dtype=np.int64)
+
+def read_graphml(chunks):
+    # Потоковый разбор XML: элементы удаляются сразу после обработки. Координаты — из ключей с именами x и y.
+    from xml.etree import ElementTree
+    parser = ElementTree.XMLPullParser(("end",))
+    rows, coords, ends, coord_keys = {}, {}, [], {}
+    def node_row(label):
+        return rows.setdefault(label, len(rows))
+    for data in chunks:
+        parser.feed(data)
+        for _, elem in parser.read_events():
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if tag == "key" and elem.get("attr.name") in ("x", "y"):
+                coord_keys[elem.get("id")] = elem.get("attr.name")
+            elif tag == "node":
+                point = {coord_keys[d.get("key")]: float(d.text) for d in elem
+                         if d.tag.rsplit("}", 1)[-1] == "data" and d.get("key") in coord_keys}
+                row = node_row(elem.get("id"))
+                if len(point) == 2:
+                    coords[row] = (point["x"], point["y"])
+            elif tag == "edge":
+                ends.append(node_row(elem.get("source")))
+                ends.append(node_row(elem.get("target")))
+            else:
+                continue
+            elem.clear()
+    points = None
+    if coords and len(coords) == len(rows):
+        points = np.array([coords[row] for row in range(len(rows))], dtype=np.float32)
+    return len(rows), points, np.array(ends, dtype=np.int64).reshape(-1, 2)
+
+def read_npz(file_path):
+    # Число вершин — по массиву nodes, который пишет AdjacencyMatrix.write_npz (строка i — вершина nodes[i]);
+    # у файлов без него — по indptr
+    with np.load(file_path) as data:
+        indptr, indices = data["indptr"], data["indices"]
+        n = len(data["nodes"]) if "nodes" in data else len(indptr) - 1
+    if len(indptr) != n + 1:
+        raise ValueError(f"{os.path.basename(file_path)}: строк в indptr {len(indptr) - 1}, а вершин в nodes {n}")
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    return n, None, np.stack([rows, indices], axis=1)
+
+SESSION_FILETYPES = [("Graph session", "*.graphsession")]
+
+class SessionFile:
+    """
+    Файл сессии редактора: вершины с номерами и координатами, закреплённые вершины, рёбра с контрольными
+    точками и вид. Массивы лежат в файле друг за другом, их смещения — в JSON-заголовке, поэтому открытие
+    только отображает файл в память (np.memmap). Вершины разбиты на куски: первый — видимые при сохранении,
+    остальные — по CHUNK_VERTICES в порядке удаления от центра вида. Ребро лежит в куске того из концов,
+    что загружается позже, поэтому куски добавляются в модель по одному, начиная с видимого.
+    """
+    MAGIC = b"GRAPHSESSION\x01"
+    ALIGN = 64
+    CHUNK_VERTICES = 50000
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f"{file_path}: не файл сессии")
+            header = json.loads(file.read(int.from_bytes(file.read(8), "little")))
+        self.meta = header["meta"]
+        self.arrays = {}
+        for name, (offset, dtype, shape) in header["arrays"].items():
+            # Пустой массив отобразить нельзя
+            self.arrays[name] = (np.memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=tuple(shape))
+                                 if np.prod(shape) else np.zeros(shape, dtype=dtype))
+
+    @property
+    def chunks(self):
+        return len(self.arrays["vertex_bounds"]) - 1
+
+    def chunk(self, k):
+        # Копии срезов k-го куска: вершины, координаты, закреплённость, рёбра, число точек у рёбер, точки
+        a = self.arrays
+        v0, v1 = a["vertex_bounds"][k:k + 2].tolist()
+        e0, e1 = a["edge_bounds"][k:k + 2].tolist()
+        c0, c1 = a["ctrl_bounds"][k:k + 2].tolist()
+        return (np.array(a["nodes"][v0:v1]), np.array(a["points"][v0:v1]), np.array(a["pinned"][v0:v1]),
+                np.array(a["edges"][e0:e1]), np.array(a["ctrl_counts"][e0:e1]), np.array(a["ctrl_points"][c0:c1]))
+
+    @classmethod
+    def save(cls, file_path, model, view_rect, meta):
+        # view_rect — видимая область в мировых координатах: её вершины попадают в первый кусок
+        cls.write(file_path, cls.collect(model, view_rect), meta)
+
+    @classmethod
+    def collect(cls, model, view_rect):
+        # Массивы файла — копии, а не виды на модель: write можно звать из другого потока, пока модель меняется
+        slots = model.vertices.active_slots()
+        nodes, points = model.vertices.slot_ids[slots], model.vertices.coords[slots]
+        x0, y0, x1, y1 = view_rect
+        inside = (points[:, 0] >= x0) & (points[:, 0] <= x1) & (points[:, 1] >= y0) & (points[:, 1] <= y1)
+        dist = ((points - ((x0 + x1) / 2, (y0 + y1) / 2)) ** 2).sum(axis=1)
+        dist[inside] = -1
+        order = np.argsort(dist, kind="stable")
+        nodes, points = nodes[order], points[order]
+        first = int(inside.sum())
+        vertex_bounds = np.unique(np.concatenate([[0, first], np.arange(first, len(nodes), cls.CHUNK_VERTICES),
+                                                  [len(nodes)]]))
+        chunk_of = np.zeros(int(nodes.max()) + 1 if len(nodes) else 0, dtype=np.int64)
+        chunk_of[nodes] = np.searchsorted(vertex_bounds, np.arange(len(nodes)), side="right") - 1
+        edges, records = model.edges.arrays()
+        edge_chunk = np.maximum(chunk_of[edges[:, 0]], chunk_of[edges[:, 1]])
+        order = np.argsort(edge_chunk, kind="stable")
+        edges, records = edges[order], records[order]
+        edge_bounds = np.searchsorted(edge_chunk[order], np.arange(len(vertex_bounds)))
+        ctrl_counts = records[:, 1].astype(np.int32)
+        ctrl_offsets = np.concatenate([[0], np.cumsum(ctrl_counts, dtype=np.int64)])
+        return {"nodes": nodes, "points": points, "pinned": np.isin(nodes, list(model.pinned)),
+                "edges": edges, "ctrl_counts": ctrl_counts,
+                "ctrl_points": model.edges.coords[model.edges.record_point_slots(records)],
+                "vertex_bounds": vertex_bounds, "edge_bounds": edge_bounds, "ctrl_bounds": ctrl_offsets[edge_bounds]}
+
+    @classmethod
+    def write(cls, file_path, arrays, meta, sync=False):
+        # sync — дождаться записи на диск (снимок автосохранения)
+        # Смещения массивов считаются от начала файла, поэтому длина заголовка нужна заранее: дописываем
+        # его пробелами до кратной ALIGN и пересчитываем, пока длина не перестанет меняться
+        header_size = 0
+        while True:
+            offset, index = len(cls.MAGIC) + 8 + header_size, {}
+            for name, array in arrays.items():
+                offset = -(-offset // cls.ALIGN) * cls.ALIGN
+                index[name] = [offset, array.dtype.str, list(array.shape)]
+                offset += array.nbytes
+            header = json.dumps({"meta": meta, "arrays": index}).encode()
+            if len(header) <= header_size:
+                break
+            header_size = -(-len(header) // cls.ALIGN) * cls.ALIGN
+        try:
+            with open(file_path, "wb") as file:
+                file.write(cls.MAGIC + header_size.to_bytes(8, "little") + header.ljust(header_size))
+                for name, array in arrays.items():
+                    file.write(b"\0" * (index[name][0] - file.tell()))
+                    file.write(np.ascontiguousarray(array).tobytes())
+                if sync:
+                    file.flush()
+                    os.fsync(file.fileno())
+        except BaseException:
+            # Недописанный файл не оставляем
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+
+# Анализ графа в отдельных процессах (GraphEditor.run_analysis). Каждая функция получает снимок
+# (число вершин n, массив рёбер (m, 2) по номерам строк) и возвращает результат тоже по номерам строк.
+
+def csr_from_edges(n, edges):
+    # Списки соседей в обе стороны: indptr, indices
+    ends = np.concatenate([edges, edges[:, ::-1]]) if len(edges) else np.zeros((0, 2), dtype=np.int64)
+    ends = ends[np.argsort(ends[:, 0], kind="stable")]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ends[:, 0], minlength=n), out=indptr[1:])
+    return indptr, ends[:, 1]
+
+def bfs_parents(indptr, indices, sources, target=-1):
+    # Обход в ширину фронтами: parent[v] — откуда пришли в v (у корней — сами корни), -1 — не достигнута
+    parent = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    depth = np.zeros(len(indptr) - 1, dtype=np.int64)
+    frontier = np.asarray(sources, dtype=np.int64)
+    parent[frontier] = frontier
+    level = 0
+    while len(frontier) and (target < 0 or parent[target] < 0):
+        starts, counts = indptr[frontier], indptr[frontier + 1] - indptr[frontier]
+        owners = np.repeat(frontier, counts)
+        nbrs = indices[np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+        new = parent[nbrs] < 0
+        frontier, first = np.unique(nbrs[new], return_index=True)
+        parent[frontier] = owners[new][first]
+        level += 1
+        depth[frontier] = level
+    return parent, depth
+
+def trace_path(parent, node):
+    path = [int(node)]
+    while parent[path[-1]] != path[-1]:
+        path.append(int(parent[path[-1]]))
+    return path
+
+def analyze_shortest_path(n, edges, source, target):
+    # Кратчайший по числу рёбер путь source -> target или None, если вершины в разных компонентах
+    indptr, indices = csr_from_edges(n, edges)
+    parent, _ = bfs_parents(indptr, indices, [source], target)
+    return trace_path(parent, target)[::-1] if parent[target] >= 0 else None
+
+def component_labels(n, edges):
+    # Подвешивание к меньшей метке и сжатие путей, пока метки концов всех рёбер не совпадут
+    labels = np.arange(n)
+    while len(edges):
+        lu, lv = labels[edges[:, 0]], labels[edges[:, 1]]
+        differ = lu != lv
+        if not differ.any():
+            break
+        np.minimum.at(labels, np.maximum(lu, lv)[differ], np.minimum(lu, lv)[differ])
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+    return labels
+
+def analyze_components(n, edges):
+    # Компоненты: метка компоненты для каждой строки, метки 0, 1, ... от больших компонент к меньшим
+    _, labels, sizes = np.unique(component_labels(n, edges), return_inverse=True, return_counts=True)
+    rank = np.empty(len(sizes), dtype=np.int64)
+    rank[np.argsort(-sizes, kind="stable")] = np.arange(len(sizes))
+    return rank[labels]
+
+def analyze_degrees(n, edges):
+    # Распределение степеней: histogram[d] — число вершин степени d
+    degrees = np.bincount(edges.ravel(), minlength=n)
+    return np.bincount(degrees)
+
+def analyze_cycles(n, edges):
+    # Цикломатическое число m - n + c и один цикл (строки вершин) или None для леса
+    labels = component_labels(n, edges)
+    rank = len(edges) - n + len(np.unique(labels))
+    if rank == 0:
+        return 0, None
+    loops = np.flatnonzero(edges[:, 0] == edges[:, 1])
+    if len(loops):
+        return rank, [int(edges[loops[0], 0])]
+    indptr, indices = csr_from_edges(n, edges)
+    parent, depth = bfs_parents(indptr, indices, np.flatnonzero(labels == np.arange(n)))
+    # Ребро не из дерева обхода замыкает цикл через общего предка его концов
+    u, v = edges[:, 0], edges[:, 1]
+    extra = np.flatnonzero((parent[u] != v) & (parent[v] != u))[0]
+    a, b = int(u[extra]), int(v[extra])
+    left, right = [a], [b]
+    while left[-1] != right[-1]:
+        if depth[left[-1]] >= depth[right[-1]]:
+            left.append(int(parent[left[-1]]))
+        else:
+            right.append(int(parent[right[-1]]))
+    return rank, left + right[-2::-1]
+
+def grid_layout(n, spacing=60, origin=(0, 0)):
+    # Начальная раскладка без координат: квадратная сетка в порядке номеров вершин
+    side = max(int(math.ceil(math.sqrt(n))), 1)
+    i = np.arange(n)
+    return np.stack([origin[0] + i % side * spacing, origin[1] + i // side * spacing], axis=1).astype(np.float32)
+
+def morton_codes(cx, cy):
+    # Чередование битов координат ячейки (до 16 бит на ось): у соседних по дереву ячеек общий префикс кода
+    def spread(v):
+        v = v & 0xFFFF
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        return (v | (v << 1)) & 0x55555555
+    return spread(cx) | (spread(cy) << 1)
+
+class ForceLayout:
+    """
+    Силовая раскладка (Фрухтерман — Рейнгольд) над массивами NumPy. Притяжение считается по всем рёбрам разом,
+    отталкивание — по квадродереву Барнса — Хата: ячейка, видная из вершины под углом меньше THETA,
+    действует как одна точка в своём центре масс, поэтому шаг стоит O(n log n). Закреплённые вершины
+    (fixed) не двигаются, но действуют на остальные. step() делает одну итерацию и остужает температуру.
+    """
+    THETA = 1.0
+    COOLING = 0.95
+    GRAVITY = 0.01
+
+    def __init__(self, points, edges, fixed=None, spacing=60):
+        self.pos = np.array(points, dtype=np.float64).reshape(-1, 2)
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.fixed = np.zeros(len(self.pos), dtype=bool) if fixed is None else np.asarray(fixed, dtype=bool)
+        self.k = spacing  # желаемая длина ребра
+        extent = np.ptp(self.pos, axis=0).max() if len(self.pos) else 0
+        self.temperature = max(extent / 10, spacing)
+        self.iterations = 0
+
+    def done(self):
+        return self.temperature < 0.5 or not len(self.pos)
+
+    def step(self):
+        force = self.repulsion()
+        if len(self.edges):
+            u, v = self.edges[:, 0], self.edges[:, 1]
+            d = self.pos[u] - self.pos[v]
+            pull = d * np.hypot(d[:, 0], d[:, 1])[:, None] / self.k
+            n = len(self.pos)
+            for axis in (0, 1):
+                force[:, axis] += np.bincount(v, pull[:, axis], n) - np.bincount(u, pull[:, axis], n)
+        force -= self.GRAVITY * (self.pos - self.pos.mean(axis=0))
+        # Смещение за шаг не больше температуры
+        length = np.maximum(np.hypot(force[:, 0], force[:, 1]), 1e-9)
+        move = force * (np.minimum(length, self.temperature) / length)[:, None]
+        move[self.fixed] = 0
+        self.pos += move
+        self.temperature *= self.COOLING
+        self.iterations += 1
+        return float(np.abs(move).max()) if len(move) else 0.0
+
+    def repulsion(self):
+        n = len(self.pos)
+        force = np.zeros((n, 2))
+        if n < 2:
+            return force
+        depth = int(min(max(math.ceil(math.log2(math.sqrt(n))) + 2, 1), 16))
+        lo = self.pos.min(axis=0)
+        size = max(np.ptp(self.pos, axis=0).max(), 1e-6) * (1 + 1e-9)
+        cells = np.minimum(((self.pos - lo) / size * (1 << depth)).astype(np.int64), (1 << depth) - 1)
+        codes = morton_codes(cells[:, 0], cells[:, 1])
+        order = np.argsort(codes, kind="stable")
+        codes, pos = codes[order], self.pos[order]
+        # Уровни дерева: у каждого — отсортированные коды непустых ячеек, их масса и центр масс,
+        # ячейка каждой вершины и диапазон детей на следующем уровне
+        levels = []
+        for level in range(depth + 1):
+            ids = codes >> (2 * (depth - level))
+            first = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            mass = np.diff(np.r_[first, n])
+            com = np.add.reduceat(pos, first, axis=0) / mass[:, None]
+            owner = np.repeat(np.arange(len(first)), mass)
+            levels.append((ids[first], mass, com, owner))
+        k2 = self.k * self.k
+        result = np.zeros((n, 2))
+        p = np.arange(n)
+        c = np.zeros(n, dtype=np.int64)
+        for level, (uniq, mass, com, owner) in enumerate(levels):
+            last = level == depth
+            d = pos[p] - com[c]
+            dist2 = (d ** 2).sum(axis=1)
+            own = owner[p] == c
+            width = size / (1 << level)
+            accept = ~own & ((width * width < self.THETA ** 2 * dist2) | last)
+            if last:
+                # Остальные вершины той же самой мелкой ячейки: центр масс без самой вершины
+                rest = own & (mass[c] > 1)
+                m = mass[c[rest]] - 1
+                d_rest = pos[p[rest]] - (com[c[rest]] * (m + 1)[:, None] - pos[p[rest]]) / m[:, None]
+                self.add_repulsion(result, p[rest], d_rest, m, k2)
+            self.add_repulsion(result, p[accept], d[accept], mass[c[accept]], k2)
+            if last:
+                break
+            keep = ~accept
+            p, c = p[keep], c[keep]
+            # Раскрываем оставшиеся пары (вершина, ячейка) в пары с детьми ячейки
+            child_ids = levels[level + 1][0]
+            start = np.searchsorted(child_ids, uniq[c] << 2)
+            count = np.searchsorted(child_ids, (uniq[c] << 2) + 4) - start
+            p = np.repeat(p, count)
+            offsets = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            c = np.repeat(start, count) + offsets
+        force[order] = result
+        return force
+
+    @staticmethod
+    def add_repulsion(result, p, d, mass, k2):
+        # Сила k² / расстояние вдоль d; совпавшие точки расталкиваем в случайную сторону
+        dist2 = (d ** 2).sum(axis=1)
+        close = dist2 < 1e-6
+        if close.any():
+            d = d.copy()
+            d[close] = np.random.uniform(-1e-3, 1e-3, (int(close.sum()), 2))
+            dist2 = np.maximum((d ** 2).sum(axis=1), 1e-9)
+        f = d * (k2 * mass / dist2)[:, None]
+        n = len(result)
+        result[:, 0] += np.bincount(p, f[:, 0], n)
+        result[:, 1] += np.bincount(p, f[:, 1], n)
+
+class PointStore(MutableMapping):
+    """
+    Координаты вершин в массиве float32: слот -> (x, y), плюс массивы id -> слот и слот -> id.
+    Освободившиеся слоты переиспользуются через список свободных. Снаружи выглядит как словарь id -> (x, y),
+    а bounding_box и translate работают сразу над всем массивом.
+    """
+    def __init__(self, capacity=64):
+        self.coords = np.zeros((capacity, 2), dtype=np.float32)
+        self.slot_ids = np.full(capacity, -1, dtype=np.int64)  # слот -> id, -1 — слот свободен
+        self.id_slots = np.full(capacity, -1, dtype=np.int64)  # id -> слот, -1 — нет такой вершины
+        self.free = []
+        self.used = 0   # слоты [0, used) уже выдавались
+        self.count = 0
+        self.generation = 0  # слоты вершин не переезжают (см. PointGrid)
+
+    def slot(self, node):
+        if isinstance(node, (int, np.integer)) and 0 <= node < len(self.id_slots):
+            slot = self.id_slots[node]
+            if slot >= 0:
+                return int(slot)
+        raise KeyError(node)
+
+    def slots(self, nodes):
+        # Слоты вершин массива nodes; KeyError, если какой-нибудь нет, как у slot
+        nodes = np.asarray(nodes if isinstance(nodes, np.ndarray) else list(nodes), dtype=np.int64)
+        present = self.present(nodes)
+        if not present.all():
+            raise KeyError(int(nodes[~present][0]))
+        return self.id_slots[nodes]
+
+    def present(self, nodes):
+        # Есть ли вершины массива nodes — без обхода всех вершин
+        nodes = np.asarray(nodes, dtype=np.int64)
+        inside = (nodes >= 0) & (nodes < len(self.id_slots))
+        return inside & (self.id_slots[np.where(inside, nodes, 0)] >= 0)
+
+    def __getitem__(self, node):
+        x, y = self.coords[self.slot(node)].tolist()
+        return x, y
+
+    def __setitem__(self, node, point):
+        try:
+            slot = self.slot(node)
+        except KeyError:
+            slot = self.allocate(node)
+        self.coords[slot] = point
+
+    def allocate(self, node):
+        if node < 0:
+            raise KeyError(node)
+        if node >= len(self.id_slots):
+            self.id_slots = np.concatenate([self.id_slots, np.full(max(node + 1, 2 * len(self.id_slots)) -
+                                                                   len(self.id_slots), -1, dtype=np.int64)])
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.used == len(self.coords):
+                self.coords = np.concatenate([self.coords, np.zeros_like(self.coords)])
+                self.slot_ids = np.concatenate([self.slot_ids, np.full(len(self.slot_ids), -1, dtype=np.int64)])
+            slot = self.used
+            self.used += 1
+        self.slot_ids[slot] = node
+        self.id_slots[node] = slot
+        self.count += 1
+        return slot
+
+    def __delitem__(self, node):
+        slot = self.slot(node)
+        self.slot_ids[slot] = -1
+        self.id_slots[node] = -1
+        self.free.append(slot)
+        self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+    def active_slots(self):
+        return np.flatnonzero(self.slot_ids[:self.used] >= 0)
+
+    def live(self, slots):
+        return self.slot_ids[slots] >= 0
+
+    def __iter__(self):
+        return iter(self.slot_ids[self.active_slots()].tolist())
+
+    def items(self):
+        slots = self.active_slots()
+        return zip(self.slot_ids[slots].tolist(), map(tuple, self.coords[slots].tolist()))
+
+    def values(self):
+        return map(tuple, self.coords[self.active_slots()].tolist())
+
+    def bounding_box(self):
+        coords = self.coords[self.active_slots()]
+        if not len(coords):
+            return None
+        (x0, y0), (x1, y1) = coords.min(axis=0).tolist(), coords.max(axis=0).tolist()
+        return x0, y0, x1, y1
+
+    def translate(self, nodes, dx, dy):
+        self.coords[self.slots(nodes)] += (dx, dy)
+
+    def extend(self, nodes, coords):
+        # Много новых вершин сразу: занимают слоты подряд после used, свободные слоты не трогаем
+        nodes = np.asarray(nodes, dtype=np.int64)
+        n = len(nodes)
+        if not n:
+            return
+        if nodes.max() >= len(self.id_slots):
+            grown = np.full(max(int(nodes.max()) + 1, 2 * len(self.id_slots)), -1, dtype=np.int64)
+            grown[:len(self.id_slots)] = self.id_slots
+            self.id_slots = grown
+        if self.used + n > len(self.coords):
+            size = max(self.used + n, 2 * len(self.coords))
+            coords_grown = np.zeros((size, 2), dtype=np.float32)
+            coords_grown[:self.used] = self.coords[:self.used]
+            slots_grown = np.full(size, -1, dtype=np.int64)
+            slots_grown[:self.used] = self.slot_ids[:self.used]
+            self.coords, self.slot_ids = coords_grown, slots_grown
+        slots = np.arange(self.used, self.used + n)
+        self.coords[slots] = coords
+        self.slot_ids[slots] = nodes
+        self.id_slots[nodes] = slots
+        self.used += n
+        self.count += n
+
+class CodeTable:
+    """
+    Хеш-таблица с открытой адресацией в массивах numpy: неотрицательный код int64 -> номер int32.
+    Ячейка keys равна -1, если пуста, и -2, если код из неё удалён; поиск идёт по ячейкам подряд от той, что
+    даёт хеш кода, до самого кода или пустой ячейки. Пакетные find и insert делают этот шаг сразу для всех кодов.
+    Когда занято больше двух третей ячеек (вместе с удалёнными), таблица перестраивается и заполнена не больше
+    чем наполовину.
+    """
+    EMPTY = -1
+    DELETED = -2
+    HASH = 0x9E3779B97F4A7C15  # мультипликативный хеш (Фибоначчи): номер ячейки — старшие биты произведения
+    MASK = (1 << 64) - 1
+
+    def __init__(self, capacity=64):
+        self.reset(capacity)
+
+    def reset(self, capacity):
+        self.keys = np.full(capacity, self.EMPTY, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.int32)
+        self.shift = 65 - capacity.bit_length()  # ёмкость — степень двойки
+        self.count = 0   # живых кодов
+        self.filled = 0  # занятых ячеек: живые и удалённые коды
+
+    def home(self, codes):
+        return ((codes.astype(np.uint64) * np.uint64(self.HASH)) >> np.uint64(self.shift)).astype(np.int64)
+
+    def cell(self, code):
+        # Ячейка кода или пустая ячейка, на которой кончился поиск
+        keys, mask = self.keys, len(self.keys) - 1
+        pos = ((code * self.HASH) & self.MASK) >> self.shift
+        while True:
+            key = keys.item(pos)
+            if key == code or key == self.EMPTY:
+                return pos
+            pos = (pos + 1) & mask
+
+    def get(self, code):
+        # Номер по коду, -1 — кода нет. Тот же проход, что в cell, без лишнего вызова: has_edge зовёт get часто
+        if code < 0:
+            return -1
+        keys, mask = self.keys, len(self.keys) - 1
+        pos = ((code * self.HASH) & self.MASK) >> self.shift
+        while True:
+            key = keys.item(pos)
+            if key == code:
+                return self.values.item(pos)
+            if key == self.EMPTY:
+                return -1
+            pos = (pos + 1) & mask
+
+    def find(self, codes):
+        # get для массива кодов
+        codes = np.asarray(codes, dtype=np.int64)
+        result = np.full(len(codes), -1, dtype=np.int64)
+        mask = len(self.keys) - 1
+        pending = np.flatnonzero(codes >= 0)
+        pos = self.home(codes[pending])
+        while len(pending):
+            keys = self.keys[pos]
+            hit = keys == codes[pending]
+            result[pending[hit]] = self.values[pos[hit]]
+            going = ~hit & (keys != self.EMPTY)
+            pending, pos = pending[going], (pos[going] + 1) & mask
+        return result
+
+    def insert(self, codes, values):
+        # Новые коды (их ещё нет в таблице, в массиве они не повторяются) с номерами values
+        codes = np.asarray(codes, dtype=np.int64)
+        self.reserve(len(codes))
+        self.place(codes, np.asarray(values, dtype=np.int64))
+
+    def place(self, codes, values):
+        # Каждый код встаёт в первую свободную ячейку от своей; из кодов, попавших в одну ячейку на одном шаге,
+        # её занимает первый, остальные идут дальше
+        mask = len(self.keys) - 1
+        pending, pos = np.arange(len(codes)), self.home(codes)
+        while len(pending):
+            keys = self.keys[pos]
+            free = np.flatnonzero(keys < 0)
+            cells, first = np.unique(pos[free], return_index=True)
+            taken = free[first]
+            self.filled += int(np.count_nonzero(keys[taken] == self.EMPTY))
+            self.keys[cells] = codes[pending[taken]]
+            self.values[cells] = values[pending[taken]]
+            going = np.ones(len(pending), dtype=bool)
+            going[taken] = False
+            pending, pos = pending[going], (pos[going] + 1) & mask
+        self.count += len(codes)
+
+    def insert_one(self, code, value):
+        self.reserve(1)
+        pos = self.cell(code)
+        if self.keys[pos] != self.EMPTY:
+            raise KeyError(code)
+        # Удалённую ячейку по пути к пустой можно занять: дальше этого кода в таблице нет
+        mask = len(self.keys) - 1
+        first = ((code * self.HASH) & self.MASK) >> self.shift
+        while self.keys[first] >= 0:
+            first = (first + 1) & mask
+        self.filled += int(self.keys[first] == self.EMPTY)
+        self.keys[first], self.values[first] = code, value
+        self.count += 1
+
+    def pop(self, code):
+        # Убирает код и возвращает его номер, -1 — кода нет
+        if code < 0:
+            return -1
+        pos = self.cell(code)
+        if self.keys[pos] != code:
+            return -1
+        self.keys[pos] = self.DELETED
+        self.count -= 1
+        return int(self.values[pos])
+
+    def reserve(self, n):
+        if 3 * (self.filled + n) > 2 * len(self.keys):
+            capacity = 64
+            while capacity < 2 * (self.count + n):
+                capacity *= 2
+            live = self.keys >= 0
+            codes, values = self.keys[live], self.values[live].astype(np.int64)
+            self.reset(capacity)
+            self.place(codes, values)
+
+class EdgeStore(MutableMapping):
+    """
+    Рёбра и их контрольные точки. Все точки лежат в одном массиве float32, у каждого ребра своя запись
+    [начало блока, число точек, ёмкость, u, v] в массиве records; таблица table ведёт от кода ребра
+    u << 32 | v к номеру записи, у свободной записи u = v = -1.
+    Номер записи не меняется, пока ребро существует, поэтому по нему ребро знают индексы (см. SegmentGrid).
+    Переполненный блок переезжает в конец массива, а когда мусора становится больше половины, массив
+    уплотняется. Снаружи выглядит как словарь ребро -> список точек; список — копия, менять точки нужно
+    методами insert_point/set_point/pop_point.
+    """
+    def __init__(self, capacity=256):
+        self.coords = np.zeros((capacity, 2), dtype=np.float32)
+        self.owner = np.full(capacity, -1, dtype=np.int64)  # строка coords -> запись, -1 — точки нет
+        self.table = CodeTable()  # код ребра -> номер записи
+        self.records = np.zeros((64, 5), dtype=np.int64)  # запись -> [начало, число точек, ёмкость, u, v]
+        self.free = []     # освободившиеся записи
+        self.used = 0      # записи [0, used) уже выдавались
+        self.end = 0       # граница занятой части массива точек
+        self.garbage = 0   # точек в брошенных блоках
+        self.generation = 0  # растёт при уплотнении, когда точки переезжают (см. PointGrid)
+
+    @staticmethod
+    def code(edge):
+        u, v = edge
+        return int(u) << 32 | int(v)
+
+    @staticmethod
+    def codes(edges):
+        edges = np.asarray(edges if isinstance(edges, np.ndarray) else list(edges), dtype=np.int64).reshape(-1, 2)
+        return edges[:, 0] << 32 | edges[:, 1]
+
+    def slot(self, edge):
+        slot = self.table.get(self.code(edge))
+        if slot < 0:
+            raise KeyError(edge)
+        return slot
+
+    def slots(self, edges):
+        # Номера записей рёбер; KeyError, если какого-нибудь нет, как у PointStore.slots
+        slots = self.find(edges)
+        if (slots < 0).any():
+            edges = np.asarray(edges if isinstance(edges, np.ndarray) else list(edges)).reshape(-1, 2)
+            raise KeyError(tuple(edges[np.argmax(slots < 0)].tolist()))
+        return slots
+
+    def find(self, edges):
+        # Номера записей рёбер, -1 — такого ребра нет
+        return self.table.find(self.codes(edges))
+
+    def record(self, edge):
+        start, count, capacity = self.records[self.slot(edge), :3].tolist()
+        return start, count, capacity
+
+    def edge(self, record):
+        u, v = self.records[record, 3:].tolist()
+        return u, v
+
+    def __getitem__(self, edge):
+        start, count, _ = self.record(edge)
+        return list(map(tuple, self.coords[start:start + count].tolist()))
+
+    def __setitem__(self, edge, points):
+        # У существующего ребра запись остаётся прежней, меняется только блок точек
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        start = self.allocate(len(points))
+        self.coords[start:start + len(points)] = points
+        slot = self.table.get(self.code(edge))
+        if slot < 0:
+            slot = self.free.pop() if self.free else self.new_records(1)
+            self.table.insert_one(self.code(edge), slot)
+        else:
+            old_start, old_count, capacity = self.records[slot, :3].tolist()
+            self.owner[old_start:old_start + old_count] = -1
+            self.garbage += capacity
+        self.owner[start:start + len(points)] = slot
+        self.records[slot] = (start, len(points), len(points), *edge)
+
+    def new_records(self, n):
+        # Номера n новых записей подряд после used; массив записей растёт вдвое
+        if self.used + n > len(self.records):
+            grown = np.zeros((max(self.used + n, 2 * len(self.records)), 5), dtype=np.int64)
+            grown[:self.used] = self.records[:self.used]
+            self.records = grown
+        self.used += n
+        return self.used - n
+
+    def __delitem__(self, edge):
+        slot = self.table.pop(self.code(edge))
+        if slot < 0:
+            raise KeyError(edge)
+        start, count, capacity = self.records[slot, :3].tolist()
+        self.owner[start:start + count] = -1
+        self.garbage += capacity
+        self.records[slot] = (0, 0, 0, -1, -1)
+        self.free.append(slot)
+
+    def __contains__(self, edge):
+        return self.table.get(self.code(edge)) >= 0
+
+    def live_records(self):
+        return np.flatnonzero(self.records[:self.used, 3] >= 0)
+
+    def __iter__(self):
+        return map(tuple, self.records[self.live_records(), 3:].tolist())
+
+    def __len__(self):
+        return self.table.count
+
+    def allocate(self, size):
+        if self.end + size > len(self.coords):
+            if self.garbage > self.end // 2:
+                self.compact()
+            if self.end + size > len(self.coords):
+                grown = np.zeros((max(2 * len(self.coords), self.end + size), 2), dtype=np.float32)
+                grown[:self.end] = self.coords[:self.end]
+                self.coords = grown
+                self.owner = np.concatenate([self.owner, np.full(len(grown) - len(self.owner), -1, dtype=np.int64)])
+        start = self.end
+        self.end += size
+        return start
+
+    def compact(self):
+        # Блоки живых рёбер переезжают подряд в начало массива в порядке записей
+        live = self.live_records()
+        starts, counts, capacities = self.records[live, :3].T
+        new_starts = np.cumsum(capacities) - capacities
+        packed = np.zeros_like(self.coords)
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        packed[np.repeat(new_starts, counts) + offsets] = self.coords[np.repeat(starts, counts) + offsets]
+        self.owner[:] = -1
+        self.owner[np.repeat(new_starts, counts) + offsets] = np.repeat(live, counts)
+        self.records[live, 0] = new_starts
+        self.coords, self.end, self.garbage = packed, int(capacities.sum()), 0
+        self.generation += 1
+
+    def count(self, edge):
+        return int(self.records[self.slot(edge), 1])
+
+    def point(self, edge, idx):
+        start, count, _ = self.record(edge)
+        if not -count <= idx < count:
+            raise IndexError(idx)
+        x, y = self.coords[start + idx % count].tolist()
+        return x, y
+
+    def set_point(self, edge, idx, point):
+        start, count, _ = self.record(edge)
+        if not -count <= idx < count:
+            raise IndexError(idx)
+        self.coords[start + idx % count] = point
+
+    def insert_point(self, edge, idx, point):
+        slot = self.slot(edge)
+        start, count, capacity = self.records[slot, :3].tolist()
+        if count == capacity:
+            # Блок полон: переносим его в конец массива с запасом (allocate может уплотнить массив и сдвинуть блок)
+            new_capacity = max(4, 2 * capacity)
+            new_start = self.allocate(new_capacity)
+            start = int(self.records[slot, 0])
+            self.coords[new_start:new_start + count] = self.coords[start:start + count]
+            self.owner[start:start + count] = -1
+            self.owner[new_start:new_start + count] = slot
+            self.garbage += capacity
+            self.records[slot, 0], self.records[slot, 2], start = new_start, new_capacity, new_start
+        idx = max(0, min(count, idx))
+        self.coords[start + idx + 1:start + count + 1] = self.coords[start + idx:start + count].copy()
+        self.coords[start + idx] = point
+        self.owner[start + count] = slot
+        self.records[slot, 1] += 1
+
+    def pop_point(self, edge, idx):
+        start, count, _ = self.record(edge)
+        point = self.point(edge, idx)
+        idx %= count
+        self.coords[start + idx:start + count - 1] = self.coords[start + idx + 1:start + count].copy()
+        self.owner[start + count - 1] = -1
+        self.records[self.slot(edge), 1] -= 1
+        return point
+
+    def active_slots(self):
+        return np.flatnonzero(self.owner[:self.end] >= 0)
+
+    def live(self, slots):
+        return self.owner[slots] >= 0
+
+    def point_slots(self, edges):
+        # Номера строк массива coords для всех точек указанных рёбер
+        return self.record_point_slots(self.records[self.slots(edges)])
+
+    @staticmethod
+    def record_point_slots(records):
+        starts, counts = records[:, 0], records[:, 1]
+        return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+
+    def bounding_box(self):
+        slots = self.record_point_slots(self.records[self.live_records()])
+        if not len(slots):
+            return None
+        (x0, y0), (x1, y1) = self.coords[slots].min(axis=0).tolist(), self.coords[slots].max(axis=0).tolist()
+        return x0, y0, x1, y1
+
+    def arrays(self):
+        # Все рёбра массивом (m, 2) и их записи в том же порядке — без кортежа на ребро
+        records = self.records[self.live_records()]
+        return records[:, 3:], records
+
+    def add_empty(self, edges):
+        # Много рёбер без контрольных точек сразу: записи подряд, пустой блок в конце массива.
+        # Возвращает номер первой записи
+        start = self.new_records(len(edges))
+        self.records[start:self.used, :3] = (self.end, 0, 0)
+        self.records[start:self.used, 3:] = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.table.insert(self.codes(edges), np.arange(start, self.used))
+        return start
+
+    def translate(self, edges, dx, dy):
+        self.coords[self.point_slots(edges)] += (dx, dy)
+
+class NeighborStore:
+    """
+    Списки соседей в виде CSR по номерам вершин: соседи вершины node — отсортированный срез
+    indices[indptr[node]:indptr[node + 1]]. Правки копятся в буфере (added — новые соседи по вершинам,
+    removed — удалённые из массивов рёбра) и вливаются в массивы пересборкой, когда буфер дорастает до
+    восьмой части рёбер или когда нужен весь граф сразу (submatrix). Рёбра вершины выдаются ключами edge_key.
+    """
+    MIN_BUFFER = 4096
+
+    def __init__(self):
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.added = {}       # вершина -> множество соседей, ещё не влитых в массивы
+        self.removed = set()  # рёбра, которые есть в массивах, но уже удалены
+        self.pending = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def neighbors(self, node):
+        neighbors = []
+        if node < len(self.indptr) - 1:
+            neighbors = self.indices[self.indptr[node]:self.indptr[node + 1]].tolist()
+            if self.removed:
+                neighbors = [other for other in neighbors if edge_key(node, other) not in self.removed]
+        extra = self.added.get(node)
+        return neighbors + list(extra) if extra else neighbors
+
+    __getitem__ = neighbors
+
+    def edges_of(self, node):
+        return [edge_key(node, other) for other in self.neighbors(node)]
+
+    def add(self, u, v):
+        # Ребра (u, v) ещё нет: вызывающий проверяет это по EdgeStore
+        edge = edge_key(u, v)
+        if edge in self.removed:
+            self.removed.discard(edge)
+        else:
+            self.added.setdefault(u, set()).add(v)
+            self.added.setdefault(v, set()).add(u)
+        self.count += 1
+        self.touch()
+
+    def remove(self, u, v):
+        self.discard(u, v)
+        self.touch()
+
+    def remove_many(self, edges):
+        for u, v in edges:
+            self.discard(u, v)
+        self.touch(len(edges))
+
+    def discard(self, u, v):
+        if v in self.added.get(u, ()):
+            for a, b in ((u, v), (v, u)):
+                self.added[a].discard(b)
+                if not self.added[a]:
+                    del self.added[a]
+        else:
+            self.removed.add(edge_key(u, v))
+        self.count -= 1
+
+    def touch(self, count=1):
+        self.pending += count
+        if self.pending > max(self.MIN_BUFFER, self.count // 8):
+            self.compact()
+
+    def extend(self, edges):
+        # Много новых рёбер (массив пар номеров вершин) сразу: пока влезают в буфер (отмена удаления) — через
+        # него, иначе одной пересборкой
+        if not len(edges):
+            return
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if self.pending + len(edges) <= max(self.MIN_BUFFER, self.count // 8):
+            for u, v in edges.tolist():
+                self.add(u, v)
+            return
+        self.compact(edges)
+        self.count += len(edges)
+
+    def compact(self, extra=None):
+        # Пересборка: пары (вершина, сосед) из массивов без удалённых, плюс буфер, сортируются заново
+        if not self.pending and extra is None:
+            return
+        rows = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        cols = self.indices
+        if self.removed:
+            gone = np.array(list(self.removed), dtype=np.int64).reshape(-1, 2)
+            size = len(self.indptr)
+            keep = ~np.isin(np.minimum(rows, cols) * size + np.maximum(rows, cols), gone[:, 0] * size + gone[:, 1])
+            rows, cols = rows[keep], cols[keep]
+        parts_u, parts_v = [rows], [cols]
+        if self.added:
+            parts_u.append(np.fromiter((u for u, others in self.added.items() for _ in others), dtype=np.int64))
+            parts_v.append(np.fromiter((v for others in self.added.values() for v in others), dtype=np.int64))
+        if extra is not None and len(extra):
+            parts_u += [extra[:, 0], extra[:, 1]]
+            parts_v += [extra[:, 1], extra[:, 0]]
+        rows, cols = np.concatenate(parts_u), np.concatenate(parts_v)
+        size = max(len(self.indptr) - 1, int(rows.max()) + 1 if len(rows) else 0)
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=self.indptr[1:])
+        self.added, self.removed, self.pending = {}, set(), 0
+
+    def submatrix(self, nodes):
+        # CSR графа с вершинами nodes в роли строк 0..len(nodes)-1: indptr и indices в номерах строк
+        self.compact()
+        nodes = np.asarray(nodes, dtype=np.int64)
+        size = len(self.indptr) - 1
+        row_of = np.full(max(size, int(nodes.max()) + 1 if len(nodes) else 0), -1, dtype=np.int64)
+        row_of[nodes] = np.arange(len(nodes))
+        inside = nodes < size
+        starts = np.where(inside, self.indptr[np.minimum(nodes, size)], 0)
+        degrees = np.where(inside, self.indptr[np.minimum(nodes + 1, size)] - starts, 0)
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        gather = np.repeat(starts - indptr[:-1], degrees) + np.arange(int(indptr[-1]))
+        return indptr, row_of[self.indices[gather]]
+
+def flatten_spline(points, samples):
+    # Кривая Катмулла — Рома через все точки пути, samples отрезков на каждый промежуток между соседними точками
+    p = np.asarray(points, dtype=np.float64)
+    ext = np.concatenate([2 * p[:1] - p[1:2], p, 2 * p[-1:] - p[-2:-1]])
+    p0, p1, p2, p3 = ext[:-3], ext[1:-2], ext[2:-1], ext[3:]
+    t = (np.arange(samples) / samples)[:, None, None]
+    curve = 0.5 * (2 * p1 + (p2 - p0) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t ** 2 +
+                   (3 * (p1 - p2) + p3 - p0) * t ** 3)
+    return np.concatenate([curve.transpose(1, 0, 2).reshape(-1, 2), p[-1:]])
+
+def edge_key(u, v):
+    # Неориентированное ребро хранится под одним ключом: меньшая вершина первой
+    return (u, v) if u <= v else (v, u)
+
+class RowIndex:
+    """
+    Порядок строк матрицы смежности в массивах: nodes — строка -> вершина, rows — вершина -> строка (по номеру
+    вершины, как PointStore.id_slots). Новая вершина получает следующую строку за O(1), удалённая оставляет дыру;
+    дыры убираются одним проходом, когда их становится больше половины или когда нужен плотный порядок (order).
+    """
+    def __init__(self):
+        self.nodes = np.zeros(64, dtype=np.int64)    # строка -> вершина, -1 — дыра; заняты строки [0, size)
+        self.rows = np.full(64, -1, dtype=np.int64)  # вершина -> строка, -1 — нет такой вершины
+        self.size = 0
+        self.holes = 0
+
+    def append(self, node):
+        self.extend([node])
+
+    def extend(self, nodes):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if not len(nodes):
+            return
+        end = self.size + len(nodes)
+        if end > len(self.nodes):
+            grown = np.zeros(max(end, 2 * len(self.nodes)), dtype=np.int64)
+            grown[:self.size] = self.nodes[:self.size]
+            self.nodes = grown
+        top = int(nodes.max()) + 1
+        if top > len(self.rows):
+            grown = np.full(max(top, 2 * len(self.rows)), -1, dtype=np.int64)
+            grown[:len(self.rows)] = self.rows
+            self.rows = grown
+        self.nodes[self.size:end] = nodes
+        self.rows[nodes] = np.arange(self.size, end)
+        self.size = end
+
+    def remove(self, node):
+        row = self.rows[node] if 0 <= node < len(self.rows) else -1
+        if row < 0:
+            raise KeyError(node)
+        self.nodes[row] = -1
+        self.rows[node] = -1
+        self.holes += 1
+        if self.holes > self.size // 2:
+            self.compact()
+
+    def compact(self):
+        # Живые строки сдвигаются в новый массив: порядок, отданный order раньше, остаётся как был
+        if self.holes:
+            nodes = self.nodes[:self.size]
+            nodes = nodes[nodes >= 0]
+            self.nodes = np.zeros(len(self.nodes), dtype=np.int64)
+            self.nodes[:len(nodes)] = nodes
+            self.rows[nodes] = np.arange(len(nodes))
+            self.size, self.holes = len(nodes), 0
+
+    def order(self):
+        # Вершины по строкам массивом без дыр; не менять — это срез внутреннего массива
+        self.compact()
+        return self.nodes[:self.size]
+
+    def __len__(self):
+        return self.size - self.holes
+
+def estimate_bytes(value):
+    # Примерный размер производного значения для кеша: массивы numpy, строки, матрицы и контейнеры из них
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, AdjacencyMatrix):
+        return value.indptr.nbytes + value.indices.nbytes + 8 * value.size
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 8 * len(value) + sum(estimate_bytes(item) for item in value if not isinstance(item, (int, float)))
+    return 64
+
+def measure_bytes(objects, seen):
+    # Занятая память объектов со всем, на что они ссылаются: контейнеры, массивы numpy (вместе с базовым
+    # массивом у срезов) и объекты классов этого модуля. Уже посчитанное в seen не считается второй раз
+    total, stack = 0, list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, np.ndarray):
+            if obj.base is not None:
+                stack.append(obj.base)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif type(obj).__module__ == __name__:
+            stack.append(vars(obj))
+    return total
+
+class DerivedCache:
+    """
+    Кеш производных от графа значений (матрица, её текст, степени, компоненты...), по одному значению на имя.
+    Значение годно, пока совпадает версия графа, с которой оно посчитано; новая версия вытесняет старую.
+    Общий объём ограничен max_bytes, при превышении выбрасываются давно не использованные значения.
+    Доступ под блокировкой: кешем пользуются и фоновые задачи (MatrixJob).
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # имя -> (версия, значение, байты), от давних к недавним
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, version, compute):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Считаем без блокировки: вычисление может быть долгим
+        value = compute()
+        self.put(name, version, value)
+        return value
+
+    def put(self, name, version, value):
+        size = estimate_bytes(value)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                if entry[0] > version:
+                    return  # пока считали, уже сохранили значение для более новой версии
+                self.bytes -= self.entries.pop(name)[2]
+            if size > self.max_bytes:
+                return
+            self.entries[name] = (version, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "bytes": self.bytes}
+
+@contextmanager
+def paused_gc():
+    # Миллионы новых кортежей и множеств раз за разом запускали бы сборщик циклов по всей куче
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+class GraphChanges:
+    """Вершины и рёбра, затронутые изменением. Удалены они или изменены — подписчик проверяет по модели."""
+    def __init__(self):
+        self.vertices = set()
+        self.edges = set()
+
+    def __bool__(self):
+        return bool(self.vertices or self.edges)
+
+class GraphModel:
+    """
+    Состояние графа без привязки к Tk: вершины с координатами, рёбра с контрольными точками и индексы для поиска.
+    Каждое изменение сообщается подписчикам через GraphChanges; внутри batch() подписчики получают одно
+    уведомление на всю пачку изменений. Если задан recorder, он получает каждое изменение в виде кортежа
+    (см. apply и inverse_change): из них редактор собирает отмену и журнал автосохранения.
+    """
+    def __init__(self):
+        # Граф хранится один раз: координаты вершин, записи рёбер с точками и CSR-списки соседей (из них же
+        # берутся рёбра вершины)
+        self.vertices = PointStore()      # вершина -> (x, y)
+        self.edges = EdgeStore()          # edge_key(u, v) -> список контрольных точек от u к v
+        self.adjacency = NeighborStore()  # вершина -> соседи
+        # Номера вершин не переиспользуются: после удаления новая вершина получает следующий свободный номер
+        self.next_id = 1
+        self.row_index = RowIndex()
+        self.pinned = set()           # вершины, которые раскладка не двигает
+        # Версия растёт при каждом изменении набора вершин или рёбер (перемещения её не меняют);
+        # по ней проверяются значения в кеше производных
+        self.version = 0
+        self.cache = DerivedCache()
+        # Индексы для попадания мышью: вершины и контрольные точки по слотам своих хранилищ, отрезки рёбер
+        self.vertex_index = PointGrid(self.vertices)
+        self.ctrl_index = PointGrid(self.edges)
+        self.segment_index = SegmentGrid()
+        # Ребро с контрольными точками рисуется сплайном: сглаженный путь считается в update_edge_path,
+        # то есть только когда меняются концы или точки ребра, и служит и для отрисовки, и для попадания мышью
+        self.geometry = {}
+        self.listeners = []
+        self.changes = GraphChanges()
+        self.batch_depth = 0
+        self.recorder = None
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def record(self, *change):
+        if self.recorder is not None:
+            self.recorder(change)
+
+    @contextmanager
+    def unrecorded(self):
+        # Изменения, которые не должны попасть в отмену и журнал: догрузка сессии, шаги раскладки, само применение
+        recorder, self.recorder = self.recorder, None
+        try:
+            yield self
+        finally:
+            self.recorder = recorder
+
+    def fragment(self, nodes, edges):
+        # Вершины и рёбра с координатами и точками в виде куска сессии (SessionFile.chunk) — так их
+        # записывают изменения "add" и "remove"
+        nodes = np.array([node for node in nodes if node in self.vertices], dtype=np.int64)
+        edges = list(edges)
+        records = self.edges.records[self.edges.slots(edges)]
+        return (nodes, self.vertices.coords[self.vertices.slots(nodes)],
+                np.fromiter((node in self.pinned for node in nodes.tolist()), dtype=bool, count=len(nodes)),
+                np.fromiter(chain.from_iterable(edges), dtype=np.int64, count=2 * len(edges)).reshape(-1, 2),
+                records[:, 1].astype(np.int32), self.edges.coords[self.edges.record_point_slots(records)])
+
+    def apply(self, change):
+        """
+        Применяет изменение из записанных моделью: ("add" | "remove", вершины, координаты, закреплённость,
+        рёбра, число точек у рёбер, точки), ("move", вершины, старые координаты, новые), ("translate", вершины,
+        dx, dy), ("points", u, v, старые точки ребра, новые), ("pin", вершины, закрепить). Само не записывается.
+        """
+        kind, *args = change
+        with self.unrecorded(), self.batch():
+            if kind == "add":
+                self.load_chunk(*args)
+            elif kind == "remove":
+                self.drop_edges([edge for edge in map(tuple, args[3].tolist()) if edge in self.edges])
+                self.remove_vertices(args[0].tolist())
+            elif kind == "move":
+                self.place_vertices(args[0].tolist(), args[2])
+            elif kind == "translate":
+                self.translate_vertices(args[0].tolist(), *args[1:])
+            elif kind == "points":
+                self.add_edge(*args[:2], map(tuple, args[3]))
+            elif kind == "pin":
+                self.pin_vertices(args[0].tolist(), args[1])
+            else:
+                raise ValueError(f"неизвестное изменение {kind!r}")
+
+    @contextmanager
+    def batch(self):
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            self.notify()
+
+    def notify(self):
+        if self.batch_depth or not self.changes:
+            return
+        changes, self.changes = self.changes, GraphChanges()
+        for listener in self.listeners:
+            listener(changes)
+
+    def add_vertex(self, x, y):
+        node_id = self.next_id
+        self.next_id += 1
+        self.version += 1
+        self.row_index.append(node_id)
+        self.vertices[node_id] = (x, y)
+        self.vertex_index.touch([self.vertices.slot(node_id)])
+        self.changes.vertices.add(node_id)
+        self.record("add", *self.fragment([node_id], []))
+        self.notify()
+        return node_id
+
+    def add_vertices(self, points):
+        with self.batch():
+            return [self.add_vertex(x, y) for x, y in points]
+
+    def load(self, points, edges):
+        """
+        Добавляет много вершин и рёбер одним пакетом: points — координаты новых вершин (n, 2),
+        edges — пары номеров строк points (0..n-1). Петли и повторы рёбер отбрасываются.
+        Возвращает номера новых вершин.
+        """
+        with paused_gc():
+            return self.load_arrays(points, edges)
+
+    def load_arrays(self, points, edges):
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        nodes = np.arange(self.next_id, self.next_id + len(points))
+        # Ключ ребра — (меньший номер, больший), как у edge_key
+        edges = np.sort(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=1)
+        if len(edges) and (edges[0, 0] < 0 or edges[:, 1].max() >= len(points)):
+            raise ValueError(f"концы рёбер должны быть номерами строк points 0..{len(points) - 1}")
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        codes = np.unique(edges[:, 0] * len(points) + edges[:, 1])
+        edges = np.stack([codes // len(points), codes % len(points)], axis=1)
+        edges = nodes[edges]
+        self.insert_arrays(nodes, points, edges)
+        self.record("add", nodes, points.copy(), np.zeros(len(nodes), dtype=bool), edges,
+                    np.zeros(len(edges), dtype=np.int32), np.zeros((0, 2), dtype=np.float32))
+        return nodes.tolist()
+
+    def insert_arrays(self, nodes, points, edges):
+        # Новые вершины с заданными номерами и новые рёбра без контрольных точек (пары номеров, меньший первым)
+        self.next_id = max(self.next_id, int(nodes.max()) + 1 if len(nodes) else 0)
+        self.version += 1
+        self.vertices.extend(nodes, points)
+        self.vertex_index.touch(self.vertices.slots(nodes))
+        node_list = nodes.tolist()
+        self.row_index.extend(nodes)
+        edge_list = list(map(tuple, edges.tolist()))
+        start = self.edges.add_empty(edges)
+        self.adjacency.extend(edges)
+        self.segment_index.add_lines(np.arange(start, start + len(edge_list)),
+                                     self.vertices.coords[self.vertices.slots(edges.ravel())])
+        self.changes.vertices.update(node_list)
+        self.changes.edges.update(edge_list)
+        self.notify()
+
+    def load_chunk(self, nodes, points, pinned, edges, ctrl_counts, ctrl_points):
+        # Кусок файла сессии (SessionFile.chunk). Рёбра, концы которых уже удалены или которые уже есть
+        # (граф правили, пока догружался файл), пропускаются; вершина, которая уже есть, — ошибка
+        if self.vertices.present(nodes).any():
+            raise ValueError(f"вершины куска уже есть в графе: {nodes[self.vertices.present(nodes)][:5].tolist()}")
+        with self.batch(), self.unrecorded(), paused_gc():
+            self.insert_arrays(nodes, points, np.zeros((0, 2), dtype=np.int64))
+            self.pinned.update(nodes[pinned].tolist())
+            keep = self.vertices.present(edges).all(axis=1)
+            keep[keep] = self.edges.find(edges[keep]) < 0
+            ctrl_ends = np.cumsum(ctrl_counts, dtype=np.int64)
+            straight = keep & (ctrl_counts == 0)
+            self.insert_arrays(nodes[:0], points[:0], edges[straight])
+            for i in np.flatnonzero(keep & ~straight).tolist():
+                u, v = edges[i].tolist()
+                self.add_edge(u, v, map(tuple, ctrl_points[ctrl_ends[i] - ctrl_counts[i]:ctrl_ends[i]].tolist()))
+
+    def clear(self):
+        # Пустой граф на месте текущего: подписчики и recorder остаются, версия продолжает расти
+        changes = self.changes
+        changes.vertices.update(self.vertices)
+        changes.edges.update(self.edges)
+        listeners, recorder, version = self.listeners, self.recorder, self.version
+        self.__init__()
+        self.listeners, self.recorder, self.version, self.changes = listeners, recorder, version + 1, changes
+        self.notify()
+
+    def move_vertex(self, node, x, y):
+        self.record("move", np.array([node]), np.array([self.vertices[node]], dtype=np.float32),
+                    np.array([(x, y)], dtype=np.float32))
+        self.vertices[node] = (x, y)
+        self.vertex_index.touch([self.vertices.slot(node)])
+        self.changes.vertices.add(node)
+        # Вместе с вершиной меняется геометрия всех её рёбер
+        for e in self.adjacency.edges_of(node):
+            self.update_edge_path(e)
+        self.notify()
+
+    def move_vertices(self, moves):
+        # moves — пары (вершина, (x, y))
+        with self.batch():
+            for node, (x, y) in moves:
+                self.move_vertex(node, x, y)
+
+    def place_vertices(self, nodes, coords):
+        # Новые координаты многих вершин сразу (раскладка); контрольные точки рёбер остаются на месте
+        nodes = list(nodes)
+        slots = self.vertices.slots(nodes)
+        if self.recorder is not None:
+            self.record("move", np.array(nodes, dtype=np.int64), self.vertices.coords[slots],
+                        np.array(coords, dtype=np.float32))
+        self.vertices.coords[slots] = coords
+        self.vertex_index.touch(slots)
+        self.update_edge_paths(set().union(*map(self.adjacency.edges_of, nodes)))
+        self.changes.vertices.update(nodes)
+        self.notify()
+
+    def pin_vertices(self, nodes, pinned=True):
+        nodes = list(nodes)
+        changed = [node for node in nodes if (node in self.pinned) != pinned]
+        if changed:
+            self.record("pin", np.array(changed, dtype=np.int64), bool(pinned))
+        if pinned:
+            self.pinned.update(nodes)
+        else:
+            self.pinned.difference_update(nodes)
+        self.changes.vertices.update(nodes)
+        self.notify()
+
+    def translate_vertices(self, nodes, dx, dy):
+        # Сдвиг группы вершин вместе с контрольными точками рёбер, у которых сдвигаются оба конца
+        nodes = set(nodes)
+        slots = self.vertices.slots(nodes)  # неизвестная вершина — KeyError до записи изменения
+        if self.recorder is not None:
+            self.record("translate", np.sort(np.fromiter(nodes, dtype=np.int64, count=len(nodes))),
+                        float(dx), float(dy))
+        touched = set().union(*map(self.adjacency.edges_of, nodes))
+        inner = [e for e in touched if e[0] in nodes and e[1] in nodes]
+        self.vertices.translate(nodes, dx, dy)
+        self.edges.translate(inner, dx, dy)
+        self.vertex_index.touch(slots)
+        self.ctrl_index.touch(self.edges.point_slots(inner))
+        self.update_edge_paths(touched)
+        self.changes.vertices.update(nodes)
+        self.notify()
+
+    def remove_vertices(self, nodes):
+        nodes = set(nodes)
+        # Удаляем рёбра, связанные с удалёнными вершинами: их находим по спискам соседей, за O(степени)
+        edges = set().union(*map(self.adjacency.edges_of, nodes))
+        if self.recorder is not None:
+            self.record("remove", *self.fragment(nodes, edges))
+        self.drop_edges(edges)
+        present = np.fromiter(nodes, dtype=np.int64, count=len(nodes))
+        self.vertex_index.touch(self.vertices.slots(present[self.vertices.present(present)]))
+        for node in nodes:
+            self.row_index.remove(node)
+            self.vertices.pop(node, None)
+            self.pinned.discard(node)
+        self.version += 1
+        self.changes.vertices.update(nodes)
+        self.notify()
+
+    def add_edge(self, u, v, points=()):
+        # Контрольные точки задаются от u к v; при смене порядка концов ключа переворачиваем их
+        edge = edge_key(u, v)
+        points = list(points) if edge == (u, v) else list(points)[::-1]
+        if edge in self.edges:
+            old = self.edges[edge]
+            self.unindex_ctrl_points(edge)
+            self.edges[edge] = points
+            self.record("points", *edge, old, self.edges[edge])
+        else:
+            self.version += 1
+            self.adjacency.add(u, v)
+            self.edges[edge] = points
+            self.record("add", *self.fragment([], [edge]))
+        self.index_ctrl_points(edge)
+        self.update_edge_path(edge)
+        self.notify()
+        return edge
+
+    def add_edges(self, edges):
+        # edges — пары (u, v) или тройки (u, v, контрольные точки)
+        with self.batch():
+            for edge in edges:
+                self.add_edge(*edge)
+
+    def has_edge(self, u, v):
+        return edge_key(u, v) in self.edges
+
+    def remove_edge(self, u, v):
+        edge = edge_key(u, v)
+        self.record("remove", *self.fragment([], [edge]))
+        self.drop_edge(edge)
+        self.notify()
+
+    def drop_edge(self, edge):
+        u, v = edge
+        self.adjacency.remove(u, v)
+        self.version += 1
+        self.unindex_ctrl_points(edge)
+        self.segment_index.remove_path(self.edges.slot(edge))
+        del self.edges[edge]
+        self.geometry.pop(edge, None)
+        self.changes.edges.add(edge)
+
+    def drop_edges(self, edges):
+        # drop_edge для многих рёбер: списки соседей и индекс отрезков обновляются одним вызовом
+        edges = list(edges)
+        self.adjacency.remove_many(edges)
+        self.version += 1
+        self.segment_index.remove_paths(self.edges.slots(edges))
+        self.ctrl_index.touch(self.edges.point_slots(edges))
+        for edge in edges:
+            del self.edges[edge]
+            self.geometry.pop(edge, None)
+        self.changes.edges.update(edges)
+
+    def remove_edges(self, edges):
+        with self.batch():
+            for u, v in edges:
+                self.remove_edge(u, v)
+
+    def insert_ctrl_point(self, edge, idx, point):
+        old = self.edges[edge]
+        self.unindex_ctrl_points(edge)
+        self.edges.insert_point(edge, idx, point)
+        self.index_ctrl_points(edge)
+        self.update_edge_path(edge)
+        self.record("points", *edge, old, self.edges[edge])
+        self.notify()
+
+    def move_ctrl_point(self, edge, idx, x, y):
+        old = self.edges[edge]
+        self.edges.set_point(edge, idx, (x, y))
+        self.index_ctrl_points(edge)
+        self.update_edge_path(edge)
+        self.record("points", *edge, old, self.edges[edge])
+        self.notify()
+
+    def move_ctrl_points(self, moves):
+        # moves — тройки (ребро, номер точки, (x, y))
+        with self.batch():
+            for edge, idx, (x, y) in moves:
+                self.move_ctrl_point(edge, idx, x, y)
+
+    def remove_ctrl_point(self, edge, idx):
+        old = self.edges[edge]
+        self.unindex_ctrl_points(edge)
+        self.edges.pop_point(edge, idx)
+        self.index_ctrl_points(edge)
+        self.update_edge_path(edge)
+        self.record("points", *edge, old, self.edges[edge])
+        self.notify()
+
+    def find_nearest_vertex(self, x, y, radius=15):
+        slot = self.vertex_index.nearest(x, y, radius)
+        return None if slot is None else int(self.vertices.slot_ids[slot])
+
+    def find_nearest_ctrl_point(self, x, y, radius=10):
+        # (ребро, номер точки) или None
+        slot = self.ctrl_index.nearest(x, y, radius)
+        if slot is None:
+            return None
+        record = int(self.edges.owner[slot])
+        return self.edges.edge(record), slot - int(self.edges.records[record, 0])
+
+    def vertices_in_rect(self, x0, y0, x1, y1):
+        slots = self.vertex_index.query_rect(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        return self.vertices.slot_ids[slots].tolist()
+
+    def edges_in_rect(self, x0, y0, x1, y1):
+        records = self.segment_index.query_rect(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        return list(map(tuple, self.edges.records[records, 3:].tolist()))
+
+    def find_nearest_segment(self, x, y, threshold=7):
+        # ((ребро, номер отрезка пути), проекция точки) или None
+        hit = self.segment_index.nearest(x, y, threshold)
+        if hit is None:
+            return None
+        (record, i), proj = hit
+        return (self.edges.edge(record), i), proj
+
+    def adjacency_matrix(self):
+        # Строки берутся из поддерживаемого индекса, CSR пересчитывается только после изменения графа.
+        # Матрица не меняется после создания, поэтому один объект отдаётся всем, в том числе фоновым задачам.
+        def build():
+            nodes = self.row_index.order()
+            matrix = AdjacencyMatrix.from_csr(nodes, *self.adjacency.submatrix(nodes))
+            matrix.version = self.version
+            return matrix
+        return self.cache.get("adjacency", self.version, build)
+
+    def derived(self, name, matrix, compute):
+        # Значение, посчитанное по снимку matrix (его версии); годится и для вызова из фонового потока
+        return self.cache.get(name, matrix.version, lambda: compute(matrix))
+
+    def dense_adjacency(self):
+        return self.derived("dense", self.adjacency_matrix(), AdjacencyMatrix.to_dense)
+
+    def adjacency_text(self, matrix=None, progress=None):
+        matrix = self.adjacency_matrix() if matrix is None else matrix
+        return self.derived("text", matrix, lambda m: m.to_text(progress))
+
+    def degrees(self):
+        # Степени вершин в порядке строк матрицы
+        return self.derived("degrees", self.adjacency_matrix(), lambda m: np.diff(m.indptr))
+
+    def components(self):
+        # Компоненты связности: списки вершин, от больших к меньшим
+        def build(matrix):
+            labels = analyze_components(matrix.size, np.stack(matrix.to_coo(), axis=1))
+            order = np.argsort(labels, kind="stable")
+            bounds = np.cumsum(np.bincount(labels))[:-1]
+            return [sorted(c) for c in np.split(np.array(matrix.nodes)[order], bounds) if len(c)]
+        return self.derived("components", self.adjacency_matrix(), build)
+
+    def laplacian(self):
+        # Плотная матрица Кирхгофа L = D - A; ограничена тем же порогом, что и to_dense
+        def build(matrix):
+            lap = -matrix.to_dense(np.int32)
+            lap[np.diag_indices(matrix.size)] += np.diff(matrix.indptr).astype(np.int32)
+            return lap
+        return self.derived("laplacian", self.adjacency_matrix(), build)
+
+    def incidence(self):
+        # Матрица инцидентности в разреженном виде: для ребра j (в порядке строк u <= v) — строки двух его концов
+        def build(matrix):
+            rows, cols = matrix.to_coo()
+            upper = rows <= cols
+            return np.stack([rows[upper], cols[upper]], axis=1)
+        return self.derived("incidence", self.adjacency_matrix(), build)
+
+    def to_networkx(self):
+        # Копия графа для экспорта и сторонних алгоритмов; networkx загружается при первом вызове
+        import networkx as nx
+        graph = nx.Graph()
+        graph.add_nodes_from(self.row_index.order().tolist())
+        graph.add_edges_from(self.edges)
+        return graph
+
+    def memory_usage(self):
+        # Измеренные байты графа вместе с индексами для мыши и сплайнами (без кеша производных): вершины —
+        # координаты, их сетка, порядок строк, закреплённые и CSR-смещения; рёбра — записи с контрольными
+        # точками, соседи, сетки точек и отрезков; плюс то же в пересчёте на вершину и на ребро
+        seen = set()
+        vertices = measure_bytes([self.vertices, self.vertex_index, self.row_index, self.pinned,
+                                  self.adjacency.indptr], seen)
+        edges = measure_bytes([self.edges, self.adjacency, self.ctrl_index, self.segment_index, self.geometry], seen)
+        return {"vertices": vertices, "edges": edges,
+                "per_vertex": round(vertices / max(len(self.vertices), 1), 1),
+                "per_edge": round(edges / max(len(self.edges), 1), 1)}
+
+    def index_ctrl_points(self, edge):
+        # Точки ребра поменялись или переехали в другой блок: их слоты помечаются в сетке. Перед заменой
+        # точек то же делает unindex_ctrl_points для старых слотов
+        self.ctrl_index.touch(self.edges.point_slots([edge]))
+
+    def unindex_ctrl_points(self, edge):
+        if edge in self.edges:
+            self.index_ctrl_points(edge)
+
+    SPLINE_SAMPLES = 8
+
+    def update_edge_path(self, edge):
+        # Геометрия ребра изменилась: пересчитываем его сплайн, обновляем индекс отрезков и помечаем ребро изменённым
+        self.changes.edges.add(edge)
+        u, v = edge
+        points = self.edges[edge]
+        if points:
+            path = flatten_spline([self.vertices[u]] + points + [self.vertices[v]], self.SPLINE_SAMPLES)
+            self.geometry[edge] = path
+            self.segment_index.set_path(self.edges.slot(edge), path)
+        else:
+            self.geometry.pop(edge, None)
+            self.segment_index.set_path(self.edges.slot(edge), [self.vertices[u], self.vertices[v]])
+
+    def update_edge_paths(self, edges):
+        # update_edge_path для многих рёбер: прямые рёбра обновляются в индексе отрезков одним вызовом
+        straight = []
+        for edge in edges:
+            if edge in self.edges and not self.edges.count(edge):
+                straight.append(edge)
+            else:
+                self.update_edge_path(edge)
+        if straight:
+            ends = self.vertices.coords[self.vertices.slots(np.array(straight).ravel())]
+            self.segment_index.move_lines(self.edges.slots(straight), ends.reshape(-1, 4))
+            self.changes.edges.update(straight)
+
+    def edge_path(self, edge):
+        # Путь ребра в виде массива точек: закешированный сплайн или прямой отрезок между вершинами
+        path = self.geometry.get(edge)
+        if path is None:
+            u, v = edge
+            path = np.array([self.vertices[u], self.vertices[v]])
+        return path
+
+    def ctrl_index_of_segment(self, edge, segment):
+        # Номер промежутка между точками пути, которому принадлежит отрезок segment пути ребра:
+        # новая контрольная точка, вставленная с этим номером, ляжет в этот промежуток
+        return segment // self.SPLINE_SAMPLES if edge in self.geometry else segment
+
+def inverse_change(change):
+    # Изменение, возвращающее модель к состоянию до change (см. GraphModel.apply)
+    kind = change[0]
+    if kind == "add":
+        return ("remove",) + change[1:]
+    if kind == "remove":
+        return ("add",) + change[1:]
+    if kind == "move":
+        return "move", change[1], change[3], change[2]
+    if kind == "translate":
+        return "translate", change[1], -change[2], -change[3]
+    if kind == "points":
+        return "points", change[1], change[2], change[4], change[3]
+    if kind == "pin":
+        return "pin", change[1], not change[2]
+    raise ValueError(f"необратимое изменение {kind!r}")
+
+def merge_changes(first, second):
+    # Два изменения подряд одного и того же (кадры перетаскивания) — одно, или None, если слить нельзя
+    if first[0] != second[0]:
+        return None
+    kind = first[0]
+    if kind in ("move", "translate") and len(first[1]) == len(second[1]) and np.array_equal(first[1], second[1]):
+        if kind == "move":
+            return "move", first[1], first[2], second[3]
+        return "translate", first[1], first[2] + second[2], first[3] + second[3]
+    if kind == "points" and first[1:3] == second[1:3]:
+        return "points", first[1], first[2], first[3], second[4]
+    return None
+
+class History:
+    """
+    Отмена и повтор. Шаг — изменения модели за одно действие пользователя (клик, перетаскивание, удаление);
+    отмена применяет обратные изменения в обратном порядке, поэтому стоит O(размера шага), а не графа.
+    """
+    LIMIT = 1000  # шагов отмены
+
+    def __init__(self):
+        self.undo_steps = deque(maxlen=self.LIMIT)
+        self.redo_steps = []
+        self.step = []  # изменения текущего, ещё не закрытого действия
+
+    def record(self, change):
+        merged = merge_changes(self.step[-1], change) if self.step else None
+        if merged is not None:
+            self.step[-1] = merged
+        else:
+            self.step.append(change)
+
+    def commit(self):
+        # Закрывает шаг и возвращает его изменения
+        step, self.step = self.step, []
+        if step:
+            self.undo_steps.append(step)
+            self.redo_steps.clear()
+        return step
+
+    def undo(self):
+        # Изменения, которые нужно применить, или None, если отменять нечего
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        return [inverse_change(change) for change in reversed(step)]
+
+    def redo(self):
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        return step
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+        self.step = []
+
+def encode_change(change):
+    # Запись журнала: длина и CRC32 содержимого, затем JSON-заголовок (массивы заменены на тип и форму) и массивы
+    arrays = [item for item in change if isinstance(item, np.ndarray)]
+    header = [{"array": [item.dtype.str, list(item.shape)]} if isinstance(item, np.ndarray) else item
+              for item in change]
+    payload = json.dumps(header).encode() + b"\n" + b"".join(np.ascontiguousarray(a).tobytes() for a in arrays)
+    return len(payload).to_bytes(4, "little") + zlib.crc32(payload).to_bytes(4, "little") + payload
+
+def decode_change(payload):
+    end = payload.index(b"\n")
+    change, offset = [], end + 1
+    for item in json.loads(payload[:end]):
+        if isinstance(item, dict):
+            dtype, shape = np.dtype(item["array"][0]), item["array"][1]
+            count = int(np.prod(shape))
+            item = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+            offset += count * dtype.itemsize
+        change.append(item)
+    return tuple(change)
+
+def read_journal_segment(file_path):
+    # Изменения из сегмента по порядку; недописанная при сбое запись и всё после неё отбрасываются
+    with open(file_path, "rb") as file:
+        data = file.read()
+    pos = 0
+    while pos + 8 <= len(data):
+        size, crc = int.from_bytes(data[pos:pos + 4], "little"), int.from_bytes(data[pos + 4:pos + 8], "little")
+        payload = data[pos + 8:pos + 8 + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            return
+        yield decode_change(payload)
+        pos += 8 + size
+
+class Journal:
+    """
+    Автосохранение в папке directory: снимок snapshot.graphsession (SessionFile) и сегменты journal-NNNNNN.log
+    с изменениями модели после него, только дописываемые. Записи уходят фоновому потоку и пишутся с fsync
+    пачками раз в FSYNC_INTERVAL; сбой теряет не больше последней пачки. Сжатие (compact) переключает запись
+    на новый сегмент и в другом потоке пишет снимок, снятый в Tk-потоке; после замены снимка старые сегменты
+    удаляются. Снимок знает, с какого сегмента начинаются не вошедшие в него изменения (meta["journal"]).
+    Изменение "open" — открыт файл сессии (путь): с него начинается граф, отменить его нельзя; редактор
+    сжимает журнал, как только файл догружен, и после каждого сохранения сессии, поэтому восстановление не
+    перечитывает файл, который с тех пор перезаписали.
+    Папку держит один процесс (замок directory + ".lock"); если её занял другой запущенный редактор, журнал
+    берёт directory-1, directory-2 и т. д. При обычном выходе (close, в том числе из atexit) папка удаляется;
+    если она осталась, прошлый запуск упал, и при создании журнала она переезжает в directory + ".previous"
+    (см. read). Восстановленное прошлое автосохранение удаляется, когда его содержимое попало в новый снимок.
+    """
+    SNAPSHOT = "snapshot.graphsession"
+    FSYNC_INTERVAL = 0.5
+    COMPACT_BYTES = 64 * 1024 * 1024  # столько изменений в журнале — пора сжимать
+    COMPACT_INTERVAL = 300            # секунд; раз в столько сжимается любой непустой журнал
+
+    def __init__(self, directory):
+        os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+        base, number = directory, 0
+        self.lock_file = self.lock(directory)
+        while self.lock_file is None:
+            number += 1
+            directory = f"{base}-{number}"
+            self.lock_file = self.lock(directory)
+        self.directory = directory
+        self.previous = directory + ".previous"
+        if os.path.isdir(directory) and os.listdir(directory):
+            shutil.rmtree(self.previous, ignore_errors=True)
+            os.replace(directory, self.previous)
+        os.makedirs(directory, exist_ok=True)
+        self.segment = 0
+        self.bytes = 0            # примерный объём изменений после последнего снимка
+        self.compacted = time.monotonic()
+        self.compacting = None
+        self.recovered = False    # прошлое автосохранение восстановлено: удалить его после следующего снимка
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def lock(directory):
+        # Открытый файл с замком на папку на всё время работы процесса или None, если её держит другой
+        file = open(directory + ".lock", "a+b")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return None
+        return file
+
+    @staticmethod
+    def segment_name(segment):
+        return f"journal-{segment:06d}.log"
+
+    def append(self, changes):
+        for change in changes:
+            self.queue.put(change)
+            self.bytes += 64 + sum(item.nbytes for item in change if isinstance(item, np.ndarray))
+
+    def write_loop(self):
+        file, segment = None, 0
+        while True:
+            items = [self.queue.get()]
+            if items[0] is not None:
+                # Всё, что придёт за это время, уйдёт на диск одним fsync
+                time.sleep(self.FSYNC_INTERVAL)
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            for item in items:
+                if item is None or isinstance(item, threading.Event):
+                    # Конец работы или переход на следующий сегмент: текущий дописан и закрыт
+                    if file is not None:
+                        file.flush()
+                        os.fsync(file.fileno())
+                        file.close()
+                        file = None
+                    if item is None:
+                        return
+                    segment += 1
+                    item.set()
+                    continue
+                if file is None:
+                    file = open(os.path.join(self.directory, self.segment_name(segment)), "ab")
+                file.write(encode_change(item))
+            if file is not None:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def needs_compaction(self):
+        if self.compacting is not None and self.compacting.is_alive():
+            return False
+        return self.bytes > self.COMPACT_BYTES or (self.bytes > 0 and
+                                                   time.monotonic() - self.compacted > self.COMPACT_INTERVAL)
+
+    def compact(self, arrays, meta):
+        # arrays — снимок модели (SessionFile.collect) после всех уже переданных в append изменений
+        if self.compacting is not None:
+            self.compacting.join()  # два снимка сразу писали бы в один временный файл
+        rotated = threading.Event()
+        self.queue.put(rotated)
+        self.segment += 1
+        self.bytes, self.compacted = 0, time.monotonic()
+        self.compacting = threading.Thread(target=self.write_snapshot, daemon=True,
+                                           args=(arrays, dict(meta, journal=self.segment), rotated, self.recovered))
+        self.recovered = False
+        self.compacting.start()
+
+    def write_snapshot(self, arrays, meta, rotated, recovered=False):
+        path = os.path.join(self.directory, self.SNAPSHOT)
+        SessionFile.write(path + ".tmp", arrays, meta, sync=True)
+        os.replace(path + ".tmp", path)
+        if recovered:
+            shutil.rmtree(self.previous, ignore_errors=True)
+        # Старые сегменты удаляем, только когда писатель их закрыл
+        rotated.wait()
+        for name in os.listdir(self.directory):
+            if name.startswith("journal-") and name < self.segment_name(meta["journal"]):
+                os.remove(os.path.join(self.directory, name))
+
+    def close(self, clean=True):
+        # clean=False дописывает журнал и оставляет папку, как после сбоя: её восстановит следующий запуск
+        if self.lock_file.closed:
+            return
+        atexit.unregister(self.close)
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        if self.compacting is not None:
+            self.compacting.join()
+        if clean:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.lock_file.close()
+
+    @classmethod
+    def read(cls, directory):
+        # Путь снимка (или None) и изменения после него по порядку
+        snapshot, first = os.path.join(directory, cls.SNAPSHOT), cls.segment_name(0)
+        if os.path.exists(snapshot):
+            first = cls.segment_name(SessionFile(snapshot).meta["journal"])
+        else:
+            snapshot = None
+        names = sorted(name for name in os.listdir(directory) if name.startswith("journal-") and name >= first)
+        return snapshot, chain.from_iterable(read_journal_segment(os.path.join(directory, name)) for name in names)
+
+class MatrixView:
+    """
+    Матрица смежности в виде таблицы, которая рисует только видимое окно строк и столбцов.
+    Заголовки — номера вершин, порядок строк и ячейки читаются из модели (row_index, has_edge) при каждой
+    перерисовке, поэтому размер матрицы не влияет ни на память, ни на скорость прокрутки.
+    Клик по ячейке вызывает on_cell(u, v).
+    """
+    CELL_WIDTH = 40
+    CELL_HEIGHT = 18
+    HEADER_WIDTH = 60
+    FONT = ("Arial", 8)
+
+    def __init__(self, root, model, on_cell, rows=10):
+        self.model = model
+        self.on_cell = on_cell
+        frame = tk.Frame(root)
+        frame.pack(fill=tk.X)
+        self.canvas = tk.Canvas(frame, bg="white", height=self.CELL_HEIGHT * (rows + 1))
+        self.vbar = tk.Scrollbar(frame, orient=tk.VERTICAL, command=self.yview)
+        self.hbar = tk.Scrollbar(frame, orient=tk.HORIZONTAL, command=self.xview)
+        self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.hbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.nodes = np.zeros(0, dtype=np.int64)  # порядок строк и столбцов на момент последней перерисовки
+        self.first_row = 0
+        self.first_col = 0
+        self.selected = None  # подсвеченная ячейка (u, v)
+        self.shown = False
+        self.dirty = False
+        # Элементы видимого окна живут между перерисовками, меняется только их текст и цвет
+        self.shape = None
+        self.cells = []
+        self.row_headers = []
+        self.col_headers = []
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Button-4>", self.on_wheel)
+        self.canvas.bind("<Button-5>", self.on_wheel)
+
+    def show(self):
+        self.shown = True
+        self.redraw()
+
+    def on_model_changed(self, changes):
+        self.dirty = self.shown
+
+    def refresh(self):
+        if self.dirty:
+            self.redraw()
+
+    def visible_counts(self):
+        # Сколько строк и столбцов помещается целиком; рисуется на одну больше, последняя — частично
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            width, height = int(self.canvas.cget("width")), int(self.canvas.cget("height"))
+        return (max(height // self.CELL_HEIGHT - 1, 1),
+                max((width - self.HEADER_WIDTH) // self.CELL_WIDTH, 1))
+
+    def build_grid(self, rows, cols):
+        self.canvas.delete("all")
+        self.shape = (rows, cols)
+        ch, cw, hw = self.CELL_HEIGHT, self.CELL_WIDTH, self.HEADER_WIDTH
+        self.row_headers = [self.canvas.create_text(hw - 4, ch * (r + 1.5), anchor="e", font=self.FONT)
+                            for r in range(rows)]
+        self.col_headers = [self.canvas.create_text(hw + cw * (c + 0.5), ch / 2, font=self.FONT)
+                            for c in range(cols)]
+        self.cells = [[(self.canvas.create_rectangle(hw + cw * c, ch * (r + 1), hw + cw * (c + 1), ch * (r + 2),
+                                                     outline="lightgray"),
+                        self.canvas.create_text(hw + cw * (c + 0.5), ch * (r + 1.5), font=self.FONT))
+                       for c in range(cols)] for r in range(rows)]
+
+    def redraw(self):
+        self.dirty = False
+        if not self.shown:
+            return
+        self.nodes = self.model.row_index.order()
+        n = len(self.nodes)
+        rows, cols = self.visible_counts()
+        self.first_row = max(0, min(self.first_row, n - rows))
+        self.first_col = max(0, min(self.first_col, n - cols))
+        if self.shape != (rows + 1, cols + 1):
+            self.build_grid(rows + 1, cols + 1)
+        visible_cols = self.nodes[self.first_col:self.first_col + cols + 1].tolist()
+        for header, v in zip(self.col_headers, visible_cols + [""] * (cols + 1 - len(visible_cols))):
+            self.canvas.itemconfigure(header, text=str(v))
+        for r, (header, cells) in enumerate(zip(self.row_headers, self.cells)):
+            i = self.first_row + r
+            u = int(self.nodes[i]) if i < n else None
+            self.canvas.itemconfigure(header, text="" if u is None else str(u))
+            for c, (rect, text) in enumerate(cells):
+                if u is None or c >= len(visible_cols):
+                    self.canvas.itemconfigure(rect, fill="white")
+                    self.canvas.itemconfigure(text, text="")
+                    continue
+                v = visible_cols[c]
+                value = self.model.has_edge(u, v)
+                selected = self.selected == (u, v) or self.selected == (v, u)
+                self.canvas.itemconfigure(rect, fill="gold" if selected else "skyblue" if value else "white")
+                self.canvas.itemconfigure(text, text="1" if value else "0")
+        self.vbar.set(*self.fractions(self.first_row, rows, n))
+        self.hbar.set(*self.fractions(self.first_col, cols, n))
+
+    @staticmethod
+    def fractions(first, visible, total):
+        if total == 0:
+            return 0.0, 1.0
+        return first / total, min(first + visible, total) / total
+
+    def scroll(self, first, visible, args):
+        # Аргументы команды полосы прокрутки: ("moveto", доля) или ("scroll", n, "units" | "pages")
+        if args[0] == "moveto":
+            return int(float(args[1]) * len(self.nodes))
+        step = int(args[1])
+        return first + (step * visible if args[2] == "pages" else step)
+
+    def yview(self, *args):
+        self.first_row = self.scroll(self.first_row, self.visible_counts()[0], args)
+        self.redraw()
+
+    def xview(self, *args):
+        self.first_col = self.scroll(self.first_col, self.visible_counts()[1], args)
+        self.redraw()
+
+    def on_wheel(self, event):
+        # Колесо листает строки, с Shift — столбцы
+        step = -3 if event.num == 4 or getattr(event, "delta", 0) > 0 else 3
+        if event.state & 1:
+            self.xview("scroll", step, "units")
+        else:
+            self.yview("scroll", step, "units")
+
+    def on_click(self, event):
+        r = (event.y - self.CELL_HEIGHT) // self.CELL_HEIGHT
+        c = (event.x - self.HEADER_WIDTH) // self.CELL_WIDTH
+        i, j = self.first_row + r, self.first_col + c
+        if r < 0 or c < 0 or i >= len(self.nodes) or j >= len(self.nodes):
+            return
+        u, v = self.nodes[[i, j]].tolist()
+        self.select(u, v)
+        self.on_cell(u, v)
+
+    def select(self, u, v):
+        self.selected = (u, v)
+        self.redraw()
+
+class Profiler:
+    """
+    Замеры обработчиков и кадров по запросу. wrap(name, func) возвращает обёртку, которая при enabled
+    записывает длительность вызова в мс, а для событий Tk — ещё и задержку от event.time до начала обработки.
+    Счётчики созданных и удалённых элементов холста сбрасываются в frame_done(). Кроме того, можно записывать
+    сессию в cProfile (start_recording/stop_recording). Выключенный профилировщик стоит одну проверку флага.
+    """
+    SAMPLES = 2000  # последних замеров на обработчик
+
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}  # имя -> deque длительностей, мс
+        self.latencies = deque(maxlen=self.SAMPLES)
+        self.latency_base = None  # наименьшая разница часов: event.time идёт по часам X-сервера
+        self.frames = deque(maxlen=120)  # время конца кадра (perf_counter), созданных и удалённых элементов
+        self.created = 0
+        self.deleted = 0
+        self.recording = None
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            event_time = getattr(args[0], "time", None) if args else None
+            if isinstance(event_time, int):
+                self.event_latency(event_time)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, (time.perf_counter() - start) * 1000)
+        return timed
+
+    def record(self, name, ms):
+        samples = self.timings.get(name)
+        if samples is None:
+            samples = self.timings[name] = deque(maxlen=self.SAMPLES)
+        samples.append(ms)
+
+    def event_latency(self, event_time):
+        # Задержка считается относительно самого быстрого обработанного события
+        offset = time.monotonic() * 1000 - event_time
+        if self.latency_base is None or offset < self.latency_base:
+            self.latency_base = offset
+        self.latencies.append(offset - self.latency_base)
+
+    def count_canvas(self, canvas):
+        # Подменяет методы холста счётчиками созданных и удалённых элементов
+        def counting(create):
+            def counted(*args, **kwargs):
+                self.created += self.enabled
+                return create(*args, **kwargs)
+            return counted
+        for name in ("create_line", "create_oval", "create_text", "create_rectangle"):
+            setattr(canvas, name, counting(getattr(canvas, name)))
+        delete = canvas.delete
+        def counted_delete(*items):
+            if self.enabled:
+                self.deleted += sum(len(canvas.find_all()) if item == "all" else 1 for item in items)
+            return delete(*items)
+        canvas.delete = counted_delete
+
+    def frame_done(self):
+        if self.enabled:
+            self.frames.append((time.perf_counter(), self.created, self.deleted))
+            self.created = self.deleted = 0
+
+    def fps(self):
+        if len(self.frames) < 2:
+            return 0.0
+        return (len(self.frames) - 1) / max(self.frames[-1][0] - self.frames[0][0], 1e-9)
+
+    @staticmethod
+    def percentiles(samples):
+        if not samples:
+            return {"count": 0}
+        values = np.fromiter(samples, dtype=np.float64, count=len(samples))
+        p50, p99 = np.percentile(values, [50, 99]).tolist()
+        return {"count": len(values), "p50_ms": round(p50, 3), "p99_ms": round(p99, 3),
+                "max_ms": round(float(values.max()), 3), "total_ms": round(float(values.sum()), 3)}
+
+    def stats(self):
+        return {"fps": round(self.fps(), 1),
+                "handlers": {name: self.percentiles(samples) for name, samples in sorted(self.timings.items())},
+                "latency": self.percentiles(self.latencies),
+                "frames": [{"created": created, "deleted": deleted} for _, created, deleted in self.frames]}
+
+    def hud_text(self):
+        lines = [f"FPS {self.fps():.0f}"]
+        if self.frames:
+            lines.append(f"элементы за кадр: +{self.frames[-1][1]} -{self.frames[-1][2]}")
+        if self.latencies:
+            lat = self.percentiles(self.latencies)
+            lines.append(f"задержка событий p50 {lat['p50_ms']:.1f} p99 {lat['p99_ms']:.1f} мс")
+        for name, samples in sorted(self.timings.items()):
+            st = self.percentiles(samples)
+            lines.append(f"{name}: p50 {st['p50_ms']:.2f} p99 {st['p99_ms']:.2f} мс ({st['count']})")
+        return "\n".join(lines)
+
+    def start_recording(self):
+        import cProfile
+        self.recording = cProfile.Profile()
+        self.recording.enable()
+
+    def stop_recording(self):
+        if self.recording is not None:
+            self.recording.disable()
+
+    def save(self, file_path):
+        # .prof — дамп cProfile записанной сессии (открывается pstats/snakeviz), иначе — статистика в JSON
+        if os.path.splitext(file_path)[1].lower() == ".prof":
+            if self.recording is None:
+                raise ValueError("Сессия cProfile не записывалась (F3)")
+            self.stop_recording()
+            self.recording.dump_stats(file_path)
+        else:
+            with open(file_path, "w") as file:
+                json.dump(self.stats(), file, indent=2)
+
+PROFILE_FILETYPES = [("Stats JSON", "*.json"), ("cProfile dump", "*.prof")]
+
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".graph_editor", "autosave")
 
 class GraphEditor:
-    def __init__(self, root):
+    # Уровни детализации: при масштабе ниже порога перестают рисоваться подписи, затем контрольные точки,
+    # затем сами вершины (остаются только рёбра)
+    LABELS_MIN_SCALE = 0.5
+    CTRL_POINTS_MIN_SCALE = 0.25
+    VERTICES_MIN_SCALE = 0.1
+    ZOOM_STEP = 1.2
+
+    def __init__(self, root, target_fps=60, autosave_dir=AUTOSAVE_DIR):
         self.root = root
         self.root.title("Graph Editor")
         self.canvas = tk.Canvas(root, bg="white", width=800, height=600)
         self.canvas.pack(fill=tk.BOTH, expand=True)
         
-        # Добавляем поле для вывода матрицы и кнопку
-        self.text_output = tk.Text(root, height=10)
-        self.text_output.pack(fill=tk.X)
-        btn_show_matrix = tk.Button(root, text="Показать матрицу", command=self.show_matrix)
-        btn_show_matrix.pack(fill=tk.X)
-        
-        self.graph = nx.Graph()
-        self.vertices = {}
-        self.edges = {}
+        # Граф хранится в модели, редактор только показывает его и переводит события мыши в её методы
+        self.model = GraphModel()
+        self.model.subscribe(self.on_model_changed)
+        # Каждое изменение модели попадает в текущий шаг отмены; закрытый шаг уходит в журнал автосохранения.
+        # autosave_dir=None — без автосохранения (скрипты, замеры)
+        self.history = History()
+        self.model.recorder = self.record_change
+        self.journal = Journal(autosave_dir) if autosave_dir else None
+        self.autosave_pending = None
+        self.snapshot_due = False  # журнал нужно сжать при первой возможности (открыт или сохранён файл)
+
+        # Добавляем таблицу матрицы, кнопку и строку состояния
+        self.matrix_view = MatrixView(root, self.model, self.on_matrix_cell)
+        self.btn_show_matrix = tk.Button(root, text="Показать матрицу", command=self.show_matrix)
+        self.btn_show_matrix.pack(fill=tk.X)
+        self.status = tk.Label(root, anchor="w")
+        self.status.pack(fill=tk.X)
+        # Сохранение и печать матрицы идут в фоне (MatrixJob); пока работа идёт, кнопка показывает прогресс и отменяет её
+        self.matrix_job = None
+        self.highlighted_edge = None
+        # Авто-раскладка (ForceLayout) считается кусками в простое Tk, пока не остынет или её не остановят
+        self.layout = None
+        self.layout_nodes = []
+        self.layout_version = None
+        self.layout_pending = None
+        self.layout_write_time = 0.0
+        self.layout_origin = None  # вершины и их положения до раскладки: вся раскладка — один шаг отмены
+        # Анализ в пуле процессов: задачи получают снимок-массив рёбер, результаты накладываются на холст
+        self.analysis_pool = None
+        self.analysis_jobs = []       # (future, обработчик результата, вершины в порядке строк снимка)
+        # Открываемый файл сессии: первый кусок грузится сразу, остальные — по одному в простое
+        self.session = None
+        self.session_chunk = 0
+        self.session_pending = None
+        self.overlay_edges = {}       # ребро -> цвет: найденный путь и найденный цикл
+        self.overlay_colors = {}      # вершина -> цвет компоненты
         self.drag_data = {"vertex": None, "offset_x": 0, "offset_y": 0,
-                          "edge_ctrl": None, "ctrl_offset_x": 0, "ctrl_offset_y": 0}
-        self.selected_vertices = []
+                          "edge_ctrl": None, "ctrl_offset_x": 0, "ctrl_offset_y": 0,
+                          "group": None, "moved": False}
+        # Выделение — словарь вершина -> None: проверка за O(1) и порядок выделения (ребро e идёт от первой ко второй)
+        self.selected_vertices = {}
+        self.band_start = None  # угол рамки выделения (Shift + ЛКМ) в мировых координатах
+        self.band_item = None
         self.selected_edge_ctrl = None  # кортеж (edge, ctrl_point_index) или None
         self.active_edge = None
+
+        # Элементы холста живут между перерисовками: вершина -> (овал, подпись),
+        # ребро -> [линия пути], ребро -> список овалов контрольных точек.
+        # draw_graph обновляет только то, что помечено в dirty_vertices/dirty_edges.
+        self.vertex_items = {}
+        self.edge_items = {}
+        self.ctrl_items = {}
+        self.dirty_vertices = set()
+        self.dirty_edges = set()
+        # Вид: экранные координаты = мировые * scale + offset. Рисуются только элементы внутри view_rect.
+        self.scale = 1.0
+        self.offset_x = 0.0
+        self.offset_y = 0.0
+        self.view_dirty = True
+        self.view_rect = (0, 0, 0, 0)
+        self.lod = self.level_of_detail()
+        self.pan_anchor = None
+        # Планировщик кадров: изменения только помечают вид, перерисовка идёт не чаще target_fps раз в секунду.
+        # Из событий перетаскивания за кадр применяется только последнее.
+        self.frame_interval = 1 / target_fps
+        self.last_frame = 0
+        self.redraw_pending = None
+        self.pending_drag = None
+        self.frame_stats = {"motion_events": 0, "frames": 0}
+        # Профилирование (F2 — вкл/выкл с HUD, F3 — запись cProfile): обработчики, кадры и поиск оборачиваются
+        # заранее, до привязки к событиям
+        self.profiler = Profiler()
+        self.hud_item = None
+        self.profiler.count_canvas(self.canvas)
+        for name in self.PROFILED_HANDLERS:
+            setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        for name in self.PROFILED_MODEL:
+            setattr(self.model, name, self.profiler.wrap(name, getattr(self.model, name)))
+        self.create_layers()
         
         self.canvas.bind("<Button-1>", self.on_click)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<Shift-Button-1>", self.on_band_start)
+        self.canvas.bind("<Shift-B1-Motion>", self.on_band_drag)
+        self.canvas.bind("<Shift-ButtonRelease-1>", self.on_release)
+        # Масштаб колесом мыши (X11 присылает Button-4/5), сдвиг — перетаскиванием правой или средней кнопкой
+        self.canvas.bind("<MouseWheel>", self.on_zoom)
+        self.canvas.bind("<Button-4>", self.on_zoom)
+        self.canvas.bind("<Button-5>", self.on_zoom)
+        for button in (2, 3):
+            self.canvas.bind(f"<Button-{button}>", self.on_pan_start)
+            self.canvas.bind(f"<B{button}-Motion>", self.on_pan)
+        self.canvas.bind("<Configure>", self.on_view_changed)
         self.root.bind("d", self.delete_vertex)
         self.root.bind("r", self.delete_edge)
         self.root.bind("e", self.start_edge)
+        self.root.bind("p", self.toggle_pin)
+        self.root.bind("l", self.toggle_layout)
+        self.root.bind("<F2>", self.toggle_profiling)
+        self.root.bind("<F3>", self.toggle_recording)
+        self.root.bind("<Control-z>", self.undo)
+        self.root.bind("<Control-y>", self.redo)
+        self.root.bind("<Control-Z>", self.redo)
         self.create_menu()
+        if self.journal is not None:
+            self.autosave_pending = self.root.after(self.AUTOSAVE_INTERVAL, self.autosave_tick)
+            if os.path.isdir(self.journal.previous):
+                self.status.config(text="Есть автосохранение прошлого запуска: File -> Recover Autosave")
         
+    PROFILED_HANDLERS = ("on_click", "on_drag", "on_release", "on_band_start", "on_band_drag", "on_zoom", "on_pan",
+                         "delete_vertex", "delete_edge", "start_edge", "try_add_ctrl_point", "flush_frame", "draw_graph",
+                         "show_matrix", "undo", "redo")
+    PROFILED_MODEL = ("find_nearest_vertex", "find_nearest_ctrl_point", "find_nearest_segment", "adjacency_matrix")
+
+    def to_networkx(self):
+        # Копия графа для скриптов: строится заново при каждом вызове
+        return self.model.to_networkx()
+
+    @property
+    def vertices(self):
+        return self.model.vertices
+
+    @property
+    def edges(self):
+        return self.model.edges
+
+    BULK_CHANGES = 10000
+
+    def on_model_changed(self, changes):
+        # Изменения, пришедшие не из обработчиков событий (например, из скрипта), рисуются один раз в простое.
+        # Крупные пачки (импорт) поштучно не размечаем: sync_viewport перерисует видимое и уже нарисованное.
+        # Сдвиг группы вершин размечается поштучно: запрос видимого раскладывал бы отложенные пути по сетке каждый кадр.
+        if len(changes.vertices) + len(changes.edges) > self.BULK_CHANGES and self.drag_data["group"] is None:
+            self.view_dirty = True
+        else:
+            self.dirty_vertices.update(changes.vertices)
+            self.dirty_edges.update(changes.edges)
+        self.matrix_view.on_model_changed(changes)
+        self.schedule_redraw()
+
+    def schedule_redraw(self):
+        if self.redraw_pending is not None:
+            return
+        delay = self.last_frame + self.frame_interval - time.perf_counter()
+        if delay > 0:
+            self.redraw_pending = self.root.after(int(delay * 1000) + 1, self.flush_frame)
+        else:
+            self.redraw_pending = self.root.after_idle(self.flush_frame)
+
+    def flush_frame(self):
+        # Применяем последнее положение мыши и рисуем всё накопленное одним кадром
+        self.apply_drag()
+        if self.redraw_pending is not None:
+            self.root.after_cancel(self.redraw_pending)
+            self.redraw_pending = None
+        self.draw_graph()
+        self.matrix_view.refresh()
+        self.last_frame = time.perf_counter()
+        self.frame_stats["frames"] += 1
+        self.profiler.frame_done()
+        if self.profiler.enabled:
+            self.draw_hud()
+
+    def record_change(self, change):
+        # Первая правка пользователя посреди раскладки: сделанное раскладкой до неё — отдельный шаг отмены, иначе
+        # отмена раскладки вернула бы и вершины, перетащенные за это время. Модель записывает перемещения до того,
+        # как сдвинуть вершины, поэтому положения в шаге раскладки — ещё без правки
+        if self.layout_origin is not None and not self.history.step:
+            origin, self.layout_origin = self.layout_origin, None
+            origin = self.record_layout_move(origin)
+            self.commit_step()
+            self.layout_origin = origin
+        self.history.record(change)
+
+    def commit_step(self):
+        # Конец действия пользователя: накопленные изменения модели — один шаг отмены и одна пачка в журнале.
+        # Посреди раскладки шаг забирает и то, что она сдвинула, пока шло действие
+        if self.layout_origin is not None and self.history.step:
+            self.layout_origin = self.record_layout_move(self.layout_origin)
+        step = self.history.commit()
+        if self.journal is not None:
+            self.journal.append(step)
+
+    def undo(self, event=None):
+        self.stop_layout()
+        self.commit_step()
+        self.replay(self.history.undo(), "Нечего отменять")
+
+    def redo(self, event=None):
+        self.stop_layout()
+        self.commit_step()
+        self.replay(self.history.redo(), "Нечего повторять")
+
+    def replay(self, changes, empty_text):
+        if changes is None:
+            self.status.config(text=empty_text)
+            return
+        with self.model.batch():
+            for change in changes:
+                self.model.apply(change)
+        if self.journal is not None:
+            self.journal.append(changes)
+        # Выделенное и перетаскиваемое могло исчезнуть вместе с отменённым
+        self.clear_selection()
+        self.status.config(text="")
+        self.schedule_redraw()
+
+    AUTOSAVE_INTERVAL = 1000  # мс между проверками, не пора ли сжать журнал
+
+    def autosave_tick(self):
+        self.autosave_pending = self.root.after(self.AUTOSAVE_INTERVAL, self.autosave_tick)
+        self.compact_journal()
+
+    def compact_journal(self):
+        # Снимок посреди действия или недогруженной сессии разошёлся бы с журналом
+        if self.journal is None or self.history.step or self.session is not None:
+            return
+        if self.snapshot_due or self.journal.needs_compaction():
+            self.snapshot_due = False
+            self.journal.compact(SessionFile.collect(self.model, self.visible_rect()), self.session_meta())
+
+    def recover_autosave(self):
+        # Снимок прошлого запуска и изменения после него применяются к пустому графу; отменить их нельзя
+        if self.journal is None or not os.path.isdir(self.journal.previous):
+            self.status.config(text="Автосохранения прошлого запуска нет")
+            return
+        count = 0
+        self.snapshot_due = False  # снимок снимается один раз, после всего восстановленного
+        try:
+            snapshot, changes = Journal.read(self.journal.previous)
+            if snapshot is not None:
+                self.load_session(snapshot)
+                self.finish_session_load()
+            else:
+                self.reset_graph()
+            for change in changes:
+                if change[0] == "open":
+                    self.load_session(change[1])
+                    self.finish_session_load()
+                else:
+                    self.model.apply(change)
+                count += 1
+        except (OSError, ValueError) as error:
+            self.status.config(text=f"Автосохранение восстановлено не полностью ({count} изменений): {error}")
+        else:
+            self.status.config(text=f"Восстановлено: вершин {len(self.vertices)}, рёбер {len(self.edges)}, "
+                                    f"изменений после снимка {count}")
+            self.journal.recovered = True
+        # Восстановленное не записано в журнал: новый снимок в своей папке заменяет прошлое автосохранение,
+        # а полностью восстановленное прошлое удаляется после этого снимка
+        self.snapshot_due = True
+        self.compact_journal()
+        self.flush_frame()
+
+    def toggle_profiling(self, event=None):
+        self.profiler.enabled = not self.profiler.enabled
+        if self.profiler.enabled:
+            self.draw_hud()
+        elif self.hud_item is not None:
+            self.canvas.delete(self.hud_item)
+            self.hud_item = None
+
+    def toggle_recording(self, event=None):
+        if self.profiler.recording is None:
+            self.profiler.start_recording()
+            self.status.config(text="Запись cProfile… (F3 — стоп, File -> Save Profile)")
+        else:
+            self.profiler.stop_recording()
+            self.status.config(text="Запись cProfile остановлена")
+
+    def draw_hud(self):
+        # Текст в левом верхнем углу окна поверх всех слоёв
+        if self.hud_item is None:
+            self.hud_item = self.canvas.create_text(8, 8, anchor="nw", font=("Courier", 9), fill="darkgreen")
+        self.canvas.itemconfigure(self.hud_item, text=self.profiler.hud_text())
+        self.canvas.tag_raise(self.hud_item)
+
+    def save_profile(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=PROFILE_FILETYPES)
+        if file_path:
+            try:
+                self.profiler.save(file_path)
+            except ValueError as error:
+                self.status.config(text=str(error))
+
+    def redraw_stats(self):
+        stats = dict(self.frame_stats)
+        stats["events_per_frame"] = stats["motion_events"] / max(stats["frames"], 1)
+        return stats
+
+    def to_world(self, sx, sy):
+        return (sx - self.offset_x) / self.scale, (sy - self.offset_y) / self.scale
+
+    def to_screen(self, x, y):
+        return x * self.scale + self.offset_x, y * self.scale + self.offset_y
+
+    def visible_rect(self):
+        # Видимая часть мира; до первого показа окна размер холста берём из его настроек
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            width, height = int(self.canvas.cget("width")), int(self.canvas.cget("height"))
+        return (*self.to_world(0, 0), *self.to_world(width, height))
+
+    def level_of_detail(self):
+        # (подписи, контрольные точки, вершины)
+        return (self.scale >= self.LABELS_MIN_SCALE, self.scale >= self.CTRL_POINTS_MIN_SCALE,
+                self.scale >= self.VERTICES_MIN_SCALE)
+
+    def on_view_changed(self, event=None):
+        self.view_dirty = True
+        self.schedule_redraw()
+
+    def on_zoom(self, event):
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.zoom_at(event.x, event.y, self.ZOOM_STEP if zoom_in else 1 / self.ZOOM_STEP)
+
+    def zoom_at(self, sx, sy, factor):
+        # Точка мира под курсором остаётся на месте
+        x, y = self.to_world(sx, sy)
+        self.scale = min(max(self.scale * factor, 1e-3), 50)
+        self.offset_x = sx - x * self.scale
+        self.offset_y = sy - y * self.scale
+        self.on_view_changed()
+
+    def on_pan_start(self, event):
+        self.pan_anchor = (event.x, event.y)
+
+    def on_pan(self, event):
+        if self.pan_anchor is None:
+            return
+        self.offset_x += event.x - self.pan_anchor[0]
+        self.offset_y += event.y - self.pan_anchor[1]
+        self.pan_anchor = (event.x, event.y)
+        self.on_view_changed()
+
+    JOB_POLL_MS = 50
+
     def show_matrix(self):
-        matrix = nx.to_numpy_array(self.graph).astype(int).tolist()
-        self.text_output.delete("1.0", tk.END)
-        self.text_output.insert(tk.END, str(matrix))
+        self.matrix_view.show()
+
+    def on_matrix_cell(self, u, v):
+        # Клик по ячейке: выделяем обе вершины, подсвечиваем ребро и показываем его на холсте
+        self.clear_selection()
+        self.selected_vertices.update(dict.fromkeys([u, v]))
+        self.dirty_vertices.update(self.selected_vertices)
+        if self.highlighted_edge is not None:
+            self.dirty_edges.add(self.highlighted_edge)
+        self.highlighted_edge = edge_key(u, v) if self.model.has_edge(u, v) else None
+        if self.highlighted_edge is not None:
+            self.dirty_edges.add(self.highlighted_edge)
+        (x1, y1), (x2, y2) = self.vertices[u], self.vertices[v]
+        self.center_on((x1 + x2) / 2, (y1 + y2) / 2)
+
+    def center_on(self, x, y):
+        x0, y0, x1, y1 = self.visible_rect()
+        sx, sy = self.to_screen((x0 + x1) / 2, (y0 + y1) / 2)
+        cx, cy = self.to_screen(x, y)
+        self.offset_x += sx - cx
+        self.offset_y += sy - cy
+        self.on_view_changed()
+
+    def start_matrix_job(self, title, work, on_done=None):
+        # Снимок графа берётся здесь, в Tk-потоке: правки после запуска на работу не влияют
+        matrix = self.model.adjacency_matrix()
+        self.start_job(title, lambda report: work(matrix, report), on_done)
+
+    def start_job(self, title, work, on_done=None):
+        self.cancel_matrix_job()
+        self.status.config(text="")
+        job = MatrixJob(title, work, on_done)
+        self.matrix_job = job.start()
+        self.btn_show_matrix.config(command=self.cancel_matrix_job)
+        self.poll_matrix_job(job)
+
+    def poll_matrix_job(self, job):
+        if job is not self.matrix_job:
+            return
+        if not job.done.is_set():
+            self.btn_show_matrix.config(text=f"{job.title}: {job.progress:.0%} — отменить")
+            self.root.after(self.JOB_POLL_MS, self.poll_matrix_job, job)
+            return
+        self.finish_matrix_job()
+        if job.error is not None:
+            self.status.config(text=f"Ошибка: {job.error}")
+        elif job.on_done is not None:
+            job.on_done(job.result)
+
+    def cancel_matrix_job(self):
+        if self.matrix_job is not None:
+            self.matrix_job.cancel()
+        self.finish_matrix_job()
+
+    def finish_matrix_job(self):
+        self.matrix_job = None
+        self.btn_show_matrix.config(text="Показать матрицу", command=self.show_matrix)
 
     def create_menu(self):
         menu = tk.Menu(self.root)
         self.root.config(menu=menu)
         file_menu = tk.Menu(menu, tearoff=0)
         menu.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="Import Graph", command=self.import_graph)
+        file_menu.add_command(label="Open Session", command=self.open_session)
+        file_menu.add_command(label="Save Session", command=self.save_session)
         file_menu.add_command(label="Save Matrix", command=self.save_matrix)
         file_menu.add_command(label="Print Matrix", command=self.print_matrix)
+        file_menu.add_command(label="Save Profile", command=self.save_profile)
+        file_menu.add_command(label="Recover Autosave", command=self.recover_autosave)
+        edit_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Edit", menu=edit_menu)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=self.undo)
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=self.redo)
+        analysis_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Analysis", menu=analysis_menu)
+        analysis_menu.add_command(label="Shortest Path", command=lambda: self.run_analysis("path"))
+        analysis_menu.add_command(label="Components", command=lambda: self.run_analysis("components"))
+        analysis_menu.add_command(label="Degree Distribution", command=lambda: self.run_analysis("degrees"))
+        analysis_menu.add_command(label="Cycle Check", command=lambda: self.run_analysis("cycles"))
+        analysis_menu.add_command(label="Run All", command=lambda: self.run_analysis("path", "components",
+                                                                                      "degrees", "cycles"))
+        analysis_menu.add_command(label="Clear Overlay", command=self.clear_overlay)
 
     def on_click(self, event):
-        ctrl_hit = self.find_nearest_edge_ctrl_point(event.x, event.y)
+        x, y = self.to_world(event.x, event.y)
+        ctrl_hit = self.find_nearest_edge_ctrl_point(x, y)
         if ctrl_hit is not None:
             edge, idx = ctrl_hit
+            self.clear_selection()
             self.selected_edge_ctrl = (edge, idx)
-            cx, cy = self.edges[edge][idx]
+            self.dirty_edges.add(edge)
+            cx, cy = self.edges.point(edge, idx)
             self.drag_data["edge_ctrl"] = (edge, idx)
-            self.drag_data["ctrl_offset_x"] = cx - event.x
-            self.drag_data["ctrl_offset_y"] = cy - event.y
-            self.selected_vertices.clear()
-            self.draw_graph()
+            self.drag_data["ctrl_offset_x"] = cx - x
+            self.drag_data["ctrl_offset_y"] = cy - y
+            self.schedule_redraw()
             return
         
-        clicked_node = self.find_nearest_vertex(event.x, event.y)
+        clicked_node = self.find_nearest_vertex(x, y)
         if clicked_node is not None:
+            if clicked_node in self.selected_vertices and len(self.selected_vertices) > 1:
+                # Клик по вершине из группы — перетаскивание всей группы; без движения снимет с неё выделение
+                self.drag_data["group"] = (clicked_node, x, y)
+                self.drag_data["moved"] = False
+                return
             if clicked_node not in self.selected_vertices:
-                self.selected_vertices.append(clicked_node)
+                self.selected_vertices[clicked_node] = None
             else:
-                self.selected_vertices.remove(clicked_node)
+                del self.selected_vertices[clicked_node]
+            self.dirty_vertices.add(clicked_node)
             if len(self.selected_vertices) == 1:
                 self.drag_data["vertex"] = clicked_node
-                x, y = self.vertices[clicked_node]
-                self.drag_data["offset_x"] = x - event.x
-                self.drag_data["offset_y"] = y - event.y
-            self.selected_edge_ctrl = None
-            self.draw_graph()
+                vx, vy = self.vertices[clicked_node]
+                self.drag_data["offset_x"] = vx - x
+                self.drag_data["offset_y"] = vy - y
+            self.clear_ctrl_selection()
+            self.schedule_redraw()
             return
 
         # Если кликнули по пустому месту — пытаемся добавить контрольную точку на ребро (если клик близко к ребру)
-        if self.try_add_ctrl_point(event.x, event.y):
-            self.selected_edge_ctrl = None
-            self.selected_vertices.clear()
-            self.draw_graph()
+        if self.try_add_ctrl_point(x, y):
+            self.commit_step()
+            self.clear_selection()
+            self.schedule_redraw()
             return
 
         # Иначе добавляем новую вершину
         if self.active_edge is not None:
             self.active_edge = None
 
-        node_id = len(self.vertices) + 1
-        self.vertices[node_id] = (event.x, event.y)
-        self.graph.add_node(node_id)
-        self.selected_vertices.clear()
-        self.selected_edge_ctrl = None
-        self.draw_graph()
+        self.model.add_vertex(x, y)
+        self.commit_step()
+        self.clear_selection()
+        self.schedule_redraw()
 
     def try_add_ctrl_point(self, x, y, threshold=7):
         """
         Попытка добавить контрольную точку на ребро, если клик близко к одному из сегментов ребра.
-        threshold — максимальное расстояние до сегмента, чтобы считать, что клик по ребру.
+        threshold — максимальное расстояние до сегмента в пикселях экрана, чтобы считать, что клик по ребру.
         """
-        def dist_point_to_segment(px, py, x1, y1, x2, y2):
-            # Расстояние от точки к отрезку
-            line_mag = math.hypot(x2 - x1, y2 - y1)
-            if line_mag < 1e-6:
-                return math.hypot(px - x1, py - y1)
-            u = ((px - x1) * (x2 - x1) + (py - y1) * (y2 - y1)) / (line_mag ** 2)
-            u = max(0, min(1, u))
-            ix = x1 + u * (x2 - x1)
-            iy = y1 + u * (y2 - y1)
-            return math.hypot(px - ix, py - iy), (ix, iy), u
-
-        for (u, v), points in self.edges.items():
-            path = [self.vertices[u]] + points + [self.vertices[v]]
-            for i in range(len(path) - 1):
-                x1, y1 = path[i]
-                x2, y2 = path[i + 1]
-                dist, proj_point, u_param = dist_point_to_segment(x, y, x1, y1, x2, y2)
-                if dist <= threshold:
-                    # Вставляем новую контрольную точку между i-й и (i+1)-й точками пути ребра
-                    # Учтём, что points — список контрольных точек между вершинами
-                    # Индекс вставки в points = i (если i == 0, вставка в начало, если i == len(points), вставка в конец)
-                    insert_index = i if i > 0 else 0
-                    self.edges[(u, v)].insert(insert_index, proj_point)
-                    return True
-        return False
+        hit = self.model.find_nearest_segment(x, y, threshold / self.scale)
+        if hit is None:
+            return False
+        (edge, i), proj_point = hit
+        # Отрезок i принадлежит сглаженному пути; вставляем точку в тот промежуток между точками пути ребра,
+        # где он лежит (0 — перед первой контрольной точкой, len(points) — после последней)
+        insert_index = self.model.ctrl_index_of_segment(edge, i)
+        self.model.insert_ctrl_point(edge, insert_index, proj_point)
+        return True
 
     def on_drag(self, event):
+        # Мышь присылает до 1000 событий в секунду: запоминаем последнее положение, модель меняется раз в кадр
+        if self.drag_data["vertex"] is None and self.drag_data["edge_ctrl"] is None and self.drag_data["group"] is None:
+            return
+        self.frame_stats["motion_events"] += 1
+        self.pending_drag = (event.x, event.y)
+        self.schedule_redraw()
+
+    def apply_drag(self):
+        if self.pending_drag is None:
+            return
+        x, y = self.to_world(*self.pending_drag)
+        self.pending_drag = None
         if self.drag_data["vertex"] is not None:
             node = self.drag_data["vertex"]
-            self.vertices[node] = (event.x + self.drag_data["offset_x"],
-                                  event.y + self.drag_data["offset_y"])
-            self.draw_graph()
+            self.model.move_vertex(node, x + self.drag_data["offset_x"], y + self.drag_data["offset_y"])
+        elif self.drag_data["group"] is not None:
+            # Группа сдвигается одной операцией модели вместе с контрольными точками рёбер внутри неё
+            node, last_x, last_y = self.drag_data["group"]
+            self.model.translate_vertices(self.selected_vertices, x - last_x, y - last_y)
+            self.drag_data["group"] = (node, x, y)
+            self.drag_data["moved"] = True
         elif self.drag_data["edge_ctrl"] is not None:
             edge, idx = self.drag_data["edge_ctrl"]
-            self.edges[edge][idx] = (event.x + self.drag_data["ctrl_offset_x"],
-                                    event.y + self.drag_data["ctrl_offset_y"])
-            self.draw_graph()
+            self.model.move_ctrl_point(edge, idx, x + self.drag_data["ctrl_offset_x"],
+                                       y + self.drag_data["ctrl_offset_y"])
 
     def on_release(self, event):
+        # Отпущенная точка должна встать точно под курсор, не дожидаясь следующего кадра
+        if self.band_start is not None:
+            self.finish_band(event)
+            return
+        if self.pending_drag is not None:
+            self.flush_frame()
+        if self.drag_data["group"] is not None and not self.drag_data["moved"]:
+            node = self.drag_data["group"][0]
+            del self.selected_vertices[node]
+            self.dirty_vertices.add(node)
+            self.schedule_redraw()
         self.drag_data["vertex"] = None
         self.drag_data["edge_ctrl"] = None
+        self.drag_data["group"] = None
+        # Всё перетаскивание — один шаг отмены: кадры сливаются в History.record
+        self.commit_step()
+
+    def on_band_start(self, event):
+        # Shift + ЛКМ: рамка выделения; выделенные вершины добавляются к уже выделенным
+        self.band_start = self.to_world(event.x, event.y)
+        self.band_item = self.canvas.create_rectangle(event.x, event.y, event.x, event.y, dash=(4, 2),
+                                                      outline="gray25")
+
+    def on_band_drag(self, event):
+        if self.band_item is not None:
+            x0, y0 = self.to_screen(*self.band_start)
+            self.canvas.coords(self.band_item, x0, y0, event.x, event.y)
+
+    def finish_band(self, event):
+        x0, y0 = self.band_start
+        x1, y1 = self.to_world(event.x, event.y)
+        self.band_start = None
+        if self.band_item is not None:
+            self.canvas.delete(self.band_item)
+            self.band_item = None
+        if abs(x1 - x0) * self.scale < 3 and abs(y1 - y0) * self.scale < 3:
+            # Рамки почти нет — это Shift-клик: переключаем выделение ближайшей вершины
+            node = self.find_nearest_vertex(x1, y1)
+            if node is None:
+                return
+            if node in self.selected_vertices:
+                del self.selected_vertices[node]
+            else:
+                self.selected_vertices[node] = None
+            nodes = [node]
+        else:
+            nodes = self.model.vertices_in_rect(x0, y0, x1, y1)
+            self.selected_vertices.update(dict.fromkeys(nodes))
+        self.dirty_vertices.update(nodes)
+        self.clear_ctrl_selection()
+        self.status.config(text=f"Выделено вершин: {len(self.selected_vertices)}")
+        self.schedule_redraw()
 
     def start_edge(self, event):
         if len(self.selected_vertices) == 2:
             u, v = self.selected_vertices
             if u != v:
-                self.graph.add_edge(u, v)
-                self.edges[(u, v)] = []
-                self.active_edge = (u, v)
-            self.selected_vertices.clear()
-            self.selected_edge_ctrl = None
-            self.draw_graph()
+                self.active_edge = self.model.add_edge(u, v)
+                self.commit_step()
+            self.clear_selection()
+            self.schedule_redraw()
 
     def delete_vertex(self, event):
         if self.selected_vertices:
-            for node in self.selected_vertices:
-                self.graph.remove_node(node)
-                self.vertices.pop(node, None)
-            # Удаляем рёбра, связанные с удалёнными вершинами
-            self.edges = {e: pts for e, pts in self.edges.items() if all(n not in self.selected_vertices for n in e)}
-            self.selected_vertices.clear()
-            self.selected_edge_ctrl = None
-            self.draw_graph()
+            self.model.remove_vertices(self.selected_vertices)
+            self.commit_step()
+            self.clear_selection()
+            self.schedule_redraw()
+
+    def toggle_pin(self, event=None):
+        # Закрепляет выделенные вершины, а если все они уже закреплены — открепляет
+        if self.selected_vertices:
+            pinned = not all(node in self.model.pinned for node in self.selected_vertices)
+            self.model.pin_vertices(self.selected_vertices, pinned)
+            self.commit_step()
+
+    LAYOUT_BUDGET = 0.03  # секунд счёта раскладки за один заход
+
+    def toggle_layout(self, event=None):
+        if self.layout is None:
+            self.start_layout()
+        else:
+            self.stop_layout()
+
+    def start_layout(self, temperature=None):
+        nodes = self.model.row_index.order().tolist()
+        if not nodes:
+            return
+        coords = self.vertices.coords[self.vertices.slots(nodes)]
+        self.layout = ForceLayout(coords, self.model.incidence())
+        if temperature is not None:
+            self.layout.temperature = temperature
+        self.layout_nodes = nodes
+        self.layout_version = self.model.version
+        # Вершины, появившиеся после запуска, тоже запоминаем: их положение до раскладки — то, с которым добавили
+        nodes = np.array(nodes, dtype=np.int64)
+        if self.layout_origin is None:
+            self.layout_origin = (nodes, coords)
+        else:
+            new = ~np.isin(nodes, self.layout_origin[0])
+            self.layout_origin = (np.concatenate([self.layout_origin[0], nodes[new]]),
+                                  np.concatenate([self.layout_origin[1], coords[new]]))
+        if self.layout_pending is None:
+            self.layout_pending = self.root.after_idle(self.layout_tick)
+
+    def stop_layout(self):
+        if self.layout_pending is not None:
+            self.root.after_cancel(self.layout_pending)
+            self.layout_pending = None
+        self.layout = None
+        self.status.config(text="")
+        if self.layout_origin is not None:
+            self.commit_step()
+            origin, self.layout_origin = self.layout_origin, None
+            self.record_layout_move(origin)
+            self.commit_step()
+
+    def record_layout_move(self, origin):
+        # Раскладка пишется в модель без записи, а в отмену и журнал попадает перемещением от положений origin
+        # до нынешних. Возвращает вершины и положения, от которых отсчитывается её следующее перемещение
+        nodes, coords = origin
+        alive = self.vertices.present(nodes)
+        nodes, coords = nodes[alive], coords[alive]
+        current = self.vertices.coords[self.vertices.slots(nodes)]
+        if not np.array_equal(coords, current):
+            self.history.record(("move", nodes, coords, current))
+        return nodes, current
+
+    def layout_tick(self):
+        self.layout_pending = None
+        if self.model.version != self.layout_version:
+            # Вершины или рёбра изменились: продолжаем с текущих положений и той же температурой
+            self.start_layout(self.layout.temperature)
+            return
+        layout, nodes = self.layout, self.layout_nodes
+        # Закреплённые и перетаскиваемая вершины стоят там, где они в модели
+        held = self.model.pinned | {self.drag_data["vertex"]}
+        if self.drag_data["group"] is not None:
+            held |= set(self.selected_vertices)
+        layout.fixed = np.fromiter((node in held for node in nodes), dtype=bool, count=len(nodes))
+        slots = self.vertices.slots(nodes)
+        layout.pos[layout.fixed] = self.vertices.coords[slots[layout.fixed]]
+        # Считаем не меньше, чем занимает запись в модель, иначе на больших графах запись съедает всё время
+        start = time.perf_counter()
+        while not layout.done() and time.perf_counter() - start < max(self.LAYOUT_BUDGET, self.layout_write_time):
+            layout.step()
+        start = time.perf_counter()
+        free = ~layout.fixed
+        with self.model.unrecorded():
+            self.model.place_vertices([node for node, f in zip(nodes, free) if f], layout.pos[free])
+        self.layout_version = self.model.version
+        self.layout_write_time = time.perf_counter() - start
+        self.status.config(text=f"Раскладка: шаг {layout.iterations}, температура {layout.temperature:.1f} (l — стоп)")
+        if layout.done():
+            self.stop_layout()
+        else:
+            self.layout_pending = self.root.after_idle(self.layout_tick)
 
     def delete_edge(self, event):
         # Удаляем ребро, если выбраны две вершины, между которыми оно есть
         if len(self.selected_vertices) == 2:
             u, v = self.selected_vertices
-            if self.graph.has_edge(u, v):
-                self.graph.remove_edge(u, v)
-                self.edges.pop((u, v), None)
-                self.edges.pop((v, u), None)
-            self.selected_vertices.clear()
-            self.selected_edge_ctrl = None
-            self.draw_graph()
+            if self.model.has_edge(u, v):
+                self.model.remove_edge(u, v)
+                self.commit_step()
+            self.clear_selection()
+            self.schedule_redraw()
         # Или удаляем выделенную контрольную точку ребра (если нужна такая логика)
         elif self.selected_edge_ctrl is not None:
             edge, idx = self.selected_edge_ctrl
-            self.edges[edge].pop(idx)
-            self.selected_edge_ctrl = None
-            self.draw_graph()
+            self.model.remove_ctrl_point(edge, idx)
+            self.commit_step()
+            self.clear_ctrl_selection()
+            self.schedule_redraw()
 
     def find_nearest_vertex(self, x, y):
-        for node, (vx, vy) in self.vertices.items():
-            if (x - vx)**2 + (y - vy)**2 <= 15**2:
-                return node
-        return None
+        # Попадание проверяем по тому же уровню детализации, что и отрисовка: скрытое не кликается
+        if not self.lod[2]:
+            return None
+        return self.model.find_nearest_vertex(x, y)
 
     def find_nearest_edge_ctrl_point(self, x, y, radius=10):
-        for edge, points in self.edges.items():
-            for i, (px, py) in enumerate(points):
-                if (x - px)**2 + (y - py)**2 <= radius**2:
-                    return edge, i
-        return None
+        if not self.lod[1]:
+            return None
+        return self.model.find_nearest_ctrl_point(x, y, radius)
 
-    def draw_graph(self):
+    def clear_selection(self):
+        # Вместе с выделением бросается и перетаскивание: d или r посреди него удаляют то, что тащили
+        self.dirty_vertices.update(self.selected_vertices)
+        self.selected_vertices.clear()
+        self.clear_ctrl_selection()
+        self.drag_data["vertex"] = self.drag_data["edge_ctrl"] = self.drag_data["group"] = None
+        self.pending_drag = None
+
+    def clear_ctrl_selection(self):
+        if self.selected_edge_ctrl is not None:
+            self.dirty_edges.add(self.selected_edge_ctrl[0])
+            self.selected_edge_ctrl = None
+
+    def create_layers(self):
+        # Невидимые маркеры разделяют слои: вершины, под ними отрезки рёбер, поверх всего — контрольные точки.
+        # Новые элементы опускаются под маркер своего слоя, поэтому порядок отрисовки не зависит от порядка создания.
+        self.vertex_layer = self.canvas.create_line(0, 0, 0, 0, state=tk.HIDDEN)
+        self.edge_layer = self.canvas.create_line(0, 0, 0, 0, state=tk.HIDDEN)
+        self.ctrl_layer = self.canvas.create_line(0, 0, 0, 0, state=tk.HIDDEN)
+
+    def clear_items(self):
         self.canvas.delete("all")
-        for node, (x, y) in self.vertices.items():
-            color = "lightgreen" if node in self.selected_vertices else "skyblue"
-            self.canvas.create_oval(x - 15, y - 15, x + 15, y + 15, fill=color, outline="black", width=2)
-            self.canvas.create_text(x, y, text=str(node), font=("Arial", 12, "bold"))
-        for (u, v), points in self.edges.items():
-            x1, y1 = self.vertices[u]
-            x2, y2 = self.vertices[v]
-            path = [(x1, y1)] + points + [(x2, y2)]
-            color = "red" if self.selected_edge_ctrl is not None and self.selected_edge_ctrl[0] == (u,v) else "gray"
-            for p1, p2 in zip(path[:-1], path[1:]):
-                self.canvas.create_line(*p1, *p2, fill=color, width=2)
-            # Рисуем контрольные точки ребра
-            for i, (cx, cy) in enumerate(points):
-                ctrl_color = "orange" if self.selected_edge_ctrl == ((u, v), i) else "black"
-                self.canvas.create_oval(cx - 6, cy - 6, cx + 6, cy + 6, fill=ctrl_color)
+        self.hud_item = None
+        self.band_item = None
+        self.vertex_items.clear()
+        self.edge_items.clear()
+        self.ctrl_items.clear()
+        self.create_layers()
+
+    def redraw_all(self):
+        # Полная перерисовка: сбрасываем все элементы и заново выбираем видимые
+        self.clear_items()
+        self.view_dirty = True
+        self.draw_graph()
+
+    def sync_viewport(self):
+        # Масштаб или сдвиг изменились: перерисовываем то, что видно сейчас, и убираем то, что ушло из вида.
+        # При смене уровня детализации набор элементов у вершин и рёбер другой, поэтому холст строится заново.
+        self.view_dirty = False
+        lod = self.level_of_detail()
+        if lod != self.lod:
+            self.lod = lod
+            self.clear_items()
+        x0, y0, x1, y1 = self.view_rect
+        self.dirty_vertices.update(self.vertex_items)
+        if self.lod[2]:
+            self.dirty_vertices.update(self.model.vertices_in_rect(x0 - 15, y0 - 15, x1 + 15, y1 + 15))
+        self.dirty_edges.update(self.edge_items)
+        self.dirty_edges.update(self.model.edges_in_rect(x0, y0, x1, y1))
+
+    def in_view(self, x0, y0, x1, y1):
+        vx0, vy0, vx1, vy1 = self.view_rect
+        return x0 <= vx1 and x1 >= vx0 and y0 <= vy1 and y1 >= vy0
+
+    def draw_graph(self):
+        self.view_rect = self.visible_rect()
+        if self.view_dirty:
+            self.sync_viewport()
+        for node in self.dirty_vertices:
+            self.draw_vertex(node)
+        for edge in self.edges_to_draw():
+            self.draw_edge(edge)
+        self.dirty_vertices.clear()
+        self.dirty_edges.clear()
+
+    CULL_BATCH = 1000
+
+    def edges_to_draw(self):
+        # Много изменённых рёбер (сдвиг группы): прямые рёбра без элементов на холсте отсеиваются по рамке
+        # одним запросом к массиву координат, draw_edge вызывается только для видимых и уже нарисованных
+        if len(self.dirty_edges) < self.CULL_BATCH:
+            return self.dirty_edges
+        drawn, straight = [], []
+        for edge in self.dirty_edges:
+            if edge in self.edge_items or edge in self.model.geometry:
+                drawn.append(edge)
+            elif edge in self.edges:
+                straight.append(edge)
+        if straight:
+            ends = self.vertices.coords[self.vertices.slots(np.array(straight).ravel())].reshape(-1, 2, 2)
+            (x0, y0), (x1, y1) = ends.min(axis=1).T, ends.max(axis=1).T
+            vx0, vy0, vx1, vy1 = self.view_rect
+            visible = (x0 <= vx1) & (x1 >= vx0) & (y0 <= vy1) & (y1 >= vy0)
+            drawn.extend(straight[i] for i in np.flatnonzero(visible).tolist())
+        return drawn
+
+    def draw_vertex(self, node):
+        items = self.vertex_items.get(node)
+        x, y = self.vertices[node] if node in self.vertices else (None, None)
+        if x is None or not self.lod[2] or not self.in_view(x - 15, y - 15, x + 15, y + 15):
+            if items is not None:
+                self.canvas.delete(*items)
+                del self.vertex_items[node]
+            return
+        x, y = self.to_screen(x, y)
+        r = 15 * self.scale
+        color = "lightgreen" if node in self.selected_vertices else self.overlay_colors.get(node, "skyblue")
+        # Закреплённые вершины (p) обведены толще, раскладка их не двигает
+        outline, width = ("darkred", 4) if node in self.model.pinned else ("black", 2)
+        if items is None:
+            items = [self.canvas.create_oval(x - r, y - r, x + r, y + r, fill=color, outline=outline, width=width)]
+            if self.lod[0]:
+                items.append(self.canvas.create_text(x, y, text=str(node), font=("Arial", 12, "bold")))
+            for item in items:
+                self.canvas.tag_lower(item, self.vertex_layer)
+            self.vertex_items[node] = items
+        else:
+            self.canvas.coords(items[0], x - r, y - r, x + r, y + r)
+            self.canvas.itemconfigure(items[0], fill=color, outline=outline, width=width)
+            if len(items) > 1:
+                self.canvas.coords(items[1], x, y)
+
+    def draw_edge(self, edge):
+        lines = self.edge_items.get(edge, [])
+        ctrls = self.ctrl_items.get(edge, [])
+        path = self.model.edge_path(edge) if edge in self.edges else None
+        if path is None or not self.in_view(*path.min(axis=0), *path.max(axis=0)):
+            self.canvas.delete(*lines, *ctrls)
+            self.edge_items.pop(edge, None)
+            self.ctrl_items.pop(edge, None)
+            return
+        # Ребро — одна линия по всем точкам пути (сплайн уже сглажен в модели)
+        screen = (path * self.scale + (self.offset_x, self.offset_y)).ravel().tolist()
+        points = [self.to_screen(x, y) for x, y in self.edges[edge]] if self.lod[1] else []
+        r = 6 * self.scale
+        if self.selected_edge_ctrl is not None and self.selected_edge_ctrl[0] == edge:
+            color = "red"
+        else:
+            color = "blue" if edge == self.highlighted_edge else self.overlay_edges.get(edge, "gray")
+        self.edge_items[edge] = self.sync_items(
+            lines, [screen], [color],
+            lambda c, fill: self.canvas.create_line(*c, fill=fill, width=2),
+            self.edge_layer)
+        # Рисуем контрольные точки ребра
+        self.ctrl_items[edge] = self.sync_items(
+            ctrls, [(cx - r, cy - r, cx + r, cy + r) for cx, cy in points],
+            ["orange" if self.selected_edge_ctrl == (edge, i) else "black" for i in range(len(points))],
+            lambda c, fill: self.canvas.create_oval(*c, fill=fill),
+            self.ctrl_layer)
+
+    def sync_items(self, items, coords, fills, create, layer):
+        # Переиспользуем существующие элементы, недостающие создаём, лишние удаляем
+        for item, c, fill in zip(items, coords, fills):
+            self.canvas.coords(item, *c)
+            self.canvas.itemconfigure(item, fill=fill)
+        if len(items) > len(coords):
+            self.canvas.delete(*items[len(coords):])
+            return items[:len(coords)]
+        items = list(items)
+        for c, fill in zip(coords[len(items):], fills[len(items):]):
+            item = create(c, fill)
+            self.canvas.tag_lower(item, layer)
+            items.append(item)
+        return items
 
     def save_matrix(self):
-        matrix = nx.to_numpy_matrix(self.graph).tolist()
-        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=MATRIX_FILETYPES)
         if file_path:
-            with open(file_path, "w") as file:
-                json.dump(matrix, file, indent=2)
+            self.start_matrix_job("Сохранение", lambda matrix, report: matrix.save(file_path, report))
+
+    def import_graph(self):
+        # Файл разбирается в фоне, вершины и рёбра добавляются в модель одним пакетом уже в Tk-потоке
+        file_path = filedialog.askopenfilename(filetypes=GRAPH_FILETYPES)
+        if file_path:
+            self.start_job("Импорт", lambda report: read_graph(file_path, report), self.add_imported)
+
+    def add_imported(self, imported):
+        n, points, edges = imported
+        if points is None:
+            # Без координат кладём граф сеткой справа от уже нарисованного
+            bbox = self.vertices.bounding_box()
+            points = grid_layout(n, origin=(bbox[2] + 100, bbox[1]) if bbox else (50, 50))
+        self.model.load(points, edges)
+        self.commit_step()
+        self.status.config(text=f"Импортировано вершин: {n}, рёбер: {len(edges)}")
+
+    def save_session(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".graphsession", filetypes=SESSION_FILETYPES)
+        if file_path:
+            # Недогруженная сессия сохранилась бы без хвоста
+            self.finish_session_load()
+            self.commit_step()
+            SessionFile.save(file_path, self.model, self.visible_rect(), self.session_meta())
+            self.status.config(text=f"Сессия сохранена: вершин {len(self.vertices)}, рёбер {len(self.edges)}")
+            # Файл мог заменить тот, на который ссылается "open" в журнале: журнал начинается заново со снимка
+            self.snapshot_due = True
+            self.compact_journal()
+
+    def session_meta(self):
+        return {"next_id": self.model.next_id, "scale": self.scale, "offset_x": self.offset_x, "offset_y": self.offset_y}
+
+    def open_session(self):
+        file_path = filedialog.askopenfilename(filetypes=SESSION_FILETYPES)
+        if file_path:
+            self.load_session(file_path)
+            # Журнал не копирует файл, а ссылается на него, пока файл не догружен: после этого журнал
+            # сжимается, и восстановление уже не зависит от того, что потом станет с файлом
+            if self.journal is not None:
+                self.journal.append([("open", os.path.abspath(file_path))])
+                self.snapshot_due = True
+                self.compact_journal()
+
+    def reset_graph(self):
+        # Пустой граф на месте текущего; прежние правки отменить уже нельзя
+        if self.session_pending is not None:
+            self.root.after_cancel(self.session_pending)
+            self.session_pending = None
+        self.session = None
+        self.stop_layout()
+        self.commit_step()
+        self.history.clear()
+        self.clear_selection()
+        self.clear_overlay()
+        self.highlighted_edge = None
+        self.model.clear()
+        self.clear_items()
+
+    def load_session(self, file_path):
+        # Файл только отображается в память; видимый при сохранении кусок рисуется сразу, остальные догружаются
+        session = SessionFile(file_path)
+        self.reset_graph()
+        self.model.next_id = session.meta["next_id"]
+        self.scale = session.meta["scale"]
+        self.offset_x, self.offset_y = session.meta["offset_x"], session.meta["offset_y"]
+        self.session, self.session_chunk = session, 0
+        self.on_view_changed()
+        if session.chunks:
+            self.load_session_chunk()
+        else:
+            self.session = None
+        self.flush_frame()
+
+    def load_session_chunk(self):
+        self.session_pending = None
+        session = self.session
+        self.model.load_chunk(*session.chunk(self.session_chunk))
+        self.session_chunk += 1
+        if self.session_chunk < session.chunks:
+            self.status.config(text=f"Загрузка сессии: {self.session_chunk}/{session.chunks}")
+            self.session_pending = self.root.after_idle(self.load_session_chunk)
+        else:
+            self.session = None
+            self.status.config(text=f"Сессия загружена: вершин {len(self.vertices)}, рёбер {len(self.edges)}")
+            if self.snapshot_due:
+                self.compact_journal()
+
+    def finish_session_load(self):
+        while self.session is not None:
+            if self.session_pending is not None:
+                self.root.after_cancel(self.session_pending)
+            self.load_session_chunk()
+
+    COMPONENT_COLORS = ["gold", "plum", "lightsalmon", "palegreen", "lightblue", "khaki", "pink", "aquamarine"]
+
+    def run_analysis(self, *kinds):
+        # Снимок — номера строк и массив рёбер из кеша модели; задачи идут в пуле параллельно
+        nodes = self.model.row_index.order().tolist()
+        edges = self.model.incidence()
+        rows = self.model.row_index.rows
+        if self.analysis_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.analysis_pool = ProcessPoolExecutor()
+        for kind in kinds:
+            if kind == "path":
+                if len(self.selected_vertices) != 2:
+                    self.status.config(text="Для пути выделите две вершины")
+                    continue
+                u, v = self.selected_vertices
+                future = self.analysis_pool.submit(analyze_shortest_path, len(nodes), edges, rows[u], rows[v])
+                handler = self.show_path
+            else:
+                future = self.analysis_pool.submit(
+                    {"components": analyze_components, "degrees": analyze_degrees, "cycles": analyze_cycles}[kind],
+                    len(nodes), edges)
+                handler = getattr(self, "show_" + kind)
+            if not self.analysis_jobs:
+                self.root.after(self.JOB_POLL_MS, self.poll_analysis)
+            self.analysis_jobs.append((future, handler, nodes))
+
+    def poll_analysis(self):
+        pending = []
+        for job in self.analysis_jobs:
+            future, handler, nodes = job
+            if not future.done():
+                pending.append(job)
+            elif future.exception() is not None:
+                self.status.config(text=f"Ошибка анализа: {future.exception()}")
+            else:
+                handler(future.result(), nodes)
+        self.analysis_jobs = pending
+        if pending:
+            self.root.after(self.JOB_POLL_MS, self.poll_analysis)
+
+    def set_overlay_edges(self, color, path, closed=False):
+        # Путь (или цикл при closed) заменяет прежний путь того же цвета
+        self.dirty_edges.update(self.overlay_edges)
+        self.overlay_edges = {edge: c for edge, c in self.overlay_edges.items() if c != color}
+        pairs = zip(path, path[1:] + path[:1] if closed else path[1:])
+        self.overlay_edges.update((edge_key(u, v), color) for u, v in pairs)
+        self.dirty_edges.update(self.overlay_edges)
+        self.schedule_redraw()
+
+    def show_path(self, path, nodes):
+        if path is None:
+            self.status.config(text="Пути между выделенными вершинами нет")
+            return
+        self.set_overlay_edges("magenta", [nodes[i] for i in path])
+        self.status.config(text=f"Кратчайший путь: {len(path) - 1} рёбер")
+
+    def show_components(self, labels, nodes):
+        # Большие компоненты получают свои цвета, остальные — по кругу палитры
+        self.dirty_vertices.update(self.overlay_colors)
+        colors = self.COMPONENT_COLORS
+        self.overlay_colors = {node: colors[label % len(colors)] for node, label in zip(nodes, labels.tolist())}
+        self.dirty_vertices.update(self.overlay_colors)
+        self.schedule_redraw()
+        self.status.config(text=f"Компонент связности: {int(labels.max()) + 1 if len(labels) else 0}")
+
+    def show_degrees(self, histogram, nodes):
+        degrees = np.arange(len(histogram))
+        mean = (degrees * histogram).sum() / max(len(nodes), 1)
+        top = ", ".join(f"{d}: {c}" for d, c in zip(degrees.tolist(), histogram.tolist()) if c)
+        self.status.config(text=f"Средняя степень {mean:.2f}; степень: число вершин — {top}")
+
+    def show_cycles(self, result, nodes):
+        rank, cycle = result
+        if cycle is None:
+            self.status.config(text="Циклов нет: граф — лес")
+            return
+        self.set_overlay_edges("darkorange", [nodes[i] for i in cycle], closed=True)
+        self.status.config(text=f"Независимых циклов: {rank}, показан цикл из {len(cycle)} вершин")
+
+    def clear_overlay(self):
+        self.dirty_edges.update(self.overlay_edges)
+        self.overlay_edges = {}
+        self.dirty_vertices.update(self.overlay_colors)
+        self.overlay_colors = {}
+        self.schedule_redraw()
 
     def print_matrix(self):
-        matrix = nx.to_numpy_matrix(self.graph).tolist()
-        print(matrix)
+        self.start_matrix_job("Печать", lambda matrix, report: print(self.model.adjacency_text(matrix, report)))
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,533 @@
+# Замеры производительности редактора графов
+# Запуск: python benchmark.py redraw [--sizes 100 1000 10000]
+#         python benchmark.py save [--sizes 10000 100000]
+#         python benchmark.py session [--edges 1000000] [--vertices 200000]
+#         python benchmark.py journal [--sizes 10000 100000 1000000] [--group 1000]
+#         python benchmark.py startup [--repeats 5] [--preload networkx]
+#         python benchmark.py suite [--output result.json] [--baseline baseline.json] [--update-baseline]
+# Для redraw нужен дисплей; на сервере без него — xvfb-run python benchmark.py redraw.
+# startup без дисплея меряет только импорт, время до первого кадра — при наличии окна.
+# suite без дисплея меряет те же операции на GraphModel, а draw_graph пропускает.
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tkinter as tk
+import tracemalloc
+
+import numpy as np
+
+EDITOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "25.05.17. Изображение и матрица смежности графа.py")
+
+
+def load_editor():
+    # Имя файла редактора не является допустимым именем модуля, поэтому грузим его по пути
+    spec = importlib.util.spec_from_file_location("graph_editor", EDITOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_grid(model, n, step=40):
+    # Решётка из n вершин, соседи по строке и столбцу соединены рёбрами
+    side = max(1, int(n ** 0.5))
+    with model.batch():
+        nodes = model.add_vertices((20 + (i % side) * step, 20 + (i // side) * step) for i in range(n))
+        model.add_edges((node, other) for i, node in enumerate(nodes)
+                        for other in (nodes[i + 1] if (i + 1) % side and i + 1 < n else None,
+                                      nodes[i + side] if i + side < n else None)
+                        if other is not None)
+
+
+def make_random_sparse(model, n, degree=4, ctrl_points=0, seed=None):
+    # Случайные вершины на квадрате со стороной ~40 * sqrt(n) и около n * degree / 2 рёбер
+    rng = random.Random(n if seed is None else seed)
+    size = 40 * max(1, int(n ** 0.5))
+    with model.batch():
+        nodes = model.add_vertices((rng.uniform(0, size), rng.uniform(0, size)) for _ in range(n))
+        edges = set()
+        for _ in range(n * degree // 2):
+            u, v = rng.sample(nodes, 2) if n > 1 else (nodes[0], nodes[0])
+            if u != v and (v, u) not in edges:
+                edges.add((u, v))
+        model.add_edges((u, v, make_ctrl_points(model, u, v, ctrl_points, rng)) for u, v in edges)
+
+
+def make_ctrl_points(model, u, v, count, rng):
+    # Контрольные точки вдоль отрезка u-v со случайным боковым смещением
+    (x1, y1), (x2, y2) = model.vertices[u], model.vertices[v]
+    return [(x1 + (x2 - x1) * k / (count + 1) + rng.uniform(-10, 10),
+             y1 + (y2 - y1) * k / (count + 1) + rng.uniform(-10, 10)) for k in range(1, count + 1)]
+
+
+def make_clique(model, n):
+    # Полный граф на окружности
+    import math
+    radius = 20 * n / math.pi + 20
+    with model.batch():
+        nodes = model.add_vertices((radius + radius * math.cos(2 * math.pi * i / n),
+                                    radius + radius * math.sin(2 * math.pi * i / n)) for i in range(n))
+        model.add_edges((nodes[i], nodes[j]) for i in range(n) for j in range(i + 1, n))
+
+
+# Генераторы синтетических графов и предельное число вершин для каждого (полный граф растёт как n^2)
+GENERATORS = {
+    "grid": (make_grid, None),
+    "random_sparse": (make_random_sparse, None),
+    "clique": (make_clique, 300),
+    "ctrl_points": (lambda model, n: make_random_sparse(model, n, degree=2, ctrl_points=5), None),
+}
+
+
+def bench_redraw(editor, sizes, repeats):
+    print(f"{'vertices':>10} {'full draw, ms':>15} {'drag redraw, ms':>17}")
+    for n in sizes:
+        root = tk.Tk()
+        app = editor.GraphEditor(root, autosave_dir=None)
+        make_grid(app.model, n)
+        start = time.perf_counter()
+        app.redraw_all()
+        root.update_idletasks()
+        full = time.perf_counter() - start
+
+        # Перетаскивание одной вершины: на каждом шаге одно событие <B1-Motion> и перерисовка
+        node = n // 2 + 1
+        x, y = app.vertices[node]
+        app.drag_data["vertex"] = node
+        start = time.perf_counter()
+        for i in range(repeats):
+            app.on_drag(type("Event", (), {"x": x + i % 20, "y": y})())
+            app.flush_frame()
+            root.update_idletasks()
+        drag = (time.perf_counter() - start) / repeats
+        root.destroy()
+        print(f"{n:>10} {full * 1000:>15.1f} {drag * 1000:>17.3f}")
+
+
+def random_sparse_matrix(editor, n, degree):
+    # Случайный разреженный граф без networkx: n вершин, около n * degree / 2 рёбер
+    rng = random.Random(n)
+    adjacency = {node: set() for node in range(1, n + 1)}
+    for _ in range(n * degree // 2):
+        u, v = rng.randint(1, n), rng.randint(1, n)
+        if u != v:
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+    return editor.AdjacencyMatrix(adjacency, adjacency)
+
+
+# Оценка размера файла, байт на ячейку плотной матрицы: форматы крупнее --max-bytes пропускаются
+DENSE_FORMAT_BYTES = {".json": 2, ".npy": 1 / 8}
+
+
+def bench_save(editor, sizes, degree, max_bytes):
+    print(f"{'vertices':>10} {'format':>6} {'write, s':>10} {'size, MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            matrix = random_sparse_matrix(editor, n, degree)
+            for ext in (".json", ".npy", ".npz", ".txt"):
+                estimate = DENSE_FORMAT_BYTES.get(ext, 0) * n * n
+                if estimate > max_bytes:
+                    print(f"{n:>10} {ext:>6} {'skipped':>10} {estimate / 2 ** 20:>9.0f}~")
+                    continue
+                path = os.path.join(tmp, "matrix" + ext)
+                start = time.perf_counter()
+                matrix.save(path)
+                elapsed = time.perf_counter() - start
+                print(f"{n:>10} {ext:>6} {elapsed:>10.2f} {os.path.getsize(path) / 2 ** 20:>10.2f}")
+                os.remove(path)
+
+
+def bench_import(editor, edges, vertices, locality):
+    # Список рёбер на диске -> read_graph -> GraphModel.load; соседи вершины лежат в пределах locality номеров
+    rng = np.random.default_rng(edges)
+    u = rng.integers(0, vertices, edges)
+    v = (u + rng.integers(1, locality + 1, edges)) % vertices
+    print(f"{'edges':>10} {'read, s':>8} {'load, s':>8} {'vertices':>10} {'edges':>10} {'B/vertex':>9} {'B/edge':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "graph.txt")
+        with open(path, "w") as file:
+            for start in range(0, edges, 65536):
+                file.write("".join(f"{a} {b}\n" for a, b in zip(u[start:start + 65536].tolist(),
+                                                                 v[start:start + 65536].tolist())))
+        start = time.perf_counter()
+        n, points, pairs = editor.read_graph(path)
+        read_time = time.perf_counter() - start
+        model = editor.GraphModel()
+        start = time.perf_counter()
+        model.load(editor.grid_layout(n), pairs)
+        load_time = time.perf_counter() - start
+        memory = model.memory_usage()
+        print(f"{edges:>10} {read_time:>8.2f} {load_time:>8.2f} {len(model.vertices):>10} {len(model.edges):>10} "
+              f"{memory['per_vertex']:>9.0f} {memory['per_edge']:>7.0f}")
+
+
+def bench_session(editor, edges, vertices, locality):
+    # Сохранение сессии и открытие: время до первого (видимого) куска и до конца догрузки
+    rng = np.random.default_rng(edges)
+    u = rng.integers(0, vertices, edges)
+    v = (u + rng.integers(1, locality + 1, edges)) % vertices
+    model = editor.GraphModel()
+    model.load(editor.grid_layout(vertices), np.stack([u, v], axis=1))
+    meta = {"next_id": model.next_id, "scale": 1.0, "offset_x": 0, "offset_y": 0}
+    print(f"{'edges':>10} {'save, s':>8} {'MB':>7} {'open, ms':>9} {'first view, ms':>15} {'all, s':>7} {'chunks':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "graph.graphsession")
+        start = time.perf_counter()
+        editor.SessionFile.save(path, model, (0, 0, 800, 600), meta)
+        save_time = time.perf_counter() - start
+        loaded = editor.GraphModel()
+        start = time.perf_counter()
+        session = editor.SessionFile(path)
+        open_time = time.perf_counter() - start
+        loaded.load_chunk(*session.chunk(0))
+        first_time = time.perf_counter() - start
+        for k in range(1, session.chunks):
+            loaded.load_chunk(*session.chunk(k))
+        all_time = time.perf_counter() - start
+        assert len(loaded.edges) == len(model.edges)
+        print(f"{len(model.edges):>10} {save_time:>8.2f} {os.path.getsize(path) / 2 ** 20:>7.1f} "
+              f"{open_time * 1000:>9.1f} {first_time * 1000:>15.1f} {all_time:>7.2f} {session.chunks:>7}")
+
+
+def bench_journal(editor, sizes, group):
+    # Отмена и повтор должны стоить O(размера изменения): сдвиг и удаление группы из group вершин на графах
+    # разного размера; плюс снимок для сжатия журнала — захват в Tk-потоке и запись в фоне
+    print(f"{'edges':>10} {'move undo, ms':>14} {'delete, ms':>11} {'undo, ms':>9} {'redo, ms':>9} "
+          f"{'journal, KB':>12} {'capture, s':>11} {'snapshot, s':>12}")
+    for edges in sizes:
+        vertices = max(edges // 5, group)
+        rng = np.random.default_rng(edges)
+        u = rng.integers(0, vertices, edges)
+        v = (u + rng.integers(1, 51, edges)) % vertices
+        model = editor.GraphModel()
+        nodes = model.load(editor.grid_layout(vertices), np.stack([u, v], axis=1))
+        total = len(model.edges)
+        history = editor.History()
+        model.recorder = history.record
+        history.commit()
+        chosen = rng.choice(nodes, group, replace=False).tolist()
+        for _ in range(10):
+            model.translate_vertices(chosen, 1.0, 1.0)
+        history.commit()
+        start = time.perf_counter()
+        for change in history.undo():
+            model.apply(change)
+        move_undo = time.perf_counter() - start
+        start = time.perf_counter()
+        model.remove_vertices(chosen)
+        step = history.commit()
+        delete_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for change in history.undo():
+            model.apply(change)
+        undo_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for change in history.redo():
+            model.apply(change)
+        redo_time = time.perf_counter() - start
+        journal_bytes = sum(len(editor.encode_change(change)) for change in step)
+        start = time.perf_counter()
+        arrays = editor.SessionFile.collect(model, (0, 0, 800, 600))
+        capture_time = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            editor.SessionFile.write(os.path.join(tmp, "snapshot.graphsession"), arrays, {}, sync=True)
+            snapshot_time = time.perf_counter() - start
+        print(f"{total:>10} {move_undo * 1000:>14.2f} {delete_time * 1000:>11.1f} "
+              f"{undo_time * 1000:>9.1f} {redo_time * 1000:>9.1f} {journal_bytes / 1024:>12.1f} "
+              f"{capture_time:>11.2f} {snapshot_time:>12.2f}")
+
+
+# Выполняется в отдельном интерпретаторе: время импорта редактора и (если есть дисплей) до первого кадра от старта
+STARTUP_SCRIPT = """
+import importlib, importlib.util, sys, time
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    importlib.import_module(name)
+spec = importlib.util.spec_from_file_location("graph_editor", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter() - start
+try:
+    root = module.tk.Tk()
+except module.tk.TclError:
+    print(imported, -1)
+else:
+    app = module.GraphEditor(root, autosave_dir=None)
+    root.update()
+    print(imported, time.perf_counter() - start)
+    root.destroy()
+"""
+
+
+def parse_importtime(stderr, top=10):
+    # Строки -X importtime: "import time: собственное | накопленное | имя"; собственное время суммируется
+    # по корневому пакету (numpy.core -> numpy), мс
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(own) / 1000
+    return sorted(((ms, package) for package, ms in totals.items()), reverse=True)[:top]
+
+
+def bench_startup(repeats, preload):
+    # Холодный старт: запуск интерпретатора, импорт редактора, первый кадр. preload — модули, импортируемые
+    # заранее (например, networkx), чтобы сравнить с прежним жадным импортом
+    command = [sys.executable, "-c", STARTUP_SCRIPT, EDITOR_PATH, *preload]
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout.split()
+        runs.append((time.perf_counter() - start, float(output[0]), float(output[1])))
+    process, imported, first_frame = (statistics.median(column) for column in zip(*runs))
+    print(f"{'process, ms':>12} {'import, ms':>11} {'first frame, ms':>16}")
+    print(f"{process * 1000:>12.1f} {imported * 1000:>11.1f} "
+          f"{first_frame * 1000 if first_frame >= 0 else float('nan'):>16.1f}")
+    profile = subprocess.run([sys.executable, "-X", "importtime", *command[1:]], capture_output=True, text=True)
+    print(f"\n{'import, ms':>15}  package (-X importtime)")
+    for ms, package in parse_importtime(profile.stderr):
+        print(f"{ms:>15.1f}  {package}")
+
+
+def measure(func, min_time=0.2, max_calls=10000):
+    # Повторяет func, пока не наберётся min_time секунд, и возвращает число операций в секунду
+    calls, start = 0, time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or calls >= max_calls:
+            return calls / elapsed
+
+
+def measure_peak(func):
+    # Пиковый прирост памяти (МБ) за один вызов func
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def open_display():
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    return root
+
+
+def suite_ops(app, model, root, rng, tmp):
+    # Операции редактора; без дисплея (app is None) — их эквиваленты на GraphModel
+    nodes = list(model.vertices)
+    edges = list(model.edges)
+    box = model.vertices.bounding_box()
+
+    def random_point():
+        return rng.uniform(box[0], box[2]), rng.uniform(box[1], box[3])
+
+    def near_vertex():
+        x, y = model.vertices[rng.choice(nodes)]
+        return x + rng.uniform(-10, 10), y + rng.uniform(-10, 10)
+
+    def near_edge():
+        if not edges:
+            return random_point()
+        edge = rng.choice(edges)
+        (x1, y1), (x2, y2) = model.vertices[edge[0]], model.vertices[edge[1]]
+        t = rng.uniform(0.3, 0.7)
+        return x1 + (x2 - x1) * t, y1 + (y2 - y1) * t
+
+    def draw_graph():
+        model.move_vertex(rng.choice(nodes), *random_point())
+        app.draw_graph()
+        root.update_idletasks()
+
+    def try_add_ctrl_point():
+        # Без дисплея — то же, что GraphEditor.try_add_ctrl_point при масштабе 1: отрезок сглаженного пути
+        # переводится в промежуток между контрольными точками
+        x, y = near_edge()
+        if app is not None:
+            app.try_add_ctrl_point(x, y)
+            return
+        hit = model.find_nearest_segment(x, y)
+        if hit is not None:
+            (edge, i), point = hit
+            model.insert_ctrl_point(edge, model.ctrl_index_of_segment(edge, i), point)
+
+    # Удаляется не больше десятой части вершин, чтобы граф не успел заметно уменьшиться
+    victims = rng.sample(nodes, max(2, len(nodes) // 10))
+
+    def delete_vertex():
+        node = victims.pop()
+        if app is not None:
+            app.selected_vertices = {node: None}
+            app.delete_vertex(None)
+        else:
+            model.remove_vertices([node])
+
+    def show_matrix():
+        # Кнопка "Показать матрицу": таблица рисует видимое окно строк и столбцов
+        app.matrix_view.shown = False
+        app.show_matrix()
+        root.update_idletasks()
+
+    def print_matrix():
+        # Полная работа фоновой задачи Print Matrix (снимок матрицы и её текст) с пустым кешем производных
+        model.cache.clear()
+        model.adjacency_text(model.adjacency_matrix())
+
+    def save_matrix():
+        model.cache.clear()
+        model.adjacency_matrix().save(os.path.join(tmp, "matrix.npz"))
+
+    # Операция -> (функция, наибольшее число вызовов); удаление меняет граф, поэтому идёт последним.
+    # Текст матрицы для больших графов считается долго, для него хватает одного вызова.
+    return {
+        "draw_graph": (draw_graph if app is not None else None, 10000),
+        "find_nearest_vertex": (lambda: model.find_nearest_vertex(*near_vertex()), 10000),
+        "find_nearest_edge_ctrl_point": (lambda: model.find_nearest_ctrl_point(*near_vertex()), 10000),
+        "try_add_ctrl_point": (try_add_ctrl_point, 10000),
+        "show_matrix": (show_matrix if app is not None else None, 10000),
+        "print_matrix": (print_matrix, 1),
+        "print_matrix_cached": (lambda: model.adjacency_text(model.adjacency_matrix()), 10000),
+        "save_matrix": (save_matrix, 1),
+        "delete_vertex": (delete_vertex, len(victims) - 1),
+    }
+
+
+def run_suite(editor, sizes, generators, min_time):
+    root = open_display()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in generators:
+            make, limit = GENERATORS[name]
+            for n in sizes:
+                if limit is not None and n > limit:
+                    continue
+                app = editor.GraphEditor(tk.Toplevel(root), autosave_dir=None) if root is not None else None
+                model = app.model if app is not None else editor.GraphModel()
+                start = time.perf_counter()
+                build_peak = measure_peak(lambda: make(model, n))
+                build_time = time.perf_counter() - start
+                if app is not None:
+                    app.redraw_all()
+                case = {"graph": name, "vertices": len(model.vertices), "edges": len(model.edges),
+                        "build_s": round(build_time, 3), "build_peak_mb": round(build_peak, 2),
+                        "store_bytes": model.memory_usage(), "ops": {}}
+                rng = random.Random(n)
+                for op, (func, max_calls) in suite_ops(app, model, root, rng, tmp).items():
+                    if func is None:
+                        case["ops"][op] = None
+                        continue
+                    ops_per_sec = measure(func, min_time, max_calls)
+                    case["ops"][op] = {"ops_per_sec": round(ops_per_sec, 2), "peak_mb": round(measure_peak(func), 2)}
+                case["cache"] = model.cache.stats()
+                print(f"{name} n={n}: " + ", ".join(f"{op}={r['ops_per_sec']:.1f}/s" for op, r in case["ops"].items()
+                                                    if r is not None), file=sys.stderr)
+                results.append(case)
+                if app is not None:
+                    app.root.destroy()
+    if root is not None:
+        root.destroy()
+    return {"environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "display": root is not None},
+            "results": results}
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    # Регрессия — падение ops/sec больше чем на tolerance относительно базовой линии
+    old = {(c["graph"], c["vertices"], op): r["ops_per_sec"]
+           for c in baseline["results"] for op, r in c["ops"].items() if r is not None}
+    regressions = []
+    for case in report["results"]:
+        for op, r in case["ops"].items():
+            key = (case["graph"], case["vertices"], op)
+            if r is not None and key in old and r["ops_per_sec"] < old[key] * (1 - tolerance):
+                regressions.append({"graph": key[0], "vertices": key[1], "op": op,
+                                    "baseline": old[key], "current": r["ops_per_sec"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности редактора графов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    redraw = commands.add_parser("redraw", help="полная перерисовка и перерисовка при перетаскивании")
+    redraw.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    redraw.add_argument("--repeats", type=int, default=200)
+    save = commands.add_parser("save", help="время записи и размер файла для каждого формата матрицы")
+    save.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    save.add_argument("--degree", type=int, default=4)
+    save.add_argument("--max-bytes", type=float, default=4 * 2 ** 30)
+    imp = commands.add_parser("import", help="чтение списка рёбер и пакетная загрузка в модель")
+    imp.add_argument("--edges", type=int, default=1000000)
+    imp.add_argument("--vertices", type=int, default=200000)
+    imp.add_argument("--locality", type=int, default=50)
+    session = commands.add_parser("session", help="сохранение сессии и открытие: первый вид и полная догрузка")
+    session.add_argument("--edges", type=int, default=1000000)
+    session.add_argument("--vertices", type=int, default=200000)
+    session.add_argument("--locality", type=int, default=50)
+    journal = commands.add_parser("journal", help="отмена и повтор на графах разного размера, снимок автосохранения")
+    journal.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    journal.add_argument("--group", type=int, default=1000)
+    startup = commands.add_parser("startup", help="холодный старт: импорт модулей и время до первого кадра")
+    startup.add_argument("--repeats", type=int, default=5)
+    startup.add_argument("--preload", nargs="+", default=[], help="модули, импортируемые до редактора")
+    suite = commands.add_parser("suite", help="горячие операции редактора на синтетических графах, отчёт в JSON")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    suite.add_argument("--graphs", nargs="+", choices=list(GENERATORS), default=list(GENERATORS))
+    suite.add_argument("--min-time", type=float, default=0.2)
+    suite.add_argument("--output", help="куда записать отчёт (по умолчанию stdout)")
+    suite.add_argument("--baseline", help="отчёт, с которым сравнивать")
+    suite.add_argument("--update-baseline", action="store_true", help="записать отчёт в --baseline")
+    suite.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.command == "startup":
+        bench_startup(args.repeats, args.preload)
+        return
+    editor = load_editor()
+    if args.command == "redraw":
+        bench_redraw(editor, args.sizes, args.repeats)
+    elif args.command == "save":
+        bench_save(editor, args.sizes, args.degree, args.max_bytes)
+    elif args.command == "import":
+        bench_import(editor, args.edges, args.vertices, args.locality)
+    elif args.command == "session":
+        bench_session(editor, args.edges, args.vertices, args.locality)
+    elif args.command == "journal":
+        bench_journal(editor, args.sizes, args.group)
+    else:
+        report = run_suite(editor, args.sizes, args.graphs, args.min_time)
+        if args.baseline and not args.update_baseline and os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                report["regressions"] = compare_with_baseline(report, json.load(file), args.tolerance)
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(text)
+        else:
+            print(text)
+        if args.baseline and args.update_baseline:
+            with open(args.baseline, "w") as file:
+                file.write(text)
+        if report.get("regressions"):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
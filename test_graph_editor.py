@@ -0,0 +1,321 @@
+# Проверки редактора графов: экспорт и импорт, файл сессии, отмена и повтор, журнал автосохранения
+# Запуск: python -m pytest -q test_graph_editor.py
+# Проверки GraphEditor создают окно Tk и без дисплея пропускаются (xvfb-run python -m pytest -q).
+
+import os
+import random
+import tkinter as tk
+
+import numpy as np
+import pytest
+
+from benchmark import load_editor, make_random_sparse
+
+editor = load_editor()
+
+META = {"next_id": 1, "scale": 1.0, "offset_x": 0, "offset_y": 0}
+
+
+def snapshot(model):
+    # Состояние модели для сравнения: вершины, рёбра с точками, закреплённые, соседи и то, что видят индексы
+    vertices = {node: model.vertices[node] for node in model.vertices}
+    edges = {edge: model.edges[edge] for edge in model.edges}
+    neighbors = {node: sorted(model.adjacency.neighbors(node)) for node in vertices}
+    big = 1e7
+    return {"vertices": vertices, "edges": edges, "pinned": set(model.pinned), "neighbors": neighbors,
+            "vertex_index": sorted(model.vertices_in_rect(-big, -big, big, big)),
+            "segment_index": set(model.edges_in_rect(-big, -big, big, big))}
+
+
+def make_graph(seed=1):
+    # Случайный граф с целыми координатами (сдвиги туда и обратно в float32 точны), точками на рёбрах и закреплёнными
+    rng = random.Random(seed)
+    model = editor.GraphModel()
+    nodes = model.add_vertices((rng.randrange(1000), rng.randrange(1000)) for _ in range(60))
+    for _ in range(120):
+        u, v = rng.sample(nodes, 2)
+        points = [(rng.randrange(1000), rng.randrange(1000)) for _ in range(rng.choice((0, 0, 1, 3)))]
+        model.add_edge(u, v, points)
+    model.pin_vertices(rng.sample(nodes, 5))
+    return model
+
+
+def random_action(model, rng):
+    # Одно действие пользователя над моделью; координаты и сдвиги целые
+    nodes = list(model.vertices)
+    edges = list(model.edges)
+    kind = rng.choice(("add_vertex", "add_edge", "remove_vertices", "remove_edge", "move_vertex", "translate",
+                       "insert_point", "move_point", "remove_point", "pin", "load"))
+    if kind == "add_vertex" or len(nodes) < 3:
+        model.add_vertex(rng.randrange(1000), rng.randrange(1000))
+    elif kind == "add_edge":
+        model.add_edge(*rng.sample(nodes, 2), [(rng.randrange(1000), rng.randrange(1000))] * rng.randrange(2))
+    elif kind == "remove_vertices":
+        model.remove_vertices(rng.sample(nodes, rng.randint(1, 3)))
+    elif kind == "remove_edge" and edges:
+        model.remove_edge(*rng.choice(edges))
+    elif kind == "move_vertex":
+        model.move_vertex(rng.choice(nodes), rng.randrange(1000), rng.randrange(1000))
+    elif kind == "translate":
+        model.translate_vertices(rng.sample(nodes, rng.randint(1, 10)), rng.randint(-50, 50), rng.randint(-50, 50))
+    elif kind == "pin":
+        model.pin_vertices(rng.sample(nodes, 2), rng.random() < 0.5)
+    elif kind == "load":
+        model.load([(rng.randrange(1000), rng.randrange(1000)) for _ in range(5)], [(0, 1), (1, 2), (3, 4)])
+    elif edges:
+        edge = rng.choice(edges)
+        count = model.edges.count(edge)
+        if kind == "insert_point":
+            model.insert_ctrl_point(edge, rng.randint(0, count), (rng.randrange(1000), rng.randrange(1000)))
+        elif kind == "move_point" and count:
+            model.move_ctrl_point(edge, rng.randrange(count), rng.randrange(1000), rng.randrange(1000))
+        elif kind == "remove_point" and count:
+            model.remove_ctrl_point(edge, rng.randrange(count))
+
+
+def load_session_file(path):
+    # Все куски файла сессии в новую модель, как их догружает редактор
+    session = editor.SessionFile(path)
+    model = editor.GraphModel()
+    model.next_id = session.meta["next_id"]
+    for k in range(session.chunks):
+        model.load_chunk(*session.chunk(k))
+    return model
+
+
+def replay(snapshot_path, changes):
+    model = load_session_file(snapshot_path) if snapshot_path else editor.GraphModel()
+    for change in changes:
+        model.apply(change)
+    return model
+
+
+def export_import(model, path):
+    # Матрицу модели в файл и обратно: число вершин и рёбра в номерах вершин модели, меньший первым
+    model.adjacency_matrix().save(path)
+    n, points, edges = editor.read_graph(path)
+    assert points is None
+    if path.endswith(".txt"):
+        # Строки списка рёбер — в порядке первого появления вершины в файле
+        with open(path) as file:
+            nodes = list(map(int, dict.fromkeys(file.read().split())))
+    else:
+        nodes = model.row_index.order()
+    assert n == len(nodes)
+    return n, {editor.edge_key(nodes[u], nodes[v]) for u, v in edges.tolist()}, edges
+
+
+@pytest.mark.parametrize("ext", [".json", ".npz", ".txt"])
+def test_export_import_round_trip(tmp_path, ext):
+    model = editor.GraphModel()
+    make_random_sparse(model, 200, seed=3)
+    model.add_vertex(5, 5)
+    n, edges, rows = export_import(model, str(tmp_path / f"graph{ext}"))
+    # Вершин без рёбер в списке рёбер нет
+    isolated = sum(not model.adjacency.neighbors(node) for node in model.vertices)
+    assert n == len(model.vertices) - (isolated if ext == ".txt" else 0)
+    assert edges == set(model.edges)
+    # Импортированный граф (как GraphEditor.add_imported) экспортируется так же
+    other = editor.GraphModel()
+    other.load(np.zeros((n, 2)), rows)
+    n2, edges2, _ = export_import(other, str(tmp_path / f"again{ext}"))
+    assert n2 == n
+    assert edges2 == set(other.edges)
+    assert len(edges2) == len(edges)
+
+
+def test_import_rejects_edges_outside_vertices(tmp_path):
+    # Неквадратная матрица: у двух строк столбец 2 — такой вершины нет
+    path = tmp_path / "graph.json"
+    path.write_text("[[0,1,1],[1,0,1]]")
+    with pytest.raises(ValueError):
+        editor.read_graph(str(path))
+    with pytest.raises(ValueError):
+        editor.GraphModel().load(np.zeros((2, 2)), [(0, 2)])
+
+
+def test_session_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(editor.SessionFile, "CHUNK_VERTICES", 7)
+    model = make_graph()
+    path = str(tmp_path / "graph.graphsession")
+    meta = dict(META, next_id=model.next_id, scale=2.5)
+    editor.SessionFile.save(path, model, (100, 100, 400, 400), meta)
+    session = editor.SessionFile(path)
+    assert session.chunks > 2
+    assert session.meta == meta
+    loaded = load_session_file(path)
+    assert snapshot(loaded) == snapshot(model)
+    # Кусок с вершинами, которые уже есть, не загружается
+    with pytest.raises(ValueError):
+        loaded.load_chunk(*session.chunk(0))
+    assert snapshot(loaded) == snapshot(model)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_undo_redo(seed):
+    rng = random.Random(seed)
+    model = make_graph(seed)
+    history = editor.History()
+    model.recorder = history.record
+    states = [snapshot(model)]  # states[i] — после i закрытых шагов
+    position = 0
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.5:
+            random_action(model, rng)
+            if history.commit():
+                del states[position + 1:]
+                states.append(snapshot(model))
+                position += 1
+        else:
+            changes = history.undo() if action < 0.8 else history.redo()
+            if changes is None:
+                continue
+            for change in changes:
+                model.apply(change)
+            position += -1 if action < 0.8 else 1
+        assert snapshot(model) == states[position]
+    while position:
+        for change in history.undo():
+            model.apply(change)
+        position -= 1
+        assert snapshot(model) == states[position]
+
+
+def test_journal_recovery(tmp_path):
+    rng = random.Random(7)
+    model = make_graph()
+    history = editor.History()
+    model.recorder = history.record
+    journal = editor.Journal(str(tmp_path / "autosave"))
+    journal.compact(editor.SessionFile.collect(model, (0, 0, 1000, 1000)), dict(META, next_id=model.next_id))
+    for _ in range(100):
+        random_action(model, rng)
+        journal.append(history.commit())
+    journal.compact(editor.SessionFile.collect(model, (0, 0, 1000, 1000)), dict(META, next_id=model.next_id))
+    for _ in range(100):
+        random_action(model, rng)
+        journal.append(history.commit())
+    before_last = snapshot(model)
+    model.move_vertex(next(iter(model.vertices)), -10, -10)
+    journal.append(history.commit())
+    journal.close(clean=False)  # файлы остаются, как после сбоя
+    assert snapshot(replay(*editor.Journal.read(journal.directory))) == snapshot(model)
+
+    # Оборванная при сбое последняя запись отбрасывается, всё до неё восстанавливается
+    names = sorted(name for name in os.listdir(journal.directory) if name.startswith("journal-"))
+    last = os.path.join(journal.directory, names[-1])
+    os.truncate(last, os.path.getsize(last) - 3)
+    assert snapshot(replay(*editor.Journal.read(journal.directory))) == before_last
+
+
+def test_journal_clean_close(tmp_path):
+    # После обычного выхода восстанавливать нечего; после сбоя журнал переезжает в .previous и остаётся там,
+    # пока его не восстановят, даже если следующий запуск закрылся как обычно
+    directory = str(tmp_path / "autosave")
+    model = make_graph()
+    history = editor.History()
+    model.recorder = history.record
+    journal = editor.Journal(directory)
+    model.add_vertex(1, 1)
+    journal.append(history.commit())
+    journal.close()
+    journal = editor.Journal(directory)
+    assert not os.path.exists(journal.previous)
+    model.add_vertex(2, 2)
+    journal.append(history.commit())
+    journal.close(clean=False)
+    journal = editor.Journal(directory)
+    assert len(list(editor.Journal.read(journal.previous)[1])) == 1
+    journal.close()
+    assert not os.path.exists(directory)
+    journal = editor.Journal(directory)
+    assert os.path.isdir(journal.previous)
+    journal.close()
+
+
+def test_journal_lock(tmp_path):
+    directory = str(tmp_path / "autosave")
+    first = editor.Journal(directory)
+    second = editor.Journal(directory)
+    assert (first.directory, second.directory) == (directory, directory + "-1")
+    first.close()
+    third = editor.Journal(directory)
+    assert third.directory == directory
+    second.close()
+    third.close()
+
+
+@pytest.fixture
+def root():
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        pytest.skip(f"нет дисплея: {error}")
+    root.withdraw()
+    yield root
+    root.destroy()
+
+
+def test_recover_after_open_save_crash(tmp_path, root, monkeypatch):
+    # Открыли файл, правили, сохранили поверх него, правили дальше и упали: восстановление не должно
+    # применять журнал после сохранения к уже перезаписанному файлу
+    path = str(tmp_path / "graph.graphsession")
+    model = make_graph()
+    editor.SessionFile.save(path, model, (0, 0, 1000, 1000), dict(META, next_id=model.next_id))
+    monkeypatch.setattr(editor.filedialog, "askopenfilename", lambda **kw: path)
+    monkeypatch.setattr(editor.filedialog, "asksaveasfilename", lambda **kw: path)
+    directory = str(tmp_path / "autosave")
+    app = editor.GraphEditor(root, autosave_dir=directory)
+    app.open_session()
+    app.model.add_vertex(300, 300)
+    app.commit_step()
+    app.save_session()
+    app.model.add_vertex(400, 100)
+    app.model.remove_vertices([next(iter(app.vertices))])
+    app.commit_step()
+    expected = snapshot(app.model)
+    app.journal.close(clean=False)
+
+    recovered = editor.GraphEditor(root, autosave_dir=directory)
+    assert recovered.journal.directory == directory
+    recovered.recover_autosave()
+    assert snapshot(recovered.model) == expected
+    recovered.journal.close()
+    # Восстановленное попало в новый снимок, прошлое автосохранение больше не предлагается
+    assert not os.path.exists(recovered.journal.previous)
+
+
+def test_layout_undo_keeps_user_edits(root, monkeypatch):
+    # Вершину перетащили, пока шла раскладка: отмена раскладки не должна возвращать её на место до перетаскивания
+    app = editor.GraphEditor(root, autosave_dir=None)
+    monkeypatch.setattr(app, "LAYOUT_BUDGET", 0.0005)
+    rng = np.random.default_rng(2)
+    app.model.load(rng.random((400, 2)) * 500, rng.integers(0, 400, (800, 2)))
+    app.commit_step()
+
+    def positions():
+        return {node: app.vertices[node] for node in app.vertices}
+
+    states = [positions()]
+    app.start_layout()
+    for _ in range(3):
+        app.layout_tick()
+    states.append(positions())
+    assert app.layout is not None
+    node = next(iter(app.vertices))
+    app.model.move_vertex(node, 10, 10)
+    app.layout_tick()
+    app.model.move_vertex(node, 20, 20)
+    app.commit_step()
+    states.append(positions())
+    for _ in range(3):
+        app.layout_tick()
+    app.stop_layout()
+    states.append(positions())
+    for state in reversed(states[:-1]):
+        app.undo()
+        assert positions() == state
+    for state in states[1:]:
+        app.redo()
+        assert positions() == state